@@ -3,16 +3,31 @@
 u"""Backend
 
 Inspired by Frontera Backend
+Storage of the frontier links: pages to crawl and crawled pages, as WeightedLinks
+  MemoryBackend: not saved, eg. tests and benchmarks
+  WorkbookBackend: in memory, journaled in the crawl workbook (Pages to crawl, Crawled pages worksheets)
+  SQLiteBackend: in an sqlite database next to the workbook, the pages to crawl and crawled pages are not kept in memory
+    the other tables of the frontier (validators, fingerprints, ignored pages, revisits...) still are
+Operations are batched: they take and return lists of links or urls
+Life Cycle: see main
 """
 
-__usage__ = u"""TODO - Usage: python3 backend.py [options] [url]
+__usage__ = u"""Usage: python3 backend.py [options]
+
+Benchmark the backends on the same batched operations:
+  add, contains, pop, remove of the pages to crawl, add and contains of the crawled pages
 
 Options:
   -h, --help              show this help
+  -n ..., --links=...     links, default: 100000
+  -B ..., --batch=...     links per operation, default: 100
+  -b ..., --backend=...   backend benchmarked (memory, workbook, sqlite), default: all
+  -p ..., --path=...      path of the workbook and database, default: a temporary directory
   -d                      show debugging information
 
 Examples:
   python3 backend.py
+  python3 backend.py -n 1000000 -b sqlite -p /tmp/bench
 """
 
 __author__ = u"M0t13y"
@@ -21,39 +36,495 @@ __date__ = u"$Date: 2021/14/01 06:15:00 $"
 __copyright__ = u"Copyright [" + __author__ + "]"
 __license__ = u"Licensed under the Apache License, Version 2.0"
 
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+
+from settings import HTML_SUBDIR, WORKBOOK, BACKEND, DEFAULT_WEIGHT
+from link import WeightedLink
+from scheduler import IndexedHeap
+
+def link_weight(weighted_link):
+    """
+    Return the weight of a weighted link as a float
+
+    Weights loaded from a workbook may be empty
+    """
+    try:
+        return float(weighted_link.weight)
+    except (TypeError, ValueError):
+        return DEFAULT_WEIGHT
+
+class Backend(ABC):
+    """
+    Backend
+
+    Links to crawl are popped highest weight first, equal weights in insertion order.
+    Popped links are in progress: they stay to crawl until removed (crawled, failed, blocked),
+    add or requeue makes them poppable again.
+    Life Cycle: see main
+    """
+    name = None
+
+    @abstractmethod
+    def add(self, links):
+        """
+        Add links to crawl, replace the links already there (weight, notes...)
+        """
+
+    @abstractmethod
+    def remove(self, urls):
+        """
+        Remove links to crawl, return the removed links
+        """
+
+    @abstractmethod
+    def get(self, urls):
+        """
+        Return the links to crawl of urls: {url: WeightedLink}
+        """
+
+    def contains(self, urls):
+        """
+        Return the set of urls to crawl
+        """
+        return set(self.get(urls))
+
+    @abstractmethod
+    def pop(self, n):
+        """
+        Return up to n links to crawl, highest weight first, they are in progress
+        """
+
+    @abstractmethod
+    def requeue(self, urls):
+        """
+        Make popped links poppable again, eg. retries
+        """
+
+    @abstractmethod
+    def __len__(self):
+        """
+        Links to crawl, in progress included
+        """
+
+    @abstractmethod
+    def queued(self):
+        """
+        Links to crawl not in progress
+        """
+
+    @abstractmethod
+    def add_done(self, links):
+        """
+        Add crawled links
+        """
+
+    @abstractmethod
+    def remove_done(self, urls):
+        """
+        Remove crawled links, return the removed links
+        """
+
+    @abstractmethod
+    def contains_done(self, urls):
+        """
+        Return the set of crawled urls
+        """
+
+    @abstractmethod
+    def done_count(self):
+        """
+        Number of crawled links
+        """
+
+    @abstractmethod
+    def clear_done(self):
+        """
+        Remove all crawled links, return them
+        """
+
+    def flush(self):
+        """
+        Make the operations durable
+        """
+        pass
+
+    def close(self):
+        self.flush()
+
+class MemoryBackend(Backend):
+    """
+    Memory Backend
+
+    Life Cycle: see main
+    """
+    name = u'memory'
+    # links to crawl {url: WeightedLink}
+    links = None
+    # links to crawl not in progress, keyed by url
+    queue = None
+    # crawled links {url: WeightedLink}
+    done = None
+
+    def __init__(self):
+        self.links = {}
+        self.queue = IndexedHeap()
+        self.done = {}
+
+    def add(self, links):
+        for wl in links:
+            self.links[wl.url] = wl
+            self.queue.push(wl.url, wl, link_weight(wl))
+
+    def remove(self, urls):
+        removed = []
+        for url in urls:
+            wl = self.links.pop(url, None)
+            if wl is not None:
+                self.queue.remove(url)
+                removed.append(wl)
+        return removed
+
+    def get(self, urls):
+        return {url: self.links[url] for url in urls if url in self.links}
+
+    def pop(self, n):
+        popped = []
+        while self.queue and len(popped) < n:
+            popped.append(self.queue.pop()[1])
+        return popped
+
+    def requeue(self, urls):
+        for url in urls:
+            wl = self.links.get(url)
+            if wl is not None and url not in self.queue:
+                self.queue.push(url, wl, link_weight(wl))
+
+    def __len__(self):
+        return len(self.links)
+
+    def queued(self):
+        return len(self.queue)
+
+    def add_done(self, links):
+        for wl in links:
+            self.done[wl.url] = wl
+
+    def remove_done(self, urls):
+        return [wl for wl in (self.done.pop(url, None) for url in urls) if wl is not None]
+
+    def contains_done(self, urls):
+        return {url for url in urls if url in self.done}
+
+    def done_count(self):
+        return len(self.done)
+
+    def clear_done(self):
+        done = list(self.done.values())
+        self.done = {}
+        return done
+
+class WorkbookBackend(MemoryBackend):
+    """
+    Workbook Backend
+
+    The links are kept in memory and journaled in the crawl workbook,
+    the journal is synced by the frontier (CrawlWorkbook.wb_save)
+    Life Cycle: see main
+    """
+    name = u'workbook'
+    crawl_book = None
+
+    def __init__(self, crawl_book):
+        super().__init__()
+        self.crawl_book = crawl_book
+        self.tocrawl_wsname = WORKBOOK['crawler']['worksheet']['tocrawlpages']['TITLE']
+        self.crawled_wsname = WORKBOOK['crawler']['worksheet']['crawledpages']['TITLE']
+        MemoryBackend.add(self, crawl_book.weighted_links)
+        MemoryBackend.add_done(self, crawl_book.weighted_links_done)
+
+    def add(self, links):
+        links = list(links)
+        super().add(links)
+        for wl in links:
+            self.crawl_book.ws_writeln(self.tocrawl_wsname, wl)
+
+    def remove(self, urls):
+        removed = super().remove(urls)
+        for wl in removed:
+            self.crawl_book.ws_removeln(self.tocrawl_wsname, wl.url)
+        return removed
+
+    def add_done(self, links):
+        links = list(links)
+        super().add_done(links)
+        for wl in links:
+            self.crawl_book.ws_writeln(self.crawled_wsname, wl)
+
+    def remove_done(self, urls):
+        removed = super().remove_done(urls)
+        for wl in removed:
+            self.crawl_book.ws_removeln(self.crawled_wsname, wl.url)
+        return removed
+
+    def clear_done(self):
+        done = super().clear_done()
+        for wl in done:
+            self.crawl_book.ws_removeln(self.crawled_wsname, wl.url)
+        return done
+
+class SQLiteBackend(Backend):
+    """
+    SQLite Backend
+
+    Links to crawl are popped with the (popped, weight, seq) index,
+    links in progress when the crawler stopped are poppable again on open
+    Operations are committed on flush
+    Life Cycle: see main
+    """
+    name = u'sqlite'
+    file_name = u''
+    db = None
+    batch_size = BACKEND['SQLITE']['BATCH_SIZE']
+    # sizes, counted once on open then kept up to date
+    n_links = 0
+    n_queued = 0
+    n_done = 0
+    # insertion counter, keeps equal weights FIFO
+    seq = 0
+
+    def __init__(self, file_name, batch_size=BACKEND['SQLITE']['BATCH_SIZE']):
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(file_name)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('PRAGMA cache_size = %d' % BACKEND['SQLITE']['CACHE_SIZE'])
+        self.db.execute('CREATE TABLE IF NOT EXISTS tocrawl (url TEXT PRIMARY KEY, title TEXT, date TEXT, '
+                        'weight REAL, notes TEXT, seq INTEGER, popped INTEGER NOT NULL DEFAULT 0)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tocrawl_queue ON tocrawl (popped, weight DESC, seq)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS crawled (url TEXT PRIMARY KEY, title TEXT, date TEXT, '
+                        'weight REAL, notes TEXT)')
+        self.db.execute('UPDATE tocrawl SET popped = 0 WHERE popped = 1')
+        self.db.commit()
+        self.n_links, self.seq = self.db.execute('SELECT COUNT(*), COALESCE(MAX(seq), 0) FROM tocrawl').fetchone()
+        self.n_queued = self.n_links
+        self.n_done = self.db.execute('SELECT COUNT(*) FROM crawled').fetchone()[0]
+
+    @staticmethod
+    def row(wl):
+        date = wl.date if wl.date is None or isinstance(wl.date, str) else str(wl.date)
+        return (wl.url, wl.title, date, link_weight(wl), wl.notes)
+
+    def select(self, columns, table, urls):
+        """
+        Yield the rows of urls, batch_size urls per query
+        """
+        urls = list(urls)
+        for start in range(0, len(urls), self.batch_size):
+            batch = urls[start:start + self.batch_size]
+            yield from self.db.execute('SELECT %s FROM %s WHERE url IN (%s)' % (columns, table, ','.join('?' * len(batch))),
+                                       batch)
+
+    def add(self, links):
+        links = list({wl.url: wl for wl in links}.values())
+        popped = dict(self.select('url, popped', 'tocrawl', [wl.url for wl in links]))
+        self.n_links += len(links) - len(popped)
+        self.n_queued += len(links) - sum(1 for state in popped.values() if not state)
+        rows = []
+        for wl in links:
+            self.seq += 1
+            rows.append(SQLiteBackend.row(wl) + (self.seq,))
+        self.db.executemany('INSERT INTO tocrawl (url, title, date, weight, notes, seq) VALUES (?, ?, ?, ?, ?, ?) '
+                            'ON CONFLICT (url) DO UPDATE SET title = excluded.title, date = excluded.date, '
+                            'weight = excluded.weight, notes = excluded.notes, popped = 0', rows)
+
+    def remove(self, urls):
+        removed = []
+        for url, title, date, weight, notes, popped in self.select('url, title, date, weight, notes, popped', 'tocrawl', urls):
+            removed.append(WeightedLink(url=url, title=title, date=date, weight=weight, notes=notes))
+            self.n_queued -= not popped
+        self.n_links -= len(removed)
+        self.db.executemany('DELETE FROM tocrawl WHERE url = ?', [(wl.url,) for wl in removed])
+        return removed
+
+    def get(self, urls):
+        return {url: WeightedLink(url=url, title=title, date=date, weight=weight, notes=notes)
+                for url, title, date, weight, notes in self.select('url, title, date, weight, notes', 'tocrawl', urls)}
+
+    def contains(self, urls):
+        return {url for url, in self.select('url', 'tocrawl', urls)}
+
+    def pop(self, n):
+        popped = [WeightedLink(url=url, title=title, date=date, weight=weight, notes=notes)
+                  for url, title, date, weight, notes in self.db.execute(
+                      'SELECT url, title, date, weight, notes FROM tocrawl WHERE popped = 0 '
+                      'ORDER BY weight DESC, seq LIMIT ?', (n,))]
+        self.db.executemany('UPDATE tocrawl SET popped = 1 WHERE url = ?', [(wl.url,) for wl in popped])
+        self.n_queued -= len(popped)
+        return popped
+
+    def requeue(self, urls):
+        cursor = self.db.executemany('UPDATE tocrawl SET popped = 0 WHERE url = ? AND popped = 1', [(url,) for url in urls])
+        self.n_queued += max(cursor.rowcount, 0)
+
+    def __len__(self):
+        return self.n_links
+
+    def queued(self):
+        return self.n_queued
+
+    def add_done(self, links):
+        links = list({wl.url: wl for wl in links}.values())
+        self.n_done += len(links) - len(self.contains_done([wl.url for wl in links]))
+        self.db.executemany('INSERT OR REPLACE INTO crawled (url, title, date, weight, notes) VALUES (?, ?, ?, ?, ?)',
+                            [SQLiteBackend.row(wl) for wl in links])
+
+    def remove_done(self, urls):
+        removed = [WeightedLink(url=url, title=title, date=date, weight=weight, notes=notes)
+                   for url, title, date, weight, notes in self.select('url, title, date, weight, notes', 'crawled', urls)]
+        self.db.executemany('DELETE FROM crawled WHERE url = ?', [(wl.url,) for wl in removed])
+        self.n_done -= len(removed)
+        return removed
+
+    def contains_done(self, urls):
+        return {url for url, in self.select('url', 'crawled', urls)}
+
+    def done_count(self):
+        return self.n_done
+
+    def clear_done(self):
+        done = [WeightedLink(url=url, title=title, date=date, weight=weight, notes=notes)
+                for url, title, date, weight, notes in self.db.execute('SELECT url, title, date, weight, notes FROM crawled')]
+        self.db.execute('DELETE FROM crawled')
+        self.n_done = 0
+        return done
+
+    def flush(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+BACKENDS = {
+    MemoryBackend.name: MemoryBackend,
+    WorkbookBackend.name: WorkbookBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+def open_backend(name, crawl_book):
+    """
+    Return the backend name of the frontier of crawl_book (an opened CrawlWorkbook)
+
+    A new sqlite database starts with the links of the workbook
+    """
+    if name == MemoryBackend.name:
+        return MemoryBackend()
+    if name == WorkbookBackend.name:
+        return WorkbookBackend(crawl_book)
+    if name == SQLiteBackend.name:
+        backend = SQLiteBackend(os.path.splitext(crawl_book.file_name)[0] + BACKEND['SQLITE']['FILE_EXT'])
+        if not len(backend) and not backend.done_count():
+            backend.add(crawl_book.weighted_links)
+            backend.add_done(crawl_book.weighted_links_done)
+            backend.flush()
+        return backend
+    raise ValueError(u'Unknown frontier backend: ' + name)
+
+def benchmark(backend, n_links, batch):
+    """
+    Time the batched operations of backend on n_links links, return {operation: seconds}
+    """
+    import time
+    urls = [u'https://www.apple.com/page/%d' % i for i in range(n_links)]
+    timings = {}
+
+    def timed(operation, function):
+        start = time.perf_counter()
+        for i in range(0, n_links, batch):
+            function(urls[i:i + batch])
+        backend.flush()
+        timings[operation] = time.perf_counter() - start
+
+    timed('add', lambda batch_urls: backend.add([WeightedLink(url=url, weight=DEFAULT_WEIGHT + (hash(url) % 100) / 100)
+                                                 for url in batch_urls]))
+    timed('contains', backend.contains)
+    timed('pop', lambda batch_urls: backend.pop(len(batch_urls)))
+    timed('remove', backend.remove)
+    timed('add_done', lambda batch_urls: backend.add_done([WeightedLink(url=url) for url in batch_urls]))
+    timed('contains_done', backend.contains_done)
+    return timings
+
 class Usage(Exception):
     def __init__(self, msg):
         self.msg = msg
-        
+
 def main(argv=None):
     """
     main
     """
+    import io
     import getopt
+    import shutil
+    import tempfile
+    import contextlib
+    from workbook import CrawlWorkbook
     if argv is None:
         argv = sys.argv
 
     try:
-        try:                                
-            opts, args = getopt.getopt(argv, "hup:d", ["help", "url=", "path="])
+        try:
+            opts, args = getopt.getopt(argv, "hn:B:b:p:d", ["help", "links=", "batch=", "backend=", "path="])
         except getopt.error as msg:
-             raise Usage(msg)            
-        url = u'http://localhost'
-        path = u'/var/www'
+             raise Usage(msg)
+        n_links = 100000
+        batch = 100
+        names = list(BACKENDS)
+        path = None
         for opt, arg in opts:
             if opt in ("-h", "--help"):
-                print(__usage__)                   
-                sys.exit()                  
+                print(__usage__)
+                sys.exit()
             elif opt == '-d':
-                global _debug               
-                _debug = 1                  
+                global _debug
+                _debug = 1
+            elif opt in ("-n", "--links"):
+                n_links = int(arg)
+            elif opt in ("-B", "--batch"):
+                batch = int(arg)
+            elif opt in ("-b", "--backend"):
+                if arg not in BACKENDS:
+                    raise Usage(u'Unknown backend: ' + arg)
+                names = [arg]
+            elif opt in ("-p", "--path"):
+                path = arg
     except Usage as err:
-        print >>sys.stderr, err.msg
-        print >>sys.stderr, "for help use --help"
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
         return 2
 
+    operations = ['add', 'contains', 'pop', 'remove', 'add_done', 'contains_done']
+    print(u'%d links, %d per operation, links per second:' % (n_links, batch))
+    print(u'%-10s' % u'backend' + u''.join(u'%14s' % operation for operation in operations))
+    for name in names:
+        bench_path = tempfile.mkdtemp(prefix='backend-') if path is None else os.path.join(path, name)
+        try:
+            os.makedirs(os.path.join(bench_path, HTML_SUBDIR), exist_ok=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                crawl_book = CrawlWorkbook(path=bench_path, url=u'https://www.apple.com/')
+                crawl_book.wb_open()
+                backend = open_backend(name, crawl_book)
+                timings = benchmark(backend, n_links, batch)
+                backend.close()
+                crawl_book.wb_close()
+        finally:
+            if path is None:
+                shutil.rmtree(bench_path, ignore_errors=True)
+        print(u'%-10s' % name + u''.join(u'%14.0f' % (n_links / max(timings[operation], 1e-9)) for operation in operations))
+
 if __name__ == "__main__":
     import sys
     print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
     main(sys.argv[1:])
-
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+u"""Url Canonicalizer
+
+Maps the variants of an url to one canonical url before the frontier checks it
+  - lower case scheme and host, default port removed, empty path is /
+  - fragment removed
+  - query parameters filtered with allow/deny lists, sorted
+  - percent-encoding normalised: unreserved characters decoded, escapes upper case
+  - trailing slash stripped (or added)
+  - http and https urls of a seed host use the seed scheme
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 canonical.py [url ...]
+
+Examples:
+  python3 canonical.py 'HTTP://www.NYTimes3xbfgragh.onion:80/section/us/?utm_source=x&b=2&a=1#top'
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import re
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, quote
+
+from settings import SEEDS, CANONICAL
+
+DEFAULT_PORTS = {u'http': 80, u'https': 443}
+# RFC 3986 unreserved characters, never need to be percent-encoded
+UNRESERVED = frozenset(u'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+PERCENT_RE = re.compile(u'%([0-9A-Fa-f]{2})')
+# characters left as is by quote, '%' keeps the normalised escapes
+PATH_SAFE = u"/%:@!$&'()*+,;=~"
+QUERY_SAFE = u"/%:@!$'()*+,;=?~"
+
+def normalize_escape(match):
+    char = chr(int(match.group(1), 16))
+    if char in UNRESERVED:
+        return char
+    return u'%' + match.group(1).upper()
+
+def normalize_percent(text, safe):
+    """
+    Return text with its unreserved escapes decoded, other escapes in upper case,
+    unsafe characters (eg. spaces, non ascii) percent-encoded
+    """
+    if u'%' in text:
+        text = PERCENT_RE.sub(normalize_escape, text)
+    return quote(text, safe=safe)
+
+class UrlCanonicalizer():
+    """
+    Url Canonicalizer
+
+    canonical(url) is memoised: the same links are found in most pages of a website
+    canonical_link(url) also counts the fetches saved: distinct extracted urls rewritten to another one,
+      counted once while memoised
+    Life Cycle: see main
+    """
+    # seed host => seed scheme, see MERGE_SCHEMES
+    schemes = {}
+    remove_fragment = True
+    trailing_slash = u'strip'
+    query_allow = []
+    query_deny = []
+    sort_query = True
+    # distinct extracted urls rewritten by canonical_link, see saved_fetches
+    rewritten_urls = 0
+
+    def __init__(self, seeds=SEEDS, settings=CANONICAL):
+        self.schemes = {}
+        if settings['MERGE_SCHEMES']:
+            for seed in seeds:
+                parts = urlsplit(seed)
+                self.schemes.setdefault(parts.netloc.lower(), parts.scheme.lower())
+        self.remove_fragment = settings['REMOVE_FRAGMENT']
+        self.trailing_slash = settings['TRAILING_SLASH']
+        self.query_allow = list(settings['QUERY_ALLOW'])
+        self.query_deny = list(settings['QUERY_DENY'])
+        self.sort_query = settings['SORT_QUERY']
+        self.rewritten_urls = 0
+        self.canonical = lru_cache(maxsize=settings['CACHE_SIZE'])(self.canonicalize)
+
+    def query_param_kept(self, name):
+        name = name.lower()
+        if self.query_allow and not any(fnmatchcase(name, pattern) for pattern in self.query_allow):
+            return False
+        return not any(fnmatchcase(name, pattern) for pattern in self.query_deny)
+
+    def canonicalize(self, url):
+        """
+        Return the canonical url of url, not memoised: use canonical(url)
+        """
+        try:
+            parts = urlsplit(url.strip())
+            port = parts.port
+        except ValueError:
+            return url
+        scheme, netloc, path, query, fragment = parts
+        scheme = scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            return url
+
+        # host, hostname is lower case and without the brackets of an IPv6 literal
+        userinfo, at, hostport = netloc.rpartition(u'@')
+        host = (parts.hostname or u'').rstrip(u'.')
+        if u':' in host:
+            host = u'[' + host + u']'
+        if port == DEFAULT_PORTS[scheme]:
+            port = None
+        netloc = userinfo + at + host + (u':%d' % port if port is not None else u'')
+        scheme = self.schemes.get(netloc, scheme)
+
+        # path
+        path = normalize_percent(path, PATH_SAFE) or u'/'
+        if path != u'/':
+            if self.trailing_slash == u'strip':
+                path = path.rstrip(u'/') or u'/'
+            elif self.trailing_slash == u'add' and not path.endswith(u'/'):
+                path += u'/'
+
+        # query
+        if query:
+            params = [param for param in query.split(u'&')
+                      if param and self.query_param_kept(param.partition(u'=')[0])]
+            if self.sort_query:
+                params.sort(key=lambda param: param.partition(u'=')[0])
+            query = u'&'.join(normalize_percent(param, QUERY_SAFE + u'&') for param in params)
+
+        if self.remove_fragment:
+            fragment = u''
+        else:
+            fragment = normalize_percent(fragment, QUERY_SAFE)
+        return urlunsplit((scheme, netloc, path, query, fragment))
+
+    def canonical_link(self, url):
+        """
+        Return the canonical url of an extracted link, counted in saved_fetches
+        """
+        misses = self.canonical.cache_info().misses
+        canonical_url = self.canonical(url)
+        if canonical_url != url and self.canonical.cache_info().misses > misses:
+            self.rewritten_urls += 1
+        return canonical_url
+
+    def saved_fetches(self):
+        """
+        Return the number of distinct extracted urls rewritten to their canonical url: fetched again without canonicalisation
+        """
+        return self.rewritten_urls
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+
+    canonicalizer = UrlCanonicalizer()
+    urls = sys.argv[1:] or ['HTTP://www.NYTimes3xbfgragh.onion:80/section/us/?utm_source=x&b=2&a=1#top',
+                            'https://www.nytimes3xbfgragh.onion/section/us?a=1&b=2',
+                            'https://www.nytimes3xbfgragh.onion/2020/11/01/us/%7euser%2fx%20y.html?smid=tw-share',
+                            'https://www.nytimes3xbfgragh.onion']
+    for url in urls:
+        print(url, '=>', canonicalizer.canonical_link(url))
+    print(canonicalizer.saved_fetches(), 'fetches saved')
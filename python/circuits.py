@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+u"""Circuits
+
+Pool of isolated Tor circuits
+Each circuit is a requests.Session whose socks5h proxy url carries its own username/password:
+Tor (IsolateSOCKSAuth, on by default) builds a separate circuit for each credential,
+several proxy endpoints (Tor instances) can also be given
+Requests are dispatched round-robin, failing circuits get new credentials, ie. a new circuit
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 circuits.py [options] [url]
+
+Options:
+  -h, --help              show this help
+  -n ..., --circuits=...  number of circuits
+  -d                      show debugging information
+
+Examples:
+  python3 circuits.py -n 4 https://www.nytimes3xbfgragh.onion/
+  warms up 4 circuits and prints their latency
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+# https requests
+import requests
+
+from settings import PROXIES, TOR_CIRCUITS, FETCH_TIMEOUT
+
+class Circuit():
+    """
+    Circuit
+
+    A requests.Session through one proxy endpoint, isolated by its socks credentials
+    """
+    number = 0
+    # proxy url without credentials, None for direct connections
+    endpoint = None
+    headers = {}
+    # socks credentials per circuit
+    isolation = True
+    # incremented on rotation: new credentials, new circuit
+    generation = 0
+    session = None
+    # consecutive failed requests
+    failures = 0
+    n_requests = 0
+    n_failures = 0
+    n_bytes = 0
+    # seconds, moving average of the request durations
+    latency = 0.0
+
+    def __init__(self, number, endpoint=None, headers={}, isolation=TOR_CIRCUITS['ISOLATION']):
+        self.number = number
+        self.endpoint = endpoint
+        self.headers = headers
+        self.isolation = isolation
+        self.generation = 0
+        self.n_requests = 0
+        self.n_failures = 0
+        self.n_bytes = 0
+        self.latency = 0.0
+        self.session = self.new_session()
+
+    def proxy_url(self):
+        """
+        Return the proxy url of the circuit: endpoint with the circuit credentials for socks proxies
+        """
+        parts = urlsplit(self.endpoint)
+        if not self.isolation or not parts.scheme.startswith('socks'):
+            return self.endpoint
+        # credentials are random per process: a restarted crawler does not reuse old circuits
+        credentials = 'torcrawler-%d-%d:%s' % (self.number, self.generation, os.urandom(6).hex())
+        return urlunsplit((parts.scheme, credentials + '@' + parts.netloc.rpartition('@')[2], parts.path, '', ''))
+
+    def new_session(self):
+        session = requests.Session()
+        if self.endpoint:
+            proxy_url = self.proxy_url()
+            session.proxies.update(http=proxy_url, https=proxy_url)
+        session.headers.update(self.headers)
+        self.failures = 0
+        return session
+
+    def rotate(self):
+        """
+        Switch to a new circuit, the old session is left to the requests using it
+        """
+        self.generation += 1
+        self.session = self.new_session()
+
+    def __str__(self):
+        return 'circuit %d.%d %s: %d requests, %d failures, %d bytes, %.2fs latency' % (
+            self.number, self.generation, self.endpoint or 'direct', self.n_requests, self.n_failures, self.n_bytes, self.latency)
+
+class CircuitPool():
+    """
+    Circuit Pool
+
+    size circuits spread over the proxy endpoints, acquired round-robin
+    A circuit failing max_failures times in a row is rotated
+    Thread safe: used by the fetcher worker threads
+    Life Cycle: see main
+    """
+    circuits = []
+    max_failures = TOR_CIRCUITS['MAX_FAILURES']
+    timeout = FETCH_TIMEOUT
+    # next circuit
+    position = 0
+    lock = None
+
+    def __init__(self, endpoints=None, size=TOR_CIRCUITS['SIZE'], headers={},
+                 isolation=TOR_CIRCUITS['ISOLATION'], max_failures=TOR_CIRCUITS['MAX_FAILURES'], timeout=FETCH_TIMEOUT):
+        """
+        Init with proxy endpoints eg. ['socks5h://localhost:9150'], direct connections if empty
+        """
+        endpoints = list(endpoints or [None])
+        self.circuits = [Circuit(number, endpoints[number % len(endpoints)], headers, isolation)
+                         for number in range(max(size, 1))]
+        self.max_failures = max_failures
+        self.timeout = timeout
+        self.position = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_proxies(proxies=PROXIES, size=TOR_CIRCUITS['SIZE'], headers={}):
+        """
+        Return a Circuit Pool through TOR_CIRCUITS ENDPOINTS, or through the https proxy of proxies
+        """
+        endpoints = TOR_CIRCUITS['ENDPOINTS'] or [proxies.get('https') or proxies.get('http')]
+        return CircuitPool(endpoints=[endpoint for endpoint in endpoints if endpoint], size=size, headers=headers)
+
+    def __len__(self):
+        return len(self.circuits)
+
+    def acquire(self):
+        """
+        Return the next circuit, round-robin
+        """
+        with self.lock:
+            circuit = self.circuits[self.position]
+            self.position = (self.position + 1) % len(self.circuits)
+        return circuit
+
+    def succeeded(self, circuit, elapsed, n_bytes=0):
+        with self.lock:
+            circuit.failures = 0
+            circuit.n_requests += 1
+            circuit.n_bytes += n_bytes
+            circuit.latency = elapsed if not circuit.latency else 0.8 * circuit.latency + 0.2 * elapsed
+
+    def failed(self, circuit):
+        """
+        Count a failed request, rotate the circuit after max_failures failures in a row
+        """
+        with self.lock:
+            circuit.failures += 1
+            circuit.n_requests += 1
+            circuit.n_failures += 1
+            if circuit.failures >= self.max_failures:
+                print('Circuits: rotating unhealthy', circuit)
+                circuit.rotate()
+
+    def get(self, url, headers=None, timeout=None, read=None):
+        """
+        Blocking get through the next circuit
+
+        read: streams the response if given, read(response) downloads the body
+        Raise requests.RequestException on error
+        """
+        circuit = self.acquire()
+        start = time.monotonic()
+        try:
+            response = circuit.session.get(url, headers=headers, timeout=timeout or self.timeout, stream=read is not None)
+            if read is not None:
+                read(response)
+        except requests.RequestException:
+            self.failed(circuit)
+            raise
+        self.succeeded(circuit, time.monotonic() - start, len(response.content))
+        return response
+
+    def warm_circuit(self, circuit, url):
+        """
+        Build a circuit with a HEAD request, rotate it once if it fails
+
+        Return True if the circuit is up
+        """
+        for attempt in range(2):
+            start = time.monotonic()
+            try:
+                circuit.session.head(url, timeout=self.timeout)
+                self.succeeded(circuit, time.monotonic() - start)
+                return True
+            except requests.RequestException as e:
+                print('Circuits: warm up failed', circuit, e)
+                circuit.rotate()
+        return False
+
+    def warm_up(self, url):
+        """
+        Build all circuits at the same time before crawling, return the number of circuits up
+        """
+        with ThreadPoolExecutor(max_workers=len(self.circuits), thread_name_prefix='circuit') as executor:
+            n_up = sum(executor.map(lambda circuit: self.warm_circuit(circuit, url), self.circuits))
+        print('Circuits:', n_up, '/', len(self.circuits), 'up')
+        return n_up
+
+    def print_stats(self):
+        for circuit in self.circuits:
+            print('Circuits:', circuit)
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hdn:", ["help", "circuits="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        size = TOR_CIRCUITS['SIZE']
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-n", "--circuits"):
+                size = int(arg)
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    from settings import SEEDS
+    url = args[0] if args else next(iter(SEEDS))
+    pool = CircuitPool.from_proxies(size=size)
+    pool.warm_up(url)
+    pool.print_stats()
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+u"""Crawl Benchmark
+
+Crawls a synthetic website end to end with Crawler.crawl
+The site is generated from a page count, link fan-out, page size and share of ignored links,
+served from a local http server with latency, the crawler state and pages go to a temporary www path,
+pages are not indexed
+Reports pages/s, cpu per page, peak rss and bytes written, compared with a saved baseline
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 crawlbench.py [options]
+
+Options:
+  -h, --help              show this help
+  -p ..., --pages=...     pages of the synthetic site, default: 500
+  -f ..., --fanout=...    links per page, default: 10
+  -s ..., --size=...      bytes of text per page, default: 20000
+  -i ..., --ignored=...   share of the links under ignore seeds, default: 0.1
+  -l ..., --latency=...   seconds per response, default: 0.05
+  -j ..., --jitter=...    random seconds added to the latency, default: 0.05
+  -n ..., --concurrency=  number of concurrent requests (per node)
+  -N ..., --nodes=...     distributed crawl over n nodes, one process per node, see distributed.py
+  --backend=...           frontier backend: workbook, sqlite or memory, default: BACKEND NAME, see backend.py
+  -o ..., --output=...    save the report as json, eg. baseline.json
+  -b ..., --baseline=...  compare the report with a saved report
+  -v                      print the crawler output
+  -d                      show debugging information
+
+Examples:
+  python3 crawlbench.py -o baseline.json
+  python3 crawlbench.py -b baseline.json
+  python3 crawlbench.py --pages=2000 --latency=0.5 -n 32
+  python3 crawlbench.py --latency=0.5 -N 4
+  python3 crawlbench.py --pages=20000 --latency=0 --backend=sqlite -b baseline.json
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+import io
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from settings import HTML_SUBDIR, FETCH_CONCURRENCY, BACKEND
+from metrics import RESPONSE_BYTES
+
+# paths under the default ignore seeds, see IGNORE_PATHS in settings.py
+IGNORED_PREFIXES = ['/es/', '/video/', '/2019/', '/section/sports/']
+WORDS = (u'crawler onion frontier circuit page link index search news world report market vote court '
+         u'city health climate science money budget school energy water police election country').split()
+
+class SyntheticSite():
+    """
+    Synthetic Site
+
+    Pages /article/0 to /article/pages-1, the home page / is article 0
+    Every page links fanout pages, article i + 1 first so that all pages are reachable,
+    a share ignored of the links point under IGNORED_PREFIXES
+    Pages are generated on request, the same from one run to the other
+    """
+    pages = 500
+    fanout = 10
+    size = 20000
+    ignored = 0.1
+    seed = 0
+
+    def __init__(self, pages=500, fanout=10, size=20000, ignored=0.1, seed=0):
+        self.pages = pages
+        self.fanout = fanout
+        self.size = size
+        self.ignored = ignored
+        self.seed = seed
+
+    def page_number(self, path):
+        """
+        Return the article number of path, None if not an article
+        """
+        if path in ('', '/'):
+            return 0
+        prefix, _, number = path.rpartition('/')
+        if prefix == '/article' and number.isdigit() and int(number) < self.pages:
+            return int(number)
+        return None
+
+    def links(self, number):
+        rand = random.Random(self.seed * 1000003 + number)
+        links = [u'/article/%d' % ((number + 1) % self.pages)]
+        while len(links) < self.fanout:
+            if rand.random() < self.ignored:
+                links.append(rand.choice(IGNORED_PREFIXES) + str(rand.randrange(self.pages)))
+            else:
+                links.append(u'/article/%d' % rand.randrange(self.pages))
+        return links
+
+    def page(self, number):
+        """
+        Return the html of an article
+        """
+        rand = random.Random(self.seed * 1000003 + number)
+        words = []
+        n_chars = 0
+        while n_chars < self.size:
+            word = rand.choice(WORDS)
+            words.append(word)
+            n_chars += len(word) + 1
+        # articles differ in every paragraph: they are not near-duplicates
+        paragraphs = [u'<p>article %d paragraph %d %s</p>' % (number, i, u' '.join(words[i:i + 100]))
+                      for i in range(0, len(words), 100)]
+        anchors = [u'<a href="%s">link %d</a>' % (link, i) for i, link in enumerate(self.links(number))]
+        return (u'<html><head><title>Article %d</title></head><body><h1>Article %d</h1>%s<nav>%s</nav></body></html>'
+                % (number, number, u''.join(paragraphs), u' '.join(anchors)))
+
+class SiteHandler(BaseHTTPRequestHandler):
+    site = None
+    latency = 0.0
+    jitter = 0.0
+
+    def respond(self, body=True):
+        time.sleep(self.latency + random.random() * self.jitter)
+        number = self.site.page_number(self.path.split('?')[0])
+        if number is None:
+            self.send_error(404)
+            return
+        content = self.site.page(number).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+class SiteServer():
+    """
+    Site Server
+
+    Serves a SyntheticSite on a free local port from a daemon thread
+    """
+    server = None
+
+    def __init__(self, site, latency=0.05, jitter=0.05):
+        handler = type('SyntheticSiteHandler', (SiteHandler, ), {'site': site, 'latency': latency, 'jitter': jitter})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return u'http://127.0.0.1:%d/' % self.server.server_port
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='site', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(path) for name in names)
+
+def crawl_node(url, path, concurrency=FETCH_CONCURRENCY, verbose=False, node=None, nodes={}, results=None, backend=BACKEND['NAME']):
+    """
+    Crawl url, return {'pages', 'ignored', 'bytes_downloaded'}, also put in results if given
+
+    node: a node of nodes (distributed crawl), crawled from a process of its own
+    """
+    from crawler import Crawler
+
+    crawler = Crawler(concurrency=concurrency, metrics_port=0, seeds=[url], path=path, index=False, node=node, nodes=nodes,
+                      backend=backend)
+    # direct connections to the local site
+    crawler.proxies = {}
+    response_bytes = RESPONSE_BYTES.total()
+    with contextlib.redirect_stdout(None if verbose else io.StringIO()):
+        crawler.crawl()
+    counts = {
+        'pages': crawler.frontier.backend.done_count(),
+        'ignored': len(crawler.frontier.ignored_pages),
+        'bytes_downloaded': RESPONSE_BYTES.total() - response_bytes,
+    }
+    if results is not None:
+        results.put(counts)
+    return counts
+
+def run_benchmark(site, latency=0.05, jitter=0.05, concurrency=FETCH_CONCURRENCY, verbose=False, n_nodes=1,
+                  backend=BACKEND['NAME']):
+    """
+    Crawl site end to end, return the report: {measure: value}
+
+    n_nodes > 1: distributed crawl, one process per node, nodes talk over unix sockets
+    cpu and peak rss include the parser worker processes and the node processes
+    seconds: wall clock until every node has returned, shutdown included (end of crawl detection of the nodes too)
+    """
+    server = SiteServer(site, latency, jitter).start()
+    path = tempfile.mkdtemp(prefix='crawlbench-')
+    os.makedirs(os.path.join(path, HTML_SUBDIR))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.monotonic()
+    try:
+        if n_nodes > 1:
+            nodes = {u'node%d' % i: u'unix://' + os.path.join(path, u'node%d.sock' % i) for i in range(n_nodes)}
+            results = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=crawl_node, args=(server.url, path, concurrency, verbose, node, nodes, results, backend))
+                         for node in nodes]
+            for process in processes:
+                process.start()
+            node_counts = [results.get() for process in processes]
+            for process in processes:
+                process.join()
+        else:
+            node_counts = [crawl_node(server.url, path, concurrency, verbose, backend=backend)]
+        elapsed = time.monotonic() - start
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        bytes_written = directory_size(path)
+    finally:
+        server.stop()
+        shutil.rmtree(path, ignore_errors=True)
+
+    pages = sum(counts['pages'] for counts in node_counts)
+    cpu = (end_usage.ru_utime + end_usage.ru_stime - usage.ru_utime - usage.ru_stime
+           + end_children.ru_utime + end_children.ru_stime - children.ru_utime - children.ru_stime)
+    return {
+        'pages': pages,
+        'ignored': sum(counts['ignored'] for counts in node_counts),
+        'seconds': round(elapsed, 3),
+        'pages_per_second': round(pages / elapsed, 2),
+        'cpu_ms_per_page': round(1000 * cpu / max(pages, 1), 3),
+        # ru_maxrss: kilobytes on Linux
+        'peak_rss_mb': round(max(end_usage.ru_maxrss, end_children.ru_maxrss) / 1024, 1),
+        'bytes_downloaded': sum(counts['bytes_downloaded'] for counts in node_counts),
+        'bytes_written': bytes_written,
+        'site': {'pages': site.pages, 'fanout': site.fanout, 'size': site.size, 'ignored': site.ignored,
+                 'latency': latency, 'jitter': jitter, 'concurrency': concurrency, 'nodes': n_nodes, 'backend': backend},
+    }
+
+def print_report(report, baseline=None):
+    """
+    Print the measures, with their change from baseline if given
+    """
+    for measure, value in report.items():
+        if measure == 'site':
+            continue
+        line = u'%-18s %14s' % (measure, value)
+        if baseline and baseline.get(measure):
+            line += u'  %+7.1f%%' % (100.0 * (value - baseline[measure]) / baseline[measure])
+        print(line)
+    if baseline and baseline.get('site') != report['site']:
+        print(u'Baseline site differs:', baseline.get('site'))
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hp:f:s:i:l:j:n:N:o:b:vd", ["help", "pages=", "fanout=", "size=", "ignored=",
+                                       "latency=", "jitter=", "concurrency=", "nodes=", "output=", "baseline=", "backend="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        site = SyntheticSite()
+        latency = 0.05
+        jitter = 0.05
+        concurrency = FETCH_CONCURRENCY
+        n_nodes = 1
+        backend = BACKEND['NAME']
+        output = None
+        baseline = None
+        verbose = False
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-p", "--pages"):
+                site.pages = int(arg)
+            elif opt in ("-f", "--fanout"):
+                site.fanout = int(arg)
+            elif opt in ("-s", "--size"):
+                site.size = int(arg)
+            elif opt in ("-i", "--ignored"):
+                site.ignored = float(arg)
+            elif opt in ("-l", "--latency"):
+                latency = float(arg)
+            elif opt in ("-j", "--jitter"):
+                jitter = float(arg)
+            elif opt in ("-n", "--concurrency"):
+                concurrency = int(arg)
+            elif opt in ("-N", "--nodes"):
+                n_nodes = int(arg)
+            elif opt == "--backend":
+                backend = arg
+            elif opt in ("-o", "--output"):
+                output = arg
+            elif opt in ("-b", "--baseline"):
+                with open(arg) as f:
+                    baseline = json.load(f)
+            elif opt == '-v':
+                verbose = True
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    report = run_benchmark(site, latency, jitter, concurrency, verbose, n_nodes, backend)
+    print_report(report, baseline)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -11,11 +11,32 @@ __usage__ = u"""Usage: python3 crawler.py [options]
 
 Options:
   -h, --help              show this help
+  -n ..., --concurrency=  number of concurrent requests
+  -c ..., --circuits=     number of Tor circuits the requests are spread over
+  -r, --recrawl           crawl the crawled pages again, only modified pages are parsed and indexed
+  --continuous            do not stop: revisit the crawled pages as often as they change, see revisit.py
+  -m ..., --metrics-port= port of the metrics endpoint, 0: not served
+  --no-index              crawl without sending the pages to the search engine
+  --backend=...           storage of the links to crawl and crawled: workbook, sqlite or memory,
+                          default: BACKEND NAME, see backend.py
+  --middlewares=...       comma separated middleware chain, default: MIDDLEWARES, see middleware.py
+  --node=...              distributed crawl: name of this node, see distributed.py
+  --nodes=...             nodes of the distributed crawl, eg. a=tcp://10.0.0.1:9201,b=tcp://10.0.0.2:9201,
+                          default: DISTRIBUTED NODES
+  -P ..., --profile=...   sampling profiler: write prefix.collapsed and prefix.txt, see profiler.py
+  --profile-window=...    [delay:]seconds profiled, default: the whole run
   -d                      show debugging information
   
 Examples:
   python3 crawler.py
   crawls from the seeds for searching in a Manticore Database
+  python3 crawler.py -n 16 -c 8
+  python3 crawler.py --recrawl
+  python3 crawler.py --recrawl --continuous
+  python3 crawler.py -m 9108
+  curl http://127.0.0.1:9108/metrics
+  python3 crawler.py -P /tmp/crawl --profile-window=600:60
+  python3 crawler.py --node=a --nodes=a=tcp://10.0.0.1:9201,b=tcp://10.0.0.2:9201
 """
 
 __author__ = u"M0t13y"
@@ -26,6 +47,8 @@ __license__ = u"Licensed under the Apache License, Version 2.0"
 
 import os
 import re
+import time
+import asyncio
 # https requests
 import requests
 # url parser
@@ -33,8 +56,17 @@ from urllib.parse import urljoin, urlparse, urlsplit
 # html parser
 from bs4 import BeautifulSoup
 
-from settings import SEEDS, PROXIES
+from settings import SEEDS, WWW_DIR, PROXIES, FETCH_CONCURRENCY, TOR_CIRCUITS, METRICS, DISTRIBUTED, BACKEND, MIDDLEWARES
 from frontier import FrontierManager
+from distributed import ShardedFrontier, parse_nodes
+from fetcher import AsyncFetcher, ResponseBlocked
+from middleware import MiddlewareChain, Drop
+from circuits import CircuitPool
+from ratelimit import RateLimiter, THROTTLE_STATUS_CODES
+from pageparser import ParserPool, extract_links
+from document import open_document
+from metrics import REGISTRY, STAGE_SECONDS, RESPONSE_BYTES, MetricsServer
+from profiler import profiled
 
 # web_page_list
 class Crawler():
@@ -50,8 +82,33 @@ class Crawler():
     # Requests session for multiple url get
     session = None
     proxies = PROXIES
+    # concurrent requests
+    concurrency = FETCH_CONCURRENCY
+    # Tor circuits
+    circuits = TOR_CIRCUITS['SIZE']
     # frontier
     frontier = None
+    # per host rate and concurrency, up to concurrency
+    rate_limiter = None
+    # crawl the crawled pages again
+    recrawl = False
+    # metrics endpoint port, 0: not served
+    metrics_port = METRICS['PORT']
+    # websites to crawl, www path of the crawler state and pages
+    seeds = SEEDS
+    path = WWW_DIR
+    # send the pages to the search engine
+    index = True
+    # frontier backend, see backend.py
+    backend = BACKEND['NAME']
+    # revisit the crawled pages, see revisit.py
+    continuous = False
+    # middleware names, see middleware.py
+    middlewares = MIDDLEWARES
+    middleware_chain = None
+    # distributed crawl: name of this node, None for a single crawler, {node name: address}
+    node = None
+    nodes = DISTRIBUTED['NODES']
 
     # will be handled by a Middleware
     # initialize some HTTP headers
@@ -62,11 +119,24 @@ class Crawler():
     url_base = ''
     # LINK_RE = re.compile(r'href="(.*?)"')
     
-    def __init__(self):
+    def __init__(self, concurrency=FETCH_CONCURRENCY, recrawl=False, circuits=TOR_CIRCUITS['SIZE'], metrics_port=METRICS['PORT'],
+                 seeds=SEEDS, path=WWW_DIR, index=True, node=None, nodes=DISTRIBUTED['NODES'], backend=BACKEND['NAME'],
+                 middlewares=MIDDLEWARES, continuous=False):
         """
         Init
         """
-        pass
+        self.node = node
+        self.nodes = nodes
+        self.seeds = seeds
+        self.path = path
+        self.index = index
+        self.backend = backend
+        self.middlewares = middlewares
+        self.continuous = continuous
+        self.concurrency = concurrency
+        self.circuits = circuits
+        self.recrawl = recrawl
+        self.metrics_port = metrics_port
 
     def session_start(self):
         """
@@ -78,17 +148,13 @@ class Crawler():
         self.session.proxies.update(self.proxies)
 
     def extract_page_links(self, response):
-        html_doc = response.text
-        soup = BeautifulSoup(html_doc, 'html.parser')
-        links = soup.find_all('a')
-        # absolute links
-        links_href_absolute = [link.get('href') for link in links if link and link.get('href') and link.get('href').startswith(self.url_base)]
-        # relative links
-        links_href_relative = [ urljoin(self.url_base, link.get('href')) for link in links if link and link.get('href') and link.get('href').startswith('/')
-                                and link.get('href') != '/' and not link.get('href').startswith('/#')
-                                ]
-        print(u'Web Page:',len(links_href_absolute), u'absolute links, ', len(links_href_relative), u'relative links found, ')        
-        return links_href_absolute + links_href_relative
+        """
+        Return the links of a response, parsed in this process
+
+        Crawler.crawl parses pages in the ParserPool instead
+        """
+        document = open_document(response.content, response.encoding)
+        return extract_links(document, self.url_base)
         # only interested in links, not assets... so soup is better
         # return [urljoin(response.url, link) for link in self.LINK_RE.findall(response.text)]
                       
@@ -99,52 +165,159 @@ class Crawler():
         stores web pages in a manticore DB
         """
 
-        self.session_start()
-
         # settings can be directly loaded by the frontier
         # constructor handling the seeds
-        self.frontier = FrontierManager(seeds=[requests.Request(url=url) for url in SEEDS])
+        seeds = [requests.Request(url=url) for url in self.seeds]
+        if self.node:
+            self.frontier = ShardedFrontier(seeds=seeds, path=self.path, index=self.index, node=self.node, nodes=self.nodes,
+                                            backend=self.backend, continuous=self.continuous)
+        else:
+            self.frontier = FrontierManager(seeds=seeds, path=self.path, index=self.index, backend=self.backend,
+                                            continuous=self.continuous)
+        self.middleware_chain = MiddlewareChain.from_names(self.middlewares)
+        self.middleware_chain.frontier_start(self.frontier)
+        if self.recrawl:
+            self.frontier.recrawl()
         
         # url root (eg.: https://toto.com/)
         # work with only one seed for now
-        url = next(iter(SEEDS))
+        url = next(iter(self.seeds))
         parsed_uri = urlparse(url)
         self.url_base = '{uri.scheme}://{uri.netloc}/'.format(uri=parsed_uri)
 
         #self.frontier.add_seeds(requests=[requests.Request(url=url) for url in settings.SEEDS])
-        while True:
-            next_requests = self.frontier.get_next_requests()
-            if not next_requests:
-                break
-            for request in next_requests:
-                    try:
-                        if self.session:
-                            print(u'----------------')
-                            print(u'Web Page: get', request.url)
-                            response = self.session.get(request.url)
-                            #req1 = urllib2.Request(url1)
-                            #response = urllib2.urlopen(req1)
-                            #cookie = response.headers.get('Set-Cookie')
-                            
-                            ## Use the cookie is subsequent requests
-                            #req2 = urllib2.Request(url2)
-                            #req2.add_header('cookie', cookie)
-                            #response = urllib2.urlopen(req2)            
-                            links = [
-                                requests.Request(url=url)
-                                for url in self.extract_page_links(response)
-                            ] # end links                
-                            print(len(links), 'links found')
-                            self.frontier.page_crawled(response)
-                            if links:
-                                self.frontier.links_extracted(request=response.request, links=links)
+        metrics_server = MetricsServer(REGISTRY, port=self.metrics_port)
+        if self.metrics_port:
+            metrics_server.start()
+        try:
+            asyncio.run(self.crawl_async())
+        finally:
+            metrics_server.stop()
+            print(REGISTRY.stats_line())
+            # a continuous crawl stops on interrupt
+            self.middleware_chain.frontier_stop(self.frontier)
+            self.frontier.stop()
+
+    async def crawl_async(self):
+        """
+        Fetch up to self.concurrency requests at the same time
 
+        Requests are spread over a pool of Tor circuits, built before the first request
+        The RateLimiter holds them back to the rate the host tolerates
+        Responses are parsed in a ParserPool and handed to the frontier as they complete
+        A stats line of the metrics is printed every METRICS STATS_INTERVAL seconds
+        """
+        self.rate_limiter = RateLimiter(max_concurrency=self.concurrency)
+        circuit_pool = CircuitPool.from_proxies(self.proxies, size=self.circuits, headers=self.headers)
+        await asyncio.get_running_loop().run_in_executor(None, circuit_pool.warm_up, self.url_base)
+        fetcher = AsyncFetcher(proxies=self.proxies, concurrency=self.concurrency, circuits=circuit_pool)
+        parser_pool = ParserPool()
+        # running fetches and parses: {task: request}
+        tasks = {}
+        stats_time = time.monotonic()
+        await self.frontier.connect()
+        try:
+            while True:
+                if METRICS['STATS_INTERVAL'] and time.monotonic() - stats_time >= METRICS['STATS_INTERVAL']:
+                    stats_time = time.monotonic()
+                    print(REGISTRY.stats_line())
+                if len(tasks) < self.concurrency:
+                    for request in self.frontier.get_next_requests(self.concurrency - len(tasks)):
+                        try:
+                            request = self.middleware_chain.request(request)
+                        except Drop as e:
+                            self.frontier.request_blocked(request, e.reason)
+                            continue
+                        print(u'Web Page: get', request.url)
+                        tasks[asyncio.ensure_future(self.fetch_and_parse(fetcher, parser_pool, request))] = request
+                # pages buffered for the search engine are sent every BULK_INTERVAL, even while the crawl waits
+                self.frontier.index_flush()
+                # failed requests waiting for their retry
+                retry_delay = self.frontier.next_retry_delay()
+                if not tasks and retry_delay is None:
+                    break
+                delay = min([d for d in (retry_delay, self.frontier.next_index_delay()) if d is not None], default=None)
+                if not tasks:
+                    await asyncio.sleep(delay)
+                    continue
+                done, pending = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    request = tasks.pop(task)
+                    try:
+                        self.page_fetched(*task.result())
+                    except ResponseBlocked as e:
+                        self.frontier.request_blocked(request, e.reason)
                     except requests.RequestException as e:
                         error_code = type(e).__name__
-                        #frontier.request_error(request, error_code)
-                        print('Failed to process request', request.url, 'Error:', e)                        # start new session
+                        if e.response is not None:
+                            error_code += ' %d' % e.response.status_code
+                        self.frontier.request_error(request, error_code)
+                        print('Failed to process request', request.url, 'Error:', e)
+                    except Exception as e:
+                        # parser worker, middleware or frontier error: this request fails, not the crawl
+                        self.frontier.request_error(request, type(e).__name__)
+                        print('Failed to process request', request.url, 'Error:', type(e).__name__, e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.frontier.disconnect()
+            fetcher.close()
+            parser_pool.close()
+            circuit_pool.print_stats()
+            self.rate_limiter.print_stats()
+
+    async def fetch_and_parse(self, fetcher, parser_pool, request):
+        """
+        Fetch a request and parse its response in a worker process
 
-                        self.session_start()
+        Return (response, page), page is None if the page was not modified since last crawl
+        Raise requests.HTTPError if the host is overloaded (429, 5xx): the request is crawled again later
+        Raise ResponseBlocked if the body was not downloaded (content type, size)
+        """
+        host = await self.rate_limiter.acquire(request.url)
+        start = time.monotonic()
+        try:
+            response = await fetcher.fetch(request)
+        except ResponseBlocked as e:
+            self.rate_limiter.completed(host, time.monotonic() - start, e.response)
+            raise
+        except requests.RequestException:
+            self.rate_limiter.completed(host, time.monotonic() - start)
+            raise
+        elapsed = time.monotonic() - start
+        self.rate_limiter.completed(host, elapsed, response)
+        STAGE_SECONDS.observe(elapsed, stage='fetch')
+        RESPONSE_BYTES.inc(len(response.content))
+        if response.status_code >= 500 or response.status_code in THROTTLE_STATUS_CODES:
+            raise requests.HTTPError(u'%d %s' % (response.status_code, response.reason), response=response)
+        try:
+            response = self.middleware_chain.response(response)
+        except Drop as e:
+            raise ResponseBlocked(request.url, e.reason, response)
+        # client errors are not parsed, see FrontierManager.page_client_error
+        if 400 <= response.status_code < 500 or self.frontier.page_unchanged(response):
+            return response, None
+        with STAGE_SECONDS.time(stage='parse'):
+            page = await parser_pool.parse(response, self.url_base)
+        return response, page
+
+    def page_fetched(self, response, page):
+        """
+        Hand a fetched and parsed page and its links to the frontier
+        """
+        print(u'----------------')
+        print(u'Web Page: got', response.url)
+        if page is not None:
+            page = self.middleware_chain.document(response, page)
+        links = [
+            requests.Request(url=url)
+            for url in (page.links if page else [])
+        ] # end links                
+        links = self.middleware_chain.links(response.request, links)
+        print(len(links), 'links found')
+        self.frontier.page_crawled(response, page)
+        if links:
+            self.frontier.links_extracted(request=response.request, links=links)
       
 class Usage(Exception):
     def __init__(self, msg):
@@ -160,9 +333,23 @@ def main(argv=None):
 
     try:
         try:                                
-            opts, args = getopt.getopt(argv, "h:d", ["help"])
+            opts, args = getopt.getopt(argv, "hdn:c:rm:P:", ["help", "concurrency=", "circuits=", "recrawl", "metrics-port=", "no-index",
+                                                             "profile=", "profile-window=", "node=", "nodes=", "backend=",
+                                                             "middlewares=", "continuous"])
         except getopt.error as msg:
              raise Usage(msg)            
+        concurrency = FETCH_CONCURRENCY
+        recrawl = False
+        circuits = TOR_CIRCUITS['SIZE']
+        metrics_port = METRICS['PORT']
+        index = True
+        profile = None
+        profile_window = None
+        node = None
+        nodes = DISTRIBUTED['NODES']
+        backend = BACKEND['NAME']
+        middlewares = MIDDLEWARES
+        continuous = False
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 print(__usage__)                   
@@ -170,18 +357,44 @@ def main(argv=None):
             elif opt == '-d':
                 global _debug               
                 _debug = 1                  
+            elif opt in ("-n", "--concurrency"):
+                concurrency = int(arg)
+            elif opt in ("-c", "--circuits"):
+                circuits = int(arg)
+            elif opt in ("-r", "--recrawl"):
+                recrawl = True
+            elif opt in ("-m", "--metrics-port"):
+                metrics_port = int(arg)
+            elif opt == "--no-index":
+                index = False
+            elif opt in ("-P", "--profile"):
+                profile = arg
+            elif opt == "--profile-window":
+                profile_window = arg
+            elif opt == "--node":
+                node = arg
+            elif opt == "--nodes":
+                nodes = parse_nodes(arg)
+            elif opt == "--backend":
+                backend = arg
+            elif opt == "--middlewares":
+                middlewares = [name for name in arg.split(',') if name]
+            elif opt == "--continuous":
+                continuous = True
     except Usage as err:
         print >>sys.stderr, err.msg
         print >>sys.stderr, "for help use --help"
         return 2
 
     #if len(argv)<2:
-    #    print("Arguments error")
-    #    print(__usage__)
+    #    print("Arguments error")
+    #    print(__usage__)
     #    sys.exit(2)
     
-    crawler = Crawler()
-    crawler.crawl()
+    crawler = Crawler(concurrency=concurrency, recrawl=recrawl, circuits=circuits, metrics_port=metrics_port, index=index,
+                      node=node, nodes=nodes, backend=backend, middlewares=middlewares, continuous=continuous)
+    with profiled(profile, profile_window):
+        crawler.crawl()
 #    print('---  Crawl tests ---')
 #    seeds=[requests.Request(url=url) for url in SEEDS]
 #    print(seeds, len(seeds), [req.url for req in seeds])
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+
+u"""Distributed Frontier
+
+Frontier partitioned by url hash across crawler nodes
+  - HashRing: consistent hashing of SearchEngine.hash_url, adding a node moves about 1/n of the urls
+  - ShardedFrontier: a FrontierManager crawling the urls of its node, links of the other nodes are forwarded
+  - ShardServer, ShardClient: batches of links and probes, one json line per message answered by "ok" or a json line,
+    over tcp (tcp://host:port) or unix sockets (unix:///path)
+The nodes stop together: an idle node probes the others, the crawl ends when all of them are idle
+and have neither received nor delivered a batch between two probe rounds
+Links not forwarded yet are kept in the Links to forward worksheet of the node
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 distributed.py [options] [url ...]
+
+Options:
+  -h, --help              show this help
+  -n ..., --nodes=...     nodes, eg. a=tcp://10.0.0.1:9201,b=tcp://10.0.0.2:9201, default: DISTRIBUTED NODES
+  -d                      show debugging information
+
+Examples:
+  python3 distributed.py --nodes=a=unix:///tmp/a.sock,b=unix:///tmp/b.sock https://www.nytimes3xbfgragh.onion/
+  prints the node of each url
+  python3 crawler.py --node=a --nodes=a=tcp://10.0.0.1:9201,b=tcp://10.0.0.2:9201
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+import json
+import time
+import bisect
+import asyncio
+from urllib.parse import urlsplit
+
+import requests
+
+from settings import DISTRIBUTED, WWW_DIR, HTML_SUBDIR, MAX_N_REQUESTS, BACKEND, WORKBOOK
+from search import SearchEngine
+from link import WeightedLink
+from frontier import FrontierManager
+
+def parse_nodes(nodes):
+    """
+    Return {node name: address} of 'a=tcp://host:port,b=unix:///path'
+    """
+    return dict(node.split('=', 1) for node in nodes.split(',') if node)
+
+def parse_address(address):
+    """
+    Return ('tcp', host, port) or ('unix', path, None)
+    """
+    parts = urlsplit(address)
+    if parts.scheme == 'unix':
+        return 'unix', parts.path, None
+    if parts.scheme == 'tcp':
+        return 'tcp', parts.hostname, parts.port
+    raise ValueError(u'Unknown node address ' + address)
+
+class HashRing():
+    """
+    Hash Ring
+
+    vnodes points per node on the ring of SearchEngine.hash_url values,
+    an url belongs to the node of the first point after its hash
+    """
+    # {node name: address}
+    nodes = {}
+    vnodes = DISTRIBUTED['VNODES']
+    # sorted points and their nodes
+    points = []
+    owners = []
+
+    def __init__(self, nodes, vnodes=DISTRIBUTED['VNODES']):
+        self.nodes = dict(nodes)
+        self.vnodes = vnodes
+        ring = sorted((SearchEngine.hash_url(u'%s#%d' % (node, i)), node) for node in self.nodes for i in range(vnodes))
+        self.points = [point for point, node in ring]
+        self.owners = [node for point, node in ring]
+
+    def node(self, url):
+        """
+        Return the node name of url
+        """
+        return self.owners[bisect.bisect(self.points, SearchEngine.hash_url(url)) % len(self.points)]
+
+class ShardServer():
+    """
+    Shard Server
+
+    Receives the messages of the other nodes, receive(node, message) is called for each message,
+    its reply is sent back, "ok" if None
+    """
+    address = u''
+    server = None
+    # open connections - {StreamWriter}
+    connections = None
+
+    def __init__(self, address, receive):
+        self.address = address
+        self.receive = receive
+        self.connections = set()
+
+    async def start(self):
+        kind, host, port = parse_address(self.address)
+        if kind == 'unix':
+            if os.path.exists(host):
+                os.remove(host)
+            self.server = await asyncio.start_unix_server(self.handle, path=host)
+        else:
+            self.server = await asyncio.start_server(self.handle, host=host, port=port)
+        print('Distributed: listening on', self.address)
+
+    async def handle(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                reply = self.receive(message['node'], message)
+                writer.write(b'ok\n' if reply is None else json.dumps(reply).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            print('Distributed: bad message on', self.address, '-', e)
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            # the peers keep their connections open: close them, the handlers end on end of file
+            for writer in list(self.connections):
+                writer.close()
+            while self.connections:
+                await asyncio.sleep(0)
+            await self.server.wait_closed()
+            self.server = None
+        kind, host, port = parse_address(self.address)
+        if kind == 'unix' and os.path.exists(host):
+            os.remove(host)
+
+class ShardClient():
+    """
+    Shard Client
+
+    Connection to one node, reopened after errors
+    """
+    node = u''
+    address = u''
+    reader = None
+    writer = None
+
+    def __init__(self, node, address):
+        self.node = node
+        self.address = address
+
+    async def send(self, sender, message, timeout=DISTRIBUTED['SEND_TIMEOUT']):
+        """
+        Send a message, eg. {'links': [url]}, and return its reply: u'ok' or the json reply
+
+        Raise OSError or asyncio.TimeoutError if the message was not delivered
+        """
+        try:
+            return await asyncio.wait_for(self.send_message(sender, message), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+
+    async def send_message(self, sender, message):
+        if self.writer is None:
+            kind, host, port = parse_address(self.address)
+            if kind == 'unix':
+                self.reader, self.writer = await asyncio.open_unix_connection(host)
+            else:
+                self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(json.dumps(dict(message, node=sender)).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if line == b'ok\n':
+            return u'ok'
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise ConnectionError(u'message not acknowledged by ' + self.node)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+class ShardedFrontier(FrontierManager):
+    """
+    Sharded Frontier
+
+    FrontierManager of one node: crawls the urls the HashRing assigns to the node,
+    the links of the other nodes are forwarded to them in batches of BATCH_SIZE, every FLUSH_INTERVAL seconds
+    State in path/node: the pending and done urls of the node shard, the links to forward
+    connect() and disconnect() on the crawl event loop, see Crawler.crawl_async
+    Once idle, the node probes the others every FLUSH_INTERVAL seconds, see probe
+    """
+    node = u''
+    ring = None
+    server = None
+    # {node name: ShardClient}
+    clients = None
+    # links to forward - {node name: [url]}, journaled in the Links to forward worksheet until delivered
+    outbox = None
+    # urls already forwarded, sent once
+    forwarded = None
+    flusher = None
+    flush_event = None
+    # last crawl, batch received or sent (monotonic)
+    last_activity = 0.0
+    n_forwarded = 0
+    n_received = 0
+    # batches received and delivered: an idle node stays idle while it does not change
+    n_batches = 0
+    # {node name: status} of the last probe round where all the nodes were idle
+    quiet_round = None
+    # all the nodes are idle: the crawl is over
+    terminated = False
+
+    def __init__(self, seeds=[], path=WWW_DIR, index=True, node=u'', nodes=DISTRIBUTED['NODES'], backend=BACKEND['NAME'],
+                 continuous=False):
+        if node not in nodes:
+            raise ValueError(u'Node %s not in nodes %s' % (node, u','.join(nodes)))
+        self.node = node
+        self.ring = HashRing(nodes)
+        self.clients = {name: ShardClient(name, address) for name, address in nodes.items() if name != node}
+        self.outbox = {name: [] for name in self.clients}
+        self.forwarded = set()
+        self.last_activity = time.monotonic()
+        self.n_forwarded = 0
+        self.n_received = 0
+        self.n_batches = 0
+        self.quiet_round = None
+        self.terminated = False
+        path = os.path.join(path, node)
+        os.makedirs(os.path.join(path, HTML_SUBDIR), exist_ok=True)
+        FrontierManager.__init__(self, seeds, path, index, backend, continuous)
+        self.load_outbox()
+
+    def load_outbox(self):
+        """
+        Load the links not forwarded when the node stopped, their node is looked up again: nodes may have changed
+        """
+        wsname = WORKBOOK['crawler']['worksheet']['linkstoforward']['TITLE']
+        local = []
+        for wl in self.crawl_book.links_to_forward:
+            node = self.ring.node(wl.url)
+            if node == self.node:
+                self.crawl_book.ws_removeln(wsname, wl.url)
+                local.append(requests.Request(url=wl.url))
+                continue
+            if node != wl.notes:
+                self.crawl_book.ws_writeln(wsname, WeightedLink(url=wl.url, notes=node))
+            self.forwarded.add(wl.url)
+            self.outbox[node].append(wl.url)
+        if local:
+            FrontierManager.links_extracted(self, request=None, links=local)
+        print('Distributed:', sum(len(urls) for urls in self.outbox.values()), 'links to forward')
+
+    def owns(self, url):
+        return self.ring.node(url) == self.node
+
+    def add_seeds(self, seeds):
+        """
+        add the seeds of the node
+        """
+        FrontierManager.add_seeds(self, [seed for seed in seeds if self.owns(self.canonicalizer.canonical(seed.url))])
+
+    async def connect(self):
+        self.server = ShardServer(self.ring.nodes[self.node], self.message_received)
+        await self.server.start()
+        self.flush_event = asyncio.Event()
+        self.flusher = asyncio.ensure_future(self.flush_loop())
+        self.last_activity = time.monotonic()
+
+    async def disconnect(self):
+        """
+        Forward the last links then stop, the links not forwarded stay in the workbook
+
+        The end of the crawl is told to the other nodes, they may not have seen it yet
+        """
+        self.flusher.cancel()
+        await self.flush()
+        for node, urls in self.outbox.items():
+            if urls:
+                print('Distributed:', len(urls), 'links not forwarded to node', node, '- kept in the workbook')
+        if self.terminated:
+            for node, client in self.clients.items():
+                try:
+                    await client.send(self.node, {'terminated': True})
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    pass
+        for client in self.clients.values():
+            client.close()
+        await self.server.stop()
+        print('Distributed: node', self.node, '-', self.n_forwarded, 'links forwarded -', self.n_received, 'links received')
+
+    async def flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), DISTRIBUTED['FLUSH_INTERVAL'])
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            await self.flush()
+            if not self.terminated and self.idle():
+                await self.probe()
+
+    async def flush(self):
+        """
+        Send the links to forward, the batches not delivered are sent again on next flush
+        """
+        wsname = WORKBOOK['crawler']['worksheet']['linkstoforward']['TITLE']
+        for node, urls in self.outbox.items():
+            while urls:
+                batch = urls[:DISTRIBUTED['BATCH_SIZE']]
+                try:
+                    await self.clients[node].send(self.node, {'links': batch})
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    print('Distributed: node', node, 'unreachable -', type(e).__name__, e)
+                    break
+                # links added while sending are after the batch
+                del urls[:len(batch)]
+                for url in batch:
+                    self.crawl_book.ws_removeln(wsname, url)
+                self.crawl_book.wb_save()
+                self.n_forwarded += len(batch)
+                self.n_batches += 1
+                self.last_activity = time.monotonic()
+
+    def idle(self):
+        """
+        Return True if the node has nothing to crawl, to retry nor to forward
+        """
+        return (not len(self.backend) and not any(self.outbox.values())
+                and FrontierManager.next_retry_delay(self) is None)
+
+    def status(self):
+        return {'idle': self.idle(), 'batches': self.n_batches, 'terminated': self.terminated}
+
+    async def probe(self):
+        """
+        Probe the status of all the nodes, the crawl is over when two rounds in a row find them idle with the same batches
+
+        A node gets links to crawl from batches only and a batch is acknowledged once its links are added:
+        a node idle in both rounds which has not received nor delivered a batch in between was idle all along
+        """
+        statuses = {self.node: self.status()}
+        for node, client in self.clients.items():
+            try:
+                statuses[node] = await client.send(self.node, {'probe': True})
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                self.quiet_round = None
+                return
+        if any(status.get('terminated') for status in statuses.values()):
+            self.terminated = True
+        elif not all(status['idle'] for status in statuses.values()):
+            self.quiet_round = None
+        elif statuses == self.quiet_round:
+            self.terminated = True
+        else:
+            self.quiet_round = statuses
+        if self.terminated:
+            print('Distributed: all nodes idle, end of the crawl')
+
+    def message_received(self, node, message):
+        """
+        Handle a message of node: a batch of links, a probe or the end of the crawl
+
+        Return the reply, None: "ok"
+        """
+        if 'links' in message:
+            self.links_received(node, message['links'])
+        elif message.get('probe'):
+            return self.status()
+        elif message.get('terminated'):
+            self.terminated = True
+        return None
+
+    def links_received(self, node, urls):
+        """
+        Add the links forwarded by node
+        """
+        self.n_received += len(urls)
+        self.n_batches += 1
+        self.last_activity = time.monotonic()
+        FrontierManager.links_extracted(self, request=None, links=[requests.Request(url=url) for url in urls])
+
+    def links_extracted(self, request, links):
+        """
+        add the links of the node to crawl, forward the others
+
+        Ignored links are recorded by the node which found them
+        """
+        local = []
+        for req in links:
+            url = self.canonicalizer.canonical(req.url)
+            node = self.ring.node(url)
+            if node == self.node or self.in_ignore_seeds(req):
+                local.append(req)
+            elif url not in self.forwarded:
+                self.forwarded.add(url)
+                self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['linkstoforward']['TITLE'],
+                                           WeightedLink(url=url, notes=node))
+                urls = self.outbox[node]
+                urls.append(url)
+                if len(urls) >= DISTRIBUTED['BATCH_SIZE']:
+                    self.flush_event.set()
+        if local:
+            FrontierManager.links_extracted(self, request, local)
+        else:
+            self.save()
+
+    def get_next_requests(self, max_n_requests=MAX_N_REQUESTS):
+        next_requests = FrontierManager.get_next_requests(self, max_n_requests)
+        if next_requests:
+            self.last_activity = time.monotonic()
+        return next_requests
+
+    def page_crawled(self, response, page=None):
+        self.last_activity = time.monotonic()
+        FrontierManager.page_crawled(self, response, page)
+
+    def next_retry_delay(self):
+        """
+        Return the seconds before the crawler looks for requests again, None once the crawl is over on all the nodes
+
+        Links of the other nodes may come while the node has nothing to crawl
+        """
+        delay = FrontierManager.next_retry_delay(self)
+        if delay is None and self.terminated:
+            return None
+        return min(delay, DISTRIBUTED['FLUSH_INTERVAL']) if delay is not None else DISTRIBUTED['FLUSH_INTERVAL']
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    from collections import Counter
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hn:d", ["help", "nodes="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        nodes = DISTRIBUTED['NODES']
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-n", "--nodes"):
+                nodes = parse_nodes(arg)
+        if not nodes:
+            raise Usage(u'no nodes')
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    ring = HashRing(nodes)
+    for url in args:
+        print(ring.node(url), url)
+    # shard sizes of sample urls
+    shards = Counter(ring.node(u'https://www.nytimes3xbfgragh.onion/article/%d' % i) for i in range(100000))
+    print('Urls per node:', dict(shards))
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+u"""Document
+
+Parsed html document with pluggable parser backends
+  html.parser: BeautifulSoup with the python html parser
+  lxml: lxml.html tree, needs lxml
+  fast: single pass python html parser, no tree, only title, links and text
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 document.py [options] [file.html ...]
+
+Options:
+  -h, --help              show this help
+  -b ..., --backend=...   parser backend: html.parser, lxml or fast
+  -d                      show debugging information
+
+Examples:
+  python3 document.py --backend=fast /var/www/html/www.nytimes3xbfgragh.onion/256.html
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/04/01 19:05:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+from abc import ABC, abstractmethod
+from html.parser import HTMLParser
+
+# html parser
+from bs4 import BeautifulSoup
+from bs4.dammit import UnicodeDammit
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+from settings import PARSER_BACKEND
+
+# text of these elements is not page text
+NON_TEXT_TAGS = frozenset(['script', 'style', 'noscript', 'template', 'title', 'head'])
+
+class Document(ABC):
+    """
+    Document
+
+    A page parsed once, shared by the title, links, text and html users
+    Life Cycle: see main
+    """
+    backend = u''
+    # decoded html
+    html = u''
+    title = u''
+    # href of every a tag, in page order
+    hrefs = []
+    # page text
+    text = u''
+
+    def __init__(self, content, encoding=None):
+        """
+        Init with the raw page content (bytes) and its encoding if known
+        """
+        self.html = Document.decode(content, encoding)
+        self.parse()
+
+    @staticmethod
+    def decode(content, encoding=None):
+        """
+        Return content decoded with encoding, or with the detected encoding
+        """
+        if isinstance(content, str):
+            return content
+        if encoding:
+            try:
+                return content.decode(encoding, errors='replace')
+            except LookupError:
+                pass
+        return UnicodeDammit(content, is_html=True).unicode_markup or u''
+
+    @abstractmethod
+    def parse(self):
+        """
+        Parse html into the title, hrefs and text
+        """
+
+class SoupDocument(Document):
+    """
+    BeautifulSoup Document, html.parser backend
+    """
+    backend = u'html.parser'
+
+    def parse(self):
+        soup = BeautifulSoup(self.html, self.backend)
+        self.title = u''
+        titles = soup.find('title')
+        if titles is not None and titles.string is not None:
+            self.title = str(titles.string)
+        self.hrefs = [link.get('href') for link in soup.find_all('a') if link.get('href')]
+        body = soup.body if soup.body is not None else soup
+        self.text = u' '.join(s.strip() for s in body.find_all(string=True)
+                              if s.parent.name not in NON_TEXT_TAGS and s.strip())
+
+class LxmlDocument(Document):
+    """
+    lxml Document, lxml backend
+    """
+    backend = u'lxml'
+
+    def parse(self):
+        self.title = u''
+        self.hrefs = []
+        self.text = u''
+        if not self.html.strip():
+            return
+        # lxml refuses str with an encoding declaration
+        tree = lxml.html.document_fromstring(self.html.encode('utf-8'), parser=LxmlDocument.parser())
+        self.title = tree.findtext('.//title') or u''
+        self.hrefs = [href for href in tree.xpath('//a/@href') if href]
+        body = tree.find('body')
+        if body is None:
+            body = tree
+        self.text = u' '.join(s.strip() for s in body.xpath('.//text()[not(ancestor::script or ancestor::style'
+                                                            ' or ancestor::noscript or ancestor::template)]')
+                              if s.strip())
+
+    @staticmethod
+    def parser():
+        return lxml.html.HTMLParser(encoding='utf-8')
+
+class FastDocument(Document, HTMLParser):
+    """
+    Fast Document, fast backend
+
+    One pass over the html, no tree: only title, links and text
+    """
+    backend = u'fast'
+    # open non text elements
+    skip = 0
+    in_title = False
+
+    def parse(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.title = u''
+        self.hrefs = []
+        self.texts = []
+        self.skip = 0
+        self.in_title = False
+        self.feed(self.html)
+        self.close()
+        self.text = u' '.join(self.texts)
+        self.texts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.hrefs.append(value)
+                    break
+        elif tag == 'title':
+            self.in_title = True
+        elif tag in NON_TEXT_TAGS and tag != 'head':
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self.in_title = False
+        elif tag in NON_TEXT_TAGS and tag != 'head' and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif not self.skip:
+            data = data.strip()
+            if data:
+                self.texts.append(data)
+
+# parser backends, see settings PARSER_BACKEND
+DOCUMENT_BACKENDS = {
+    SoupDocument.backend: SoupDocument,
+    LxmlDocument.backend: LxmlDocument,
+    FastDocument.backend: FastDocument,
+}
+
+def available_backends():
+    """
+    Return the parser backends usable with the installed libraries
+    """
+    return [backend for backend in DOCUMENT_BACKENDS if backend != LxmlDocument.backend or lxml is not None]
+
+def open_document(content, encoding=None, backend=PARSER_BACKEND):
+    """
+    Parse content with backend, return a Document
+    """
+    if backend not in available_backends():
+        raise ValueError(u'Unknown or unavailable parser backend: ' + backend)
+    return DOCUMENT_BACKENDS[backend](content, encoding)
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hb:d", ["help", "backend="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        backend = PARSER_BACKEND
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-b", "--backend"):
+                backend = arg
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    if len(args)<1:
+        print("Arguments error")
+        print(__usage__)
+        sys.exit(2)
+
+    for file_name in args:
+        with open(file_name, 'rb') as f:
+            document = open_document(f.read(), backend=backend)
+        print(file_name, '-', document.title, '-', len(document.hrefs), 'links -', len(document.text), 'chars')
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
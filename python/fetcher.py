@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+u"""Fetcher
+
+asyncio fetch engine with bounded concurrency
+compatible with socks5h proxies, requests are spread over a pool of Tor circuits
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 fetcher.py [options] [url ...]
+
+Options:
+  -h, --help              show this help
+  -n ..., --concurrency=  number of concurrent requests
+  -d                      show debugging information
+
+Examples:
+  python3 fetcher.py -n 4 https://www.nytimes3xbfgragh.onion/ https://www.nytimes3xbfgragh.onion/section/nyregion
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/04/01 19:05:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# https requests
+import requests
+
+from settings import PROXIES, FETCH_CONCURRENCY, FETCH_TIMEOUT
+from settings import FETCH_CONTENT_TYPES, FETCH_MAX_BYTES, FETCH_CHUNK_SIZE
+from circuits import CircuitPool
+
+class ResponseBlocked(Exception):
+    """
+    Response not downloaded: content type not crawled or body too big
+    """
+    def __init__(self, url, reason, response=None):
+        Exception.__init__(self, url + u': ' + reason)
+        self.url = url
+        self.reason = reason
+        self.response = response
+
+def read_body(response, content_types=FETCH_CONTENT_TYPES, max_bytes=FETCH_MAX_BYTES):
+    """
+    Download the body of a streamed response, checking its headers first
+
+    Raise ResponseBlocked, the connection is closed without reading the rest of the body
+    Only 2xx bodies are checked: the body of an error or a redirect is cut at FETCH_CHUNK_SIZE bytes,
+    the caller sees its status code, eg. 503 retried later
+    """
+    if not 200 <= response.status_code < 300:
+        response._content = next(response.iter_content(FETCH_CHUNK_SIZE), b'')
+        response._content_consumed = True
+        response.close()
+        return
+    blocked = None
+    mime_type = response.headers.get('Content-Type', u'').split(';')[0].strip().lower()
+    length = response.headers.get('Content-Length', u'')
+    if mime_type and content_types and mime_type not in content_types:
+        blocked = u'Content-Type ' + mime_type
+    elif length.isdigit() and int(length) > max_bytes:
+        blocked = u'Content-Length ' + length
+    else:
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(FETCH_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                blocked = u'more than %d bytes' % max_bytes
+                break
+            chunks.append(chunk)
+    if blocked:
+        response.close()
+        raise ResponseBlocked(response.url, blocked, response)
+    response._content = b''.join(chunks)
+    response._content_consumed = True
+    response.close()
+
+class AsyncFetcher():
+    """
+    Async Fetcher
+
+    Fetches up to concurrency requests at the same time from an asyncio event loop.
+    Responses are streamed: bodies of other content types or too big are not downloaded.
+    requests/PySocks handle the socks5h proxies: each blocking get runs in a worker thread
+    through the next circuit of a CircuitPool, the event loop only waits for the responses.
+    Life Cycle: see main
+    """
+    proxies = PROXIES
+    headers = {}
+    concurrency = FETCH_CONCURRENCY
+    # seconds, connect and read timeout
+    timeout = FETCH_TIMEOUT
+    content_types = FETCH_CONTENT_TYPES
+    max_bytes = FETCH_MAX_BYTES
+
+    # worker threads, one per concurrent request
+    executor = None
+    # Tor circuits, see circuits.py
+    circuits = None
+
+    def __init__(self, proxies=PROXIES, headers={}, concurrency=FETCH_CONCURRENCY, timeout=FETCH_TIMEOUT, circuits=None,
+                 content_types=FETCH_CONTENT_TYPES, max_bytes=FETCH_MAX_BYTES):
+        """
+        Init, circuits: CircuitPool, TOR_CIRCUITS SIZE circuits through proxies if None
+        """
+        self.proxies = proxies
+        self.headers = headers
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.content_types = content_types
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='fetcher')
+        if circuits is None:
+            circuits = CircuitPool.from_proxies(proxies, headers=headers)
+        self.circuits = circuits
+
+    def get(self, url, headers=None):
+        """
+        Blocking get, runs in a worker thread
+
+        headers: request headers added to the session headers, eg. If-None-Match
+        Failing circuits are rotated by the CircuitPool
+        Raise ResponseBlocked if the body is not downloaded
+        """
+        return self.circuits.get(url, headers=headers, timeout=self.timeout,
+                                 read=lambda response: read_body(response, self.content_types, self.max_bytes))
+
+    async def fetch(self, request):
+        """
+        Fetch a request, return its response
+
+        Raise requests.RequestException on error, ResponseBlocked if the body is not downloaded
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.get, request.url, request.headers or None)
+
+    def close(self):
+        """
+        Wait for running requests and stop the worker threads
+        """
+        self.executor.shutdown(wait=True)
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+async def fetch_all(fetcher, urls):
+    """
+    Fetch urls concurrently, print their status code as they complete
+    """
+    tasks = [asyncio.ensure_future(fetcher.fetch(requests.Request(url=url))) for url in urls]
+    for task in asyncio.as_completed(tasks):
+        try:
+            response = await task
+            print(response.status_code, response.url, len(response.content), 'bytes')
+        except (requests.RequestException, ResponseBlocked) as e:
+            print('Failed to process request - Error:', e)
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hdn:", ["help", "concurrency="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        concurrency = FETCH_CONCURRENCY
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-n", "--concurrency"):
+                concurrency = int(arg)
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    if len(args)<1:
+        print("Arguments error")
+        print(__usage__)
+        sys.exit(2)
+
+    fetcher = AsyncFetcher(concurrency=concurrency)
+    asyncio.run(fetch_all(fetcher, args))
+    fetcher.close()
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
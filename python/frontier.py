@@ -9,10 +9,13 @@ __usage__ = u"""TODO - Usage: python3 frontier.py [options] [url]
 
 Options:
   -h, --help              show this help
+  -P ..., --profile=...   sampling profiler: write prefix.collapsed and prefix.txt, see profiler.py
+  --profile-window=...    [delay:]seconds profiled, default: the whole run
   -d                      show debugging information
 
 Examples:
   python3 frontier.py
+  python3 frontier.py -P /tmp/frontier -p /var/www
 """
 
 __author__ = u"M0t13y"
@@ -21,20 +24,34 @@ __date__ = u"$Date: 2021/05/01 11:45:00 $"
 __copyright__ = u"Copyright [" + __author__ + "]"
 __license__ = u"Licensed under the Apache License, Version 2.0"
 
-import os
-from pathlib import Path
+import time
+import random
+import hashlib
+from collections import Counter
 
 import requests    
 from datetime import datetime
 # url parser
-from urllib.parse import urljoin, urlparse, urlsplit
-# html parser
-from bs4 import BeautifulSoup
+from urllib.parse import urljoin, urlparse
 
-from settings import WWW_DIR, HTML_DIR, WORKBOOK, MAX_N_REQUESTS, SEEDS
+from settings import WWW_DIR, WORKBOOK, MAX_N_REQUESTS, SEEDS
+from settings import DEFAULT_WEIGHT, SEED_WEIGHT, INLINK_WEIGHT, RETRY, BACKEND, IGNORE_PATHS
 from workbook import CrawlWorkbook
 from link import WeightedLink
+from scheduler import IndexedHeap
+from backend import open_backend, link_weight
+from revisit import RevisitScheduler
+from urlfilter import UrlFilter
+from simhash import SimHashIndex
+from canonical import UrlCanonicalizer
+from pageparser import parse_page
+from pagestore import PageStore
 from search import SearchEngine
+from metrics import STAGE_SECONDS, PAGES, ERRORS, FRONTIER_URLS
+from profiler import profiled
+
+# client errors of pages that are gone: ignored, other client errors are retried then failed
+GONE_STATUS_CODES = frozenset([404, 410])
 
 class FrontierManager():
     """
@@ -50,80 +67,150 @@ class FrontierManager():
     links_done = []
 
     # /! Will have to go in a Frontera Middleware at some point
-    # weighted links to crawl
-    weighted_links = None
-    # weighted links crawled
-    weighted_links_done = []
+    # Frontier state is indexed by url for O(1) membership, insert and removal
+    # weighted links to crawl (in progress included) and crawled, see backend.py
+    backend = None
     # weighted    
     ignore_seeds = []
-    # weighted    
-    ignored_pages = []
-
-    requests = []
-    requests_done = []
+    # ignore seeds compiled, see in_ignore_seeds
+    ignore_filter = None
+    # weighted - {url: WeightedLink}
+    ignored_pages = {}
+    # conditional GET validators of crawled pages - {url: WeightedLink}
+    #   title: ETag, date: Last-Modified, notes: sha256 of the body
+    page_validators = {}
+    # validators of the pages waiting in the search engine bulk buffer - {indexed url: WeightedLink}
+    #   journaled once the pages are indexed: a crash before does not leave them to 304 on recrawl
+    unindexed_validators = {}
+    # recrawled pages not modified: not parsed, saved nor indexed again
+    unchanged_pages = 0
+    # SimHash of crawled pages - {url: WeightedLink}
+    #   title: fingerprint (hex), notes: url of the page it duplicates
+    page_fingerprints = {}
+    # fingerprints of the saved and indexed pages, near-duplicates are looked up in it
+    simhash_index = None
+
+    # requests returned by get_next_requests, not crawled yet - {url: requests.Request}
+    requests_in_progress = {}
+    # failed requests waiting for their retry, earliest first - IndexedHeap {url: requests.Request}, priority: -due time
+    retries = None
+    # failed attempts of the urls to crawl - {url: attempts}
+    failures = {}
+    # dead letters, urls failing RETRY MAX_ATTEMPTS times - {url: WeightedLink}
+    #   title: last error, notes: attempts
+    failed_pages = {}
+    # failed requests by error class - Counter {error_code: count}
+    error_counts = None
+    # change rates and revisits of the crawled pages, see revisit.py
+    revisits = None
+    # crawl the crawled pages again when their revisit is due, do not stop
+    continuous = False
+
+    # links are canonicalised before membership checks
+    canonicalizer = None
+    # pages to crawl dropped because a redirect already fetched them
+    aliased_fetches = 0
         
     max_n_requests = 10
 
     searchengine = None
+    # pages are sent to the search engine, False: crawl only, eg. benchmarks
+    index = True
         
     crawl_book = None
+
+    # raw fetched pages
+    page_store = None
     
     url_base = ''
     
     # /! def __init__(self, settings=SETTINGS, seeds=SETTINGS['SEEDS']):
-    def __init__(self, seeds=[]):
+    def __init__(self, seeds=[], path=WWW_DIR, index=True, backend=BACKEND['NAME'], continuous=False):
         """ init with seeds
         
         Init with seeds
-        Create/Open a file for storing progress
+        Create/Open a file for storing progress in path
+        index: send the crawled pages to the search engine
+        backend: storage of the links to crawl and crawled, see backend.py
+        continuous: revisit the crawled pages, see revisit.py
         """
         #self.settings = settings
-        url = next(iter(SEEDS))
+        url = seeds[0].url if seeds else next(iter(SEEDS))
         parsed_uri = urlparse(url)
         self.url_base = '{uri.scheme}://{uri.netloc}/'.format(uri=parsed_uri)
+        self.canonicalizer = UrlCanonicalizer(seeds=[seed.url for seed in seeds])
+        self.aliased_fetches = 0
 
-        self.searchengine = SearchEngine()
-        self.searchengine.db_connect()
+        self.index = index
+        if self.index:
+            self.searchengine = SearchEngine()
+            self.searchengine.db_connect()
 
-        self.crawl_book = CrawlWorkbook(path=WWW_DIR, url=seeds[0].url)
+        self.crawl_book = CrawlWorkbook(path=path, url=url)
         self.crawl_book.wb_open()
+        self.page_store = PageStore(self.crawl_book.html_pages_path).open()
 
         # /! Will have to go in a Frontera Middleware at some point
         # retrieve weighted_links, weighted_links_done...
-        self.weighted_links = self.crawl_book.weighted_links        
-        self.weighted_links_done = self.crawl_book.weighted_links_done       
+        self.backend = open_backend(backend, self.crawl_book)
         self.ignore_seeds =  self.crawl_book.ignore_seeds
-        self.ignored_pages =  self.crawl_book.ignored_pages
+        self.ignored_pages = FrontierManager.index_links(self.crawl_book.ignored_pages)
+        self.page_validators = FrontierManager.index_links(self.crawl_book.page_validators)
+        self.unindexed_validators = {}
+        self.unchanged_pages = 0
+        self.page_fingerprints = FrontierManager.index_links(self.crawl_book.page_fingerprints)
+        self.simhash_index = SimHashIndex()
+        for url, wl in self.page_fingerprints.items():
+            # 0: no fingerprint, page too short, see page_duplicate
+            if not wl.notes and int(wl.title, 16):
+                self.simhash_index.add(url, int(wl.title, 16))
       
         self.add_seeds(seeds)
 
-        # build requests from weighted_links
-        for wl in self.weighted_links:
-            self.requests.append(requests.Request(url=wl.url))
-        for wl in self.weighted_links_done:
-            self.requests_done.append(requests.Request(url=wl.url))
-
-        # ignore list
-        ignore_suffixes = ['/es/', '/fr/', '/ca/', '/newsletters', '/2021/',
-                        '/2020/01/', '/2020/02/', '/2020/03/', '/2020/04/', '/2020/05/', '/2020/06/',
-                        '/2020/07/', '/2020/08/', '/2020/09/', '/2020/10/',
-                        '/2019/', '/2018/', '/2017/', '/2016/', '/2015/', '/2014/',
-                        '/section/world', '/video/world', '/section/food', '/section/arts',
-                        '/section/sports', '/section/science', '/section/books', '/section/travel', 
-                        '/section/realestate', '/section/fashion', '/section/technology',
-                        '/section/politics', '/section/business', '/section/style', '/section/well',
-                        '/section/style/love', '/section/us', '/section/video', '/section/interactive',
-                        '/section/magazine', '/international',
-                        '/section/t-magazine', '/section/live', '/live', '/video', '/interactive',
-                        '/issue/fashion',
-                        '/subscription', '/subscriptions',
-                        '/section/business/dealbook', '/pages/business/dealbook',
-                        '/privacy'
-                        ]
+        self.requests_in_progress = {}
+        self.retries = IndexedHeap()
+        self.failures = {}
+        self.failed_pages = FrontierManager.index_links(self.crawl_book.failed_pages)
+        self.error_counts = Counter()
+        self.continuous = continuous
+        self.revisits = RevisitScheduler()
+        self.revisits.load(self.crawl_book.page_revisits)
+
+        # ignore seeds of a new crawl: IGNORE_PATHS, the ignore_paths middleware may add more
         if not self.ignore_seeds:
-            self.ignore_seeds = [WeightedLink(url=urljoin(self.url_base, suffix)) for suffix in ignore_suffixes]
-            self.crawl_book.ws_writerows(WORKBOOK['crawler']['worksheet']['ignoreseeds']['TITLE'], self.ignore_seeds)
+            self.set_ignore_seeds([WeightedLink(url=urljoin(self.url_base, path)) for path in IGNORE_PATHS])
+        self.ignore_filter = UrlFilter.from_weighted_links(self.ignore_seeds)
+
+        # frontier sizes, read when the metrics are exposed
+        for state, size in [('to_crawl', lambda: self.backend.queued()), ('in_progress', lambda: len(self.requests_in_progress)),
+                            ('done', lambda: self.backend.done_count()), ('retries', lambda: len(self.retries)),
+                            ('failed', lambda: len(self.failed_pages)), ('ignored', lambda: len(self.ignored_pages)),
+                            ('revisits', lambda: len(self.revisits))]:
+            FRONTIER_URLS.set_function(size, state=state)
         
+    @staticmethod
+    def index_links(weighted_links):
+        """
+        Return weighted links indexed by url: {url: WeightedLink}
+
+        Keeps the first occurrence of an url, in worksheet order
+        """
+        index = {}
+        if weighted_links:
+            for wl in weighted_links:
+                if wl.url and wl.url not in index:
+                    index[wl.url] = wl
+        return index
+
+    @staticmethod
+    def link_weight(weighted_link):
+        """
+        Return the weight of a weighted link as a float
+
+        Weights loaded from a workbook may be empty
+        """
+        return link_weight(weighted_link)
+
     def add_seeds(self, seeds):
         """
         add seeds
@@ -131,74 +218,384 @@ class FrontierManager():
         /! not append
         """
         self.seeds = seeds
-        if self.weighted_links is None:
-            self.weighted_links = [WeightedLink(url=seed.url) for seed in self.seeds]
-        if self.weighted_links is not None and len(self.weighted_links) == 0:
-            self.weighted_links = [WeightedLink(url=seed.url) for seed in self.seeds]
+        if not len(self.backend):
+            self.backend.add(FrontierManager.index_links([WeightedLink(url=self.canonicalizer.canonical(seed.url), weight=SEED_WEIGHT)
+                                                          for seed in self.seeds]).values())
         
-    def request_error(request, error_code):
+    def set_ignore_seeds(self, ignore_seeds):
         """
-        TODO
+        Replace the ignore seeds (prefixes or regexps), see in_ignore_seeds
         """
-        pass
+        self.ignore_seeds = ignore_seeds
+        self.crawl_book.ws_writerows(WORKBOOK['crawler']['worksheet']['ignoreseeds']['TITLE'], self.ignore_seeds)
+        self.ignore_filter = UrlFilter.from_weighted_links(self.ignore_seeds)
+
+    def page_request(self, url):
+        """
+        Return the request of url, conditional (If-None-Match, If-Modified-Since) if the page was crawled
+        """
+        headers = {}
+        validators = self.page_validators.get(url)
+        if validators is not None:
+            if validators.title:
+                headers['If-None-Match'] = validators.title
+            if validators.date:
+                headers['If-Modified-Since'] = validators.date
+        return requests.Request(url=url, headers=headers)
+
+    def recrawl(self):
+        """
+        Put the crawled pages back in the pages to crawl
+
+        Their requests are conditional: pages not modified cost a 304 response or are not parsed again
+        """
+        done = self.backend.clear_done()
+        self.backend.add(done)
+        print('Frontier: recrawl', len(done), 'pages')
+        self.save()
+
+    def save(self):
+        """
+        Make the frontier state durable: backend and workbook journal
+        """
+        self.backend.flush()
+        self.crawl_book.wb_save()
+
+    @staticmethod
+    def retry_delay(attempts):
+        """
+        Return the seconds before retrying a request failed attempts times: exponential backoff with jitter
+        """
+        delay = min(RETRY['MAX_DELAY'], RETRY['BASE_DELAY'] * 2 ** (attempts - 1))
+        return delay * random.uniform(1 - RETRY['JITTER'], 1 + RETRY['JITTER'])
+
+    def request_error(self, request, error_code):
+        """
+        Schedule the retry of a failed request, with exponential backoff
+
+        After RETRY MAX_ATTEMPTS failed attempts the page goes to the Failed pages worksheet
+        """
+        url = request.url
+        self.error_counts[error_code] += 1
+        ERRORS.inc(error=error_code)
+        req = self.requests_in_progress.pop(url, None)
+        wl = self.backend.get([url]).get(url) if req else None
+        if not req or not wl:
+            return
+        attempts = self.failures.get(url, 0) + 1
+        if attempts < RETRY['MAX_ATTEMPTS']:
+            self.failures[url] = attempts
+            delay = FrontierManager.retry_delay(attempts)
+            self.retries.push(url, req, -(time.monotonic() + delay))
+            PAGES.inc(outcome='retried')
+            print('Frontier: retry', url, 'in %.0fs, attempt' % delay, attempts + 1, '-', error_code)
+        else:
+            self.failures.pop(url, None)
+            self.backend.remove([url])
+            failed = WeightedLink(url=url, title=error_code, weight=wl.weight, notes=u'%d attempts' % attempts)
+            self.failed_pages[url] = failed
+            self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['failedpages']['TITLE'], failed)
+            self.revisits.forget(url)
+            self.crawl_book.ws_removeln(WORKBOOK['crawler']['worksheet']['pagerevisits']['TITLE'], url)
+            self.save()
+            PAGES.inc(outcome='failed')
+            print('Frontier: failed', url, 'after', attempts, 'attempts -', error_code)
+        print('Frontier: errors', dict(self.error_counts))
+
+    def request_blocked(self, request, reason):
+        """
+        The response of request was not downloaded (content type, size): record it in the ignored pages
+
+        Ignored pages are never scheduled again
+        """
+        url = request.url
+        self.requests_in_progress.pop(url, None)
+        self.failures.pop(url, None)
+        self.backend.remove([url])
+        ignored = WeightedLink(url=url, notes=reason)
+        self.ignored_pages[url] = ignored
+        self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE'], ignored)
+        self.revisits.forget(url)
+        self.crawl_book.ws_removeln(WORKBOOK['crawler']['worksheet']['pagerevisits']['TITLE'], url)
+        self.save()
+        PAGES.inc(outcome='blocked')
+        print('Frontier: blocked', url, '-', reason)
+
+    def retries_due(self):
+        """
+        Move the retries that are due back to the links to crawl
+        """
+        now = time.monotonic()
+        due = []
+        while self.retries and -self.retries.priority(self.retries.peek()[0]) <= now:
+            due.append(self.retries.pop()[0])
+        if due:
+            self.backend.requeue(due)
+
+    def revisits_due(self):
+        """
+        Move the crawled pages due for a revisit back to the pages to crawl, in continuous mode
+        """
+        if not self.continuous:
+            return
+        urls = self.revisits.due(busy=lambda url: url in self.requests_in_progress or url in self.retries)
+        links = self.backend.remove_done(urls)
+        if links:
+            self.backend.add(links)
+            self.save()
+            print('Frontier: revisit', len(links), 'pages')
+
+    def next_retry_delay(self):
+        """
+        Return the seconds before the next retry (or revisit in continuous mode) is due, None if none is waiting
+        """
+        delays = []
+        if self.retries:
+            delays.append(max(0.0, -self.retries.priority(self.retries.peek()[0]) - time.monotonic()))
+        if self.continuous and self.revisits:
+            delays.append(self.revisits.next_due_delay())
+        return min(delays) if delays else None
                 
     def start(self):
         # should open workbook as well
-        self.searchengine.db_connect()
+        # the search engine connection pool is only created once
+        if self.index:
+            self.searchengine.db_connect()
+
+    async def connect(self):
+        """
+        Start the frontier tasks of the crawl event loop, none here, see ShardedFrontier
+        """
+        pass
+
+    async def disconnect(self):
+        pass
 
     def stop(self):
-        # should save workbook, maybe init values with as well
-        self.searchengine.db_close()
+        # index the buffered pages before their validators are saved
+        self.index_flush(force=True)
+        # save the crawler state
+        self.backend.close()
+        self.crawl_book.wb_close()
+        self.page_store.close()
+        if self.index:
+            self.searchengine.db_close()
       
     def finished(self):
         """
         Quick check if crawling is finished. Called pretty often, please make sure calls are lightweight.
         """
-        return not self.weighted_links
+        return not len(self.backend) and not self.retries and not (self.continuous and self.revisits)
 
-    def page_save_to_file(self, request, soup):
+    def page_save_to_file(self, request, response):
         """
-        save page to a #.html file where # is the title crc32
+        save the raw response bytes to the page store, compressed, under id SearchEngine.hash_url
         TODO: save request
         """
-        # eg. /var/www/html/apple.com/256.html
-        url_hash = SearchEngine.hash_url(request.url)
-        file_name = os.path.join(HTML_DIR, urlsplit(request.url).netloc, str(url_hash) + '.html') 
-        print(file_name)            
-        os.makedirs(os.path.join(HTML_DIR, urlsplit(request.url).netloc), exist_ok=True)
-        f = open(file_name, 'w')
-        f.write(soup.prettify())
-        f.close()
+        # eg. /var/www/html/apple.com/pages/00.seg
+        with STAGE_SECONDS.time(stage='save'):
+            url_hash = self.page_store.put(request.url, response.content, response.encoding)
+        print('Page store:', url_hash)
 
-    def page_crawled(self, response):
+    @staticmethod
+    def requested_url(response):
         """
-        This method is called every time a page has been crawled.
+        Return the url requested, before redirects
         """
-        self.requests_done.append(response.request)
-        self.requests = [req for req in self.requests if req.url != response.request.url]
+        return response.history[0].request.url if response.history else response.request.url
 
-        html_doc = response.text
-        soup = BeautifulSoup(html_doc, 'html.parser')
-        title = u''
-        if soup is not None:            
-            titles = soup.find('title')
-            if titles is not None:
-                title = titles.string
-        
-        # extract first weighted link matchinq response.request.url
-        wl = next((x for x in self.weighted_links if x.url == response.request.url), None)
-        if wl:
-            self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['crawledpages']['TITLE'], wl)
-            self.crawl_book.wb_save()
-            
-        # update weighted_links from resquests
-        self.weighted_links = [wl for wl in self.weighted_links if wl.url != response.request.url]
-        
-        self.crawl_book.ws_writerows(WORKBOOK['crawler']['worksheet']['tocrawlpages']['TITLE'], self.weighted_links)
+    @staticmethod
+    def body_hash(response):
+        """
+        Return the sha256 of the body, computed once per response: the crawler and the frontier both need it
+        """
+        digest = getattr(response, 'body_hash', None)
+        if digest is None:
+            digest = response.body_hash = hashlib.sha256(response.content).hexdigest()
+        return digest
+
+    def page_unchanged(self, response, url=None, digest=None):
+        """
+        Return True if a recrawled page was not modified: 304 response or same body as last crawl
+        digest: body_hash of the response
+        """
+        if response.status_code == 304:
+            return True
+        if url is None:
+            url = self.requested_url(response)
+            if url not in self.page_validators:
+                url = self.canonicalizer.canonical(url)
+        validators = self.page_validators.get(url)
+        if validators is None:
+            return False
+        return validators.notes == (digest or FrontierManager.body_hash(response))
+
+    def page_validated(self, url, response, digest):
+        """
+        Store the validators of a crawled page, sent when it is recrawled
+
+        digest: body_hash of the response
+        Return the WeightedLink of the Page validators worksheet, not journaled yet: see page_crawled
+        """
+        wl = WeightedLink(url=url, title=response.headers.get('ETag', u''),
+                          date=response.headers.get('Last-Modified', u''), notes=digest)
+        self.page_validators[url] = wl
+        return wl
+
+    def pages_indexed(self, indexed_urls, dropped_urls=[]):
+        """
+        Journal the validators of the pages the search engine indexed
+
+        The validators of the dropped pages are forgotten: they are fetched in full and indexed on recrawl
+        """
+        for indexed_url in indexed_urls:
+            wl = self.unindexed_validators.pop(indexed_url, None)
+            if wl is not None:
+                self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['pagevalidators']['TITLE'], wl)
+        for dropped_url in dropped_urls:
+            wl = self.unindexed_validators.pop(dropped_url, None)
+            if wl is not None:
+                self.page_validators.pop(wl.url, None)
+                self.crawl_book.ws_removeln(WORKBOOK['crawler']['worksheet']['pagevalidators']['TITLE'], wl.url)
+
+    def index_flush(self, force=False):
+        """
+        Send the pages of the search engine bulk buffer once they are due (BULK_INTERVAL), all of them if force
+        Called from the crawl loop: buffered pages are indexed while the crawl waits, eg. retries or revisits
+        """
+        if not self.index:
+            return
+        delay = self.searchengine.db_bulk_delay()
+        if delay is None or (delay > 0 and not force):
+            return
+        with STAGE_SECONDS.time(stage='index'):
+            indexed_urls, dropped_urls = self.searchengine.db_bulk_flush()
+        self.pages_indexed(indexed_urls, dropped_urls)
+        if indexed_urls:
+            self.save()
+
+    def next_index_delay(self):
+        """
+        Return the seconds before the search engine bulk buffer is due, None if it is empty or not indexing
+        """
+        if not self.index:
+            return None
+        return self.searchengine.db_bulk_delay()
+
+    def page_duplicate(self, url, page):
+        """
+        Return the url of the indexed page the page at url is a near-duplicate of, None if not a duplicate
+
+        The fingerprint is stored, with the url of the page it duplicates
+        """
+        duplicate = None
+        self.simhash_index.remove(url)
+        if page.fingerprint:
+            nearest = self.simhash_index.find(page.fingerprint, exclude=url)
+            if nearest is None:
+                self.simhash_index.add(url, page.fingerprint)
+            else:
+                duplicate = nearest[0]
+        wl = WeightedLink(url=url, title='%016x' % page.fingerprint, notes=duplicate or u'')
+        self.page_fingerprints[url] = wl
+        self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['pagefingerprints']['TITLE'], wl)
+        return duplicate
+
+    def page_crawled(self, response, page=None):
+        """
+        This method is called every time a page has been crawled.
+
+        page is the ParsedPage of the response, the response is parsed here if None
+        Recrawled pages not modified are not parsed, saved nor indexed again
+        Near-duplicates of an indexed page are not saved nor indexed, their links are still crawled
+        Client errors (4xx) are not pages, see page_client_error
+        """
+        if 400 <= response.status_code < 500:
+            self.page_client_error(response)
+            return
+        url = self.request_crawled(self.requested_url(response))
+        self.failures.pop(url, None)
+        response_url = response.request.url
+        digest = self.body_hash(response)
+        unchanged = self.page_unchanged(response, url, digest)
+
+        if page is None and not unchanged:
+            with STAGE_SECONDS.time(stage='parse'):
+                page = parse_page(response_url, response.content, response.encoding, self.url_base)
         
-        self.page_save_to_file(request=response.request, soup=soup)
+        # move the weighted link of the requested url to the crawled pages
+        self.backend.add_done(self.backend.remove([url]) or [WeightedLink(url=url)])
+        self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['pagerevisits']['TITLE'],
+                                   self.revisits.visited(url, not unchanged, response.headers.get('Last-Modified')))
+        if unchanged:
+            self.unchanged_pages += 1
+            self.save()
+            PAGES.inc(outcome='unchanged')
+            print('Frontier: not modified', url, '-', self.unchanged_pages, 'unchanged pages')
+            return
+        validators = self.page_validated(url, response, digest)
+        canonical_url = self.canonicalizer.canonical(response_url)
+        if canonical_url != url:
+            self.redirect_aliased(canonical_url, url)
+        duplicate = self.page_duplicate(url, page)
+
+        if duplicate or not self.index:
+            self.crawl_book.ws_writeln(WORKBOOK['crawler']['worksheet']['pagevalidators']['TITLE'], validators)
+        else:
+            # journaled once the page is indexed
+            self.unindexed_validators[response_url] = validators
+        self.save()
+
+        if duplicate:
+            PAGES.inc(outcome='duplicate')
+            print('Frontier: near-duplicate', url, 'of', duplicate)
+        else:
+            PAGES.inc(outcome='crawled')
+            self.page_save_to_file(request=response.request, response=response)
+            if self.index:
+                with STAGE_SECONDS.time(stage='index'):
+                    indexed_urls, dropped_urls = self.searchengine.db_bulk_add(title=page.title, url=response_url, body=page.text)
+                self.pages_indexed(indexed_urls, dropped_urls)
+                if indexed_urls:
+                    self.save()
         
-        print('Frontier: ', len(self.requests), 'pages to crawl -', len(self.requests_done), 'crawled pages -', len(self.ignored_pages), 'ignored pages')
+        print('Frontier: ', self.backend.queued(), 'pages to crawl -', self.backend.done_count(), 'crawled pages -', len(self.ignored_pages), 'ignored pages -',
+              self.canonicalizer.saved_fetches() + self.aliased_fetches, 'fetches saved by canonicalisation')
+
+    def page_client_error(self, response):
+        """
+        The response is a client error (4xx): gone pages (GONE_STATUS_CODES) are ignored,
+        other client errors, eg. 403, are retried then failed
+        """
+        url = self.requested_url(response)
+        if url not in self.requests_in_progress:
+            url = self.canonicalizer.canonical(url)
+        request = requests.Request(url=url)
+        if response.status_code in GONE_STATUS_CODES:
+            self.request_blocked(request, u'HTTP %d %s' % (response.status_code, response.reason))
+        else:
+            self.request_error(request, u'HTTPError %d' % response.status_code)
+
+    def request_crawled(self, url):
+        """
+        Remove a crawled url from the requests in progress, return its frontier url (in progress or to crawl)
+
+        Prepared requests may differ from the frontier url, eg. urls of a journal written before canonicalisation
+        """
+        for frontier_url in (url, self.canonicalizer.canonical(url)):
+            if self.requests_in_progress.pop(frontier_url, None) is not None or self.backend.contains([frontier_url]):
+                return frontier_url
+        return self.canonicalizer.canonical(url)
+
+    def redirect_aliased(self, target_url, url):
+        """
+        url was redirected to target_url: target_url is crawled too, links to it are not fetched again
+        """
+        if target_url in self.requests_in_progress or self.backend.contains_done([target_url]):
+            return
+        if self.backend.remove([target_url]):
+            self.aliased_fetches += 1
+        self.backend.add_done([WeightedLink(url=target_url, notes=u'redirected from ' + url)])
         
     def get_next_requests(self, max_n_requests=MAX_N_REQUESTS):
         """
@@ -209,49 +606,78 @@ class FrontierManager():
 
         Returns:	
 
-        list of weighted links.
+        list of requests, highest weight first.
+        Returned requests are in progress until page_crawled or request_error is called.
+        Failed requests are returned again once their retry is due.
         """
-        # return first max_n_requests links
-        return self.requests[:max_n_requests]
-        #return self.weighted_links[:max_n_requests]
+        self.retries_due()
+        self.revisits_due()
+        next_requests = []
+        for wl in self.backend.pop(max_n_requests):
+            req = self.page_request(wl.url)
+            self.requests_in_progress[wl.url] = req
+            next_requests.append(req)
+        return next_requests
         
     def in_ignore_seeds(self, link):
         """
-        returns True if link (request) is in self.ignore_seeds
+        returns the matching ignore seed (prefix or regexp) if link (request) is in self.ignore_seeds
         """        
-        return next((x for x in self.ignore_seeds if link.url.startswith(x.url)), None)
+        return self.ignore_filter.match(link.url)
 
     def in_ignored_pages(self, link):
         """
         returns True if link (request) is in self.ignored_pages
         """        
-        return next((x for x in self.ignored_pages if x.url == link.url), None)
+        return self.ignored_pages.get(link.url)
 
 
     def links_extracted(self, request, links):
         """
         add links to crawl found in response (from request)
+
+        links are canonicalised first, ignore seeds match the link or its canonical url
         """
         print('Frontier: links_extracted')
+        with STAGE_SECONDS.time(stage='links'):
+            self.add_links(links)
+        self.save()
+
+    def add_links(self, links):
+        """
+        Canonicalise and filter links, add the new ones to crawl
+
+        The backend is queried and updated once for all the links
+        """
+        ignored_wsname = WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE']
+        urls = []
         for req in links:
-            already_there = False
-            if self.in_ignore_seeds(req):
+            url = self.canonicalizer.canonical_link(req.url)
+            ignored = self.in_ignore_seeds(req)
+            if url != req.url:
+                req = requests.Request(url=url)
+            if ignored or self.in_ignore_seeds(req):
                 if not self.in_ignored_pages(req):
-                    self.ignored_pages.append(WeightedLink(url=req.url))
-            else:
-                # extract first request matchinq request.url
-                inreqs = next((x for x in self.requests if x.url == req.url), None)
-                if not inreqs:
-                    # extract first request matchinq request.url
-                    inreqsdone = next((x for x in self.requests_done if x.url == req.url), None)
-                    if not inreqsdone:
-                        self.requests.append(req)
-                        self.weighted_links.append(WeightedLink(url=req.url))
-
-        wbwsname = WORKBOOK['crawler']['worksheet']['tocrawlpages']['TITLE']
-        self.crawl_book.ws_writerows(wbwsname, self.weighted_links)
-        wbwsname = WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE']
-        self.crawl_book.ws_writerows(wbwsname, self.ignored_pages)
+                    wl = WeightedLink(url=req.url)
+                    self.ignored_pages[req.url] = wl
+                    self.crawl_book.ws_writeln(ignored_wsname, wl)
+            elif (req.url not in self.requests_in_progress and req.url not in self.retries
+                  and req.url not in self.failed_pages and not self.in_ignored_pages(req)):
+                urls.append(req.url)
+        if not urls:
+            return
+        to_crawl = self.backend.get(urls)
+        done = self.backend.contains_done(urls)
+        added = {}
+        for url in urls:
+            wl = added.get(url) or to_crawl.get(url)
+            if wl is not None:
+                # found in one more page: crawl it sooner
+                wl.weight = FrontierManager.link_weight(wl) + INLINK_WEIGHT
+                added[url] = wl
+            elif url not in done:
+                added[url] = WeightedLink(url=url, weight=DEFAULT_WEIGHT)
+        self.backend.add(added.values())
             
             
 class Usage(Exception):
@@ -268,11 +694,13 @@ def main(argv=None):
 
     try:
         try:                                
-            opts, args = getopt.getopt(argv, "hup:d", ["help", "url=", "path="])
+            opts, args = getopt.getopt(argv, "hup:dP:", ["help", "url=", "path=", "profile=", "profile-window="])
         except getopt.error as msg:
              raise Usage(msg)            
         url = u'http://localhost'
         path = u'/var/www'
+        profile = None
+        profile_window = None
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 print(__usage__)                   
@@ -284,6 +712,10 @@ def main(argv=None):
                 url = arg               
             elif opt in ("-p", "--path"):
                 path = arg               
+            elif opt in ("-P", "--profile"):
+                profile = arg
+            elif opt == "--profile-window":
+                profile_window = arg
     except Usage as err:
         print >>sys.stderr, err.msg
         print >>sys.stderr, "for help use --help"
@@ -294,66 +726,66 @@ def main(argv=None):
         print(__usage__)
         sys.exit(2)
 
-    w_l_00 = WeightedLink(u'https://www.apple.xlsx/',
-                      u'New York Times',
-                      datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                      1024,
-                      u'bla bla')
+    with profiled(profile, profile_window):
+        w_l_00 = WeightedLink(u'https://www.apple.xlsx/',
+                          u'New York Times',
+                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          1024,
+                          u'bla bla')
                       
-    w_l_01 = WeightedLink(u'https://www.apple.xlsx/mehpage',
-                      u'New York Times - Meh',
-                      datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                      0.1,
-                      u'meh')
+        w_l_01 = WeightedLink(u'https://www.apple.xlsx/mehpage',
+                          u'New York Times - Meh',
+                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          0.1,
+                          u'meh')
                       
-    w_l_02 = WeightedLink(u'https://www.apple.xlsx/megapage',
-                      u'New York Times - mega',
-                      datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                      2048,
-                      u'mega bla bla')
-    w_l_03 = WeightedLink(u'https://www.apple.xlsx/useless',
-                      u'New York Times - useless',
-                      datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                      2048,
-                      u'mega no no')
-    w_l_04 = WeightedLink(u'https://www.apple.xlsx/nopage',
-                      u'New York Times - mega',
-                      datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                      2048,
-                      u'no no')
+        w_l_02 = WeightedLink(u'https://www.apple.xlsx/megapage',
+                          u'New York Times - mega',
+                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          2048,
+                          u'mega bla bla')
+        w_l_03 = WeightedLink(u'https://www.apple.xlsx/useless',
+                          u'New York Times - useless',
+                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          2048,
+                          u'mega no no')
+        w_l_04 = WeightedLink(u'https://www.apple.xlsx/nopage',
+                          u'New York Times - mega',
+                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          2048,
+                          u'no no')
     
-    cwb = CrawlWorkbook(path, url)
-    cwb.wb_open()
-
-    wbwsname = WORKBOOK['crawler']['worksheet']['crawledpages']['TITLE']
-    cwb.ws_writeln(wbwsname, w_l_00)
-    cwb.wb_save()
-
-    wbwsname = WORKBOOK['crawler']['worksheet']['tocrawlpages']['TITLE']
-    cwb.ws_appendrows(wbwsname, [ w_l_01, w_l_02 ])
-
-    wbwsname = WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE']
-    cwb.ws_writerows(wbwsname, [ w_l_03, w_l_04 ])
-
-    from settings import SEEDS
-    frontier = FrontierManager(seeds=[requests.Request(url=url) for url in SEEDS])
-    print('--- Tests ---')
-    print('------')
-    print(frontier.seeds[0].url)
-    print('------')
-    print(frontier.requests[0].url)
-    print(len(frontier.requests))
-    print(len(frontier.requests_done))
-
-    print('------')
-    print(frontier.weighted_links)
-    wl = next((x for x in frontier.weighted_links if x.url == 'https://www.apple.xlsx/mehpage'), None)
-    print('------')
-    print(wl)
-    frontier.weighted_links = [wl for wl in frontier.weighted_links if wl.url != 'https://www.apple.xlsx/mehpage']
-    print('------')
-    print(frontier.weighted_links)
-    print('--- End Tests ---')
+        cwb = CrawlWorkbook(path, url)
+        cwb.wb_open()
+
+        wbwsname = WORKBOOK['crawler']['worksheet']['crawledpages']['TITLE']
+        cwb.ws_writeln(wbwsname, w_l_00)
+        cwb.wb_save()
+
+        wbwsname = WORKBOOK['crawler']['worksheet']['tocrawlpages']['TITLE']
+        cwb.ws_appendrows(wbwsname, [ w_l_01, w_l_02 ])
+
+        wbwsname = WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE']
+        cwb.ws_writerows(wbwsname, [ w_l_03, w_l_04 ])
+
+        from settings import SEEDS
+        frontier = FrontierManager(seeds=[requests.Request(url=url) for url in SEEDS])
+        print('--- Tests ---')
+        print('------')
+        print(frontier.seeds[0].url)
+        print('------')
+        print(frontier.backend.name)
+        print(len(frontier.backend))
+        print(frontier.backend.done_count())
+
+        print('------')
+        wl = frontier.backend.get(['https://www.apple.xlsx/mehpage']).get('https://www.apple.xlsx/mehpage')
+        print('------')
+        print(wl)
+        frontier.backend.remove(['https://www.apple.xlsx/mehpage'])
+        print('------')
+        print([wl.url for wl in frontier.backend.pop(MAX_N_REQUESTS)])
+        print('--- End Tests ---')
     
 if __name__ == "__main__":
     import sys
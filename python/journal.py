@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+u"""Journal
+
+Append-only, crash-safe journal of the Crawler state
+Live persistence layer behind the CrawlWorkbook
+Life cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 journal.py [options] [file]
+
+Options:
+  -h, --help              show this help
+  -d                      show debugging information
+
+Examples:
+  python3 journal.py /var/www/html/www.nytimes3xbfgragh.onion.journal
+  prints the number of links per worksheet
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/05/01 17:00:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+import json
+import time
+
+from settings import WORKBOOK
+
+from link import WeightedLink
+
+class CrawlJournal():
+    """
+    Crawl Journal class
+
+    One JSON record per line, appended for every change of a worksheet:
+      {"op": "add", "ws": worksheet_name, "link": [url, title, date, weight, notes]}
+      {"op": "remove", "ws": worksheet_name, "url": url}
+      {"op": "clear", "ws": worksheet_name}
+    Records are flushed on sync() and fsynced in batches (every FSYNC_RECORDS records
+    or FSYNC_INTERVAL seconds), a crash loses at most the last unsynced batch.
+    A torn last line is dropped on replay.
+    Life cycle: see main
+    """
+    file_name = u''
+    # journal file, opened for append
+    f = None
+
+    fsync_records = WORKBOOK['JOURNAL']['FSYNC_RECORDS']
+    fsync_interval = WORKBOOK['JOURNAL']['FSYNC_INTERVAL']
+    # records written since last fsync
+    unsynced = 0
+    last_fsync = 0.0
+    # records in the journal file
+    n_records = 0
+
+    def __init__(self, file_name):
+        """
+        Init with file_name
+        """
+        self.file_name = file_name
+
+    def exists(self):
+        return os.path.isfile(self.file_name)
+
+    def replay(self):
+        """
+        Read the journal and return its worksheets: {worksheet_name: {url: WeightedLink}}
+
+        Drops a torn last record
+        """
+        sheets = {}
+        self.n_records = 0
+        if not self.exists():
+            return sheets
+        valid_size = 0
+        with open(self.file_name, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn record from a crash, everything after it is dropped
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_size += len(line)
+                self.n_records += 1
+                links = sheets.setdefault(record['ws'], {})
+                op = record['op']
+                if op == 'add':
+                    url, title, date, weight, notes = record['link']
+                    links[url] = WeightedLink(url=url, title=title, date=date, weight=weight, notes=notes)
+                elif op == 'remove':
+                    links.pop(record['url'], None)
+                elif op == 'clear':
+                    links.clear()
+        if valid_size < os.path.getsize(self.file_name):
+            print('Journal: dropping torn record in', self.file_name)
+            with open(self.file_name, 'r+b') as f:
+                f.truncate(valid_size)
+        return sheets
+
+    def open(self):
+        """
+        Open the journal for append
+        """
+        self.f = open(self.file_name, 'a', encoding='utf-8')
+        self.unsynced = 0
+        self.last_fsync = time.monotonic()
+
+    def append(self, record):
+        """
+        Append a record, not synced
+        """
+        self.f.write(json.dumps(record, default=str) + '\n')
+        self.unsynced += 1
+        self.n_records += 1
+
+    def add(self, worksheet_name, weighted_link):
+        self.append({'op': 'add', 'ws': worksheet_name,
+                     'link': [weighted_link.url, weighted_link.title, weighted_link.date,
+                              weighted_link.weight, weighted_link.notes]})
+
+    def remove(self, worksheet_name, url):
+        self.append({'op': 'remove', 'ws': worksheet_name, 'url': url})
+
+    def clear(self, worksheet_name):
+        self.append({'op': 'clear', 'ws': worksheet_name})
+
+    def sync(self, force=False):
+        """
+        Flush the journal, fsync when a batch is complete or if forced
+        """
+        if self.f is None:
+            return
+        self.f.flush()
+        if not self.unsynced:
+            return
+        if force or self.unsynced >= self.fsync_records or time.monotonic() - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.f.fileno())
+            self.unsynced = 0
+            self.last_fsync = time.monotonic()
+
+    def compact(self, sheets):
+        """
+        Rewrite the journal as a snapshot of sheets: {worksheet_name: {url: WeightedLink}}
+
+        Atomic: the snapshot is written and fsynced before replacing the journal
+        """
+        reopen = self.f is not None
+        self.close()
+        tmp_name = self.file_name + '.tmp'
+        self.f = open(tmp_name, 'w', encoding='utf-8')
+        self.n_records = 0
+        for worksheet_name, links in sheets.items():
+            self.clear(worksheet_name)
+            for weighted_link in links.values():
+                self.add(worksheet_name, weighted_link)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        self.f = None
+        os.replace(tmp_name, self.file_name)
+        if reopen:
+            self.open()
+
+    def close(self):
+        """
+        Sync and close the journal
+        """
+        if self.f is not None:
+            self.sync(force=True)
+            self.f.close()
+            self.f = None
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hd", ["help"])
+        except getopt.error as msg:
+             raise Usage(msg)
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    if len(args)<1:
+        print("Arguments error")
+        print(__usage__)
+        sys.exit(2)
+
+    journal = CrawlJournal(args[0])
+    sheets = journal.replay()
+    print(journal.file_name, journal.n_records, 'records')
+    for worksheet_name, links in sheets.items():
+        print(worksheet_name + ':', len(links))
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+u"""Metrics
+
+Counters, gauges and latency histograms of the crawler stages
+  fetch, parse, links (link filtering), save (page store), index (search engine), persist (journal)
+Exposed in the Prometheus text format on a local http endpoint and as a periodic stats line
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 metrics.py [options]
+
+Options:
+  -h, --help              show this help
+  -p ..., --port=...      serve example metrics on this port
+  -d                      show debugging information
+
+Examples:
+  python3 metrics.py --port=9108
+  curl http://127.0.0.1:9108/metrics
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import time
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from settings import METRICS
+
+# seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+def format_labels(names, values, extra=u''):
+    labels = [u'%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return u'{' + u','.join(labels) + u'}' if labels else u''
+
+def format_value(value):
+    if value == float('inf'):
+        return u'+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric():
+    """
+    Metric
+
+    Values by label values, thread safe: updated from the event loop, fetcher and parser threads
+    """
+    kind = u'untyped'
+    name = u''
+    help = u''
+    # label names
+    labels = ()
+    # {label values: value}
+    values = None
+    lock = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels.get(name, u'') for name in self.labels)
+
+    def samples(self):
+        """
+        Return the exposition lines of the metric values
+        """
+        with self.lock:
+            return [self.name + format_labels(self.labels, key) + u' ' + format_value(value)
+                    for key, value in sorted(self.values.items())]
+
+    def exposition(self):
+        return [u'# HELP %s %s' % (self.name, self.help), u'# TYPE %s %s' % (self.name, self.kind)] + self.samples()
+
+class Counter(Metric):
+    """
+    Counter, only increases
+    """
+    kind = u'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+class Gauge(Metric):
+    """
+    Gauge, set or read from a function when exposed
+    """
+    kind = u'gauge'
+    # {label values: function}
+    functions = None
+
+    def __init__(self, name, help, labels=()):
+        Metric.__init__(self, name, help, labels)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def set_function(self, function, **labels):
+        """
+        Read the value from function() when the metric is exposed, eg. len of a frontier queue
+        """
+        with self.lock:
+            self.functions[self.key(labels)] = function
+
+    def samples(self):
+        for key, function in list(self.functions.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            with self.lock:
+                self.values[key] = value
+        return Metric.samples(self)
+
+class Histogram(Metric):
+    """
+    Histogram of durations in seconds
+    """
+    kind = u'histogram'
+    buckets = LATENCY_BUCKETS
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            # [bucket counts..., sum, count]
+            values = self.values.get(key)
+            if values is None:
+                values = [0] * (len(self.buckets) + 2)
+                self.values[key] = values
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self):
+        """
+        Return {label values: (count, sum)}
+        """
+        with self.lock:
+            return {key: (values[-1], values[-2]) for key, values in self.values.items()}
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, values in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, values):
+                    cumulative += count
+                    lines.append(self.name + u'_bucket' + format_labels(self.labels, key, u'le="%s"' % format_value(bound))
+                                 + u' ' + str(cumulative))
+                lines.append(self.name + u'_sum' + format_labels(self.labels, key) + u' ' + format_value(values[-2]))
+                lines.append(self.name + u'_count' + format_labels(self.labels, key) + u' ' + str(values[-1]))
+        return lines
+
+class MetricsRegistry():
+    """
+    Metrics Registry
+
+    Life Cycle: see main
+    """
+    # {name: Metric}
+    metrics = None
+    started = 0.0
+
+    def __init__(self):
+        self.metrics = {}
+        self.started = time.monotonic()
+
+    def register(self, metric):
+        """
+        Add a metric, return the metric already registered under its name if any
+        """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def exposition(self):
+        """
+        Return the metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.exposition())
+        return u'\n'.join(lines) + u'\n'
+
+    def stats_line(self):
+        """
+        Return a one line summary: counters, stage counts and mean durations, gauges
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        parts = []
+        for metric in self.metrics.values():
+            short_name = metric.name.replace(METRICS['PREFIX'], u'', 1)
+            if isinstance(metric, Histogram):
+                for key, (count, total) in sorted(metric.summary().items()):
+                    parts.append(u'%s %dx%.1fms' % (u'/'.join(key) or short_name, count, 1000 * total / count if count else 0))
+            elif isinstance(metric, Counter):
+                total = metric.total()
+                parts.append(u'%s %d (%.1f/s)' % (short_name, total, total / elapsed))
+            else:
+                metric.samples()
+                with metric.lock:
+                    parts.extend(u'%s %s' % (u'/'.join(key) or short_name, format_value(value))
+                                 for key, value in sorted(metric.values.items()))
+        return u'Metrics: ' + u' | '.join(parts)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer():
+    """
+    Metrics Server
+
+    Serves the registry on http://host:port/metrics from a daemon thread
+    """
+    server = None
+
+    def __init__(self, registry, host=METRICS['HOST'], port=METRICS['PORT']):
+        self.registry = registry
+        self.host = host
+        self.port = port
+
+    def start(self):
+        """
+        Start serving, return False if the port is not available
+        """
+        handler = type('RegistryMetricsHandler', (MetricsHandler, ), {'registry': self.registry})
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        except OSError as e:
+            print('Metrics: not served on port', self.port, '-', e)
+            return False
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        print('Metrics: http://%s:%d/metrics' % (self.host, self.server.server_port))
+        return True
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+# crawler metrics
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(METRICS['PREFIX'] + 'stage_seconds', u'Duration of the crawler stages', ['stage'])
+PAGES = REGISTRY.counter(METRICS['PREFIX'] + 'pages_total', u'Fetched pages by outcome', ['outcome'])
+RESPONSE_BYTES = REGISTRY.counter(METRICS['PREFIX'] + 'response_bytes_total', u'Bytes of the downloaded response bodies')
+ERRORS = REGISTRY.counter(METRICS['PREFIX'] + 'errors_total', u'Failed requests by error class', ['error'])
+FRONTIER_URLS = REGISTRY.gauge(METRICS['PREFIX'] + 'frontier_urls', u'Urls in the frontier by state', ['state'])
+MIDDLEWARE_SECONDS = REGISTRY.histogram(METRICS['PREFIX'] + 'middleware_seconds', u'Duration of the middleware hooks',
+                                        ['middleware', 'hook'])
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hp:d", ["help", "port="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        port = METRICS['PORT']
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-p", "--port"):
+                port = int(arg)
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    for stage, seconds in [('fetch', 0.8), ('fetch', 2.5), ('parse', 0.004), ('save', 0.0002)]:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    PAGES.inc(outcome='crawled')
+    RESPONSE_BYTES.inc(123456)
+    FRONTIER_URLS.set_function(lambda: 42, state='to_crawl')
+    print(REGISTRY.exposition())
+    print(REGISTRY.stats_line())
+    server = MetricsServer(REGISTRY, port=port)
+    if server.start():
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
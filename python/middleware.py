@@ -3,16 +3,30 @@
 u"""Middleware
 
 Inspired by Frontera Middleware
+Ordered chain of middlewares around the crawl, each middleware implements some of the hooks:
+  frontier_start(frontier), frontier_stop(frontier): once, eg. configure the frontier
+  request(request): before the fetch, return the request, raise Drop not to fetch it
+  response(response): before the parse, return the response, raise Drop not to parse it
+  document(response, page): the ParsedPage of the response, before the frontier saves and indexes it
+  links(request, links): the links (requests) found in the page of request, before they are added to crawl
+Responses, pages and links are handed from a middleware to the next one as they are, nothing is parsed or copied again
+Dropped requests and responses are recorded in the Ignored pages worksheet
+The duration of each hook of each middleware is in the middleware_seconds metric, see metrics.py
+Life Cycle: see main
 """
 
-__usage__ = u"""TODO - Usage: python3 middleware.py [options] [url]
+__usage__ = u"""Usage: python3 middleware.py [options]
+
+Show the middleware chain and the hooks of each middleware
 
 Options:
   -h, --help              show this help
+  -m ..., --middlewares=  comma separated middlewares, default: MIDDLEWARES
   -d                      show debugging information
 
 Examples:
   python3 middleware.py
+  python3 middleware.py -m ignore_paths,mymodule.MyMiddleware
 """
 
 __author__ = u"M0t13y"
@@ -21,10 +35,155 @@ __date__ = u"$Date: 2021/14/01 06:15:00 $"
 __copyright__ = u"Copyright [" + __author__ + "]"
 __license__ = u"Licensed under the Apache License, Version 2.0"
 
+import importlib
+# url parser
+from urllib.parse import urljoin
+
+from settings import MIDDLEWARES, IGNORE_PATHS
+from link import WeightedLink
+from metrics import MIDDLEWARE_SECONDS
+
+HOOKS = ['frontier_start', 'frontier_stop', 'request', 'response', 'document', 'links']
+
+class Drop(Exception):
+    """
+    Raised by a request or response hook: the page is not crawled, reason is recorded in the Ignored pages
+    """
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+class Middleware():
+    """
+    Middleware
+
+    Hooks not overridden are not called
+    Life Cycle: see main
+    """
+    name = None
+
+    def frontier_start(self, frontier):
+        pass
+
+    def frontier_stop(self, frontier):
+        pass
+
+    def request(self, request):
+        return request
+
+    def response(self, response):
+        return response
+
+    def document(self, response, page):
+        return page
+
+    def links(self, request, links):
+        return links
+
+class IgnorePathsMiddleware(Middleware):
+    """
+    Ignore Paths Middleware
+
+    A new crawl does not crawl paths on the site of the seeds: they are added to its first Ignore seeds,
+    IGNORE_PATHS written by the frontier, the worksheet can be edited afterwards
+    Life Cycle: see main
+    """
+    name = u'ignore_paths'
+    paths = IGNORE_PATHS
+
+    def __init__(self, paths=IGNORE_PATHS):
+        self.paths = paths
+
+    def frontier_start(self, frontier):
+        # a new crawl: the workbook had no ignore seeds
+        if frontier.crawl_book.ignore_seeds:
+            return
+        urls = set(wl.url for wl in frontier.ignore_seeds)
+        added = [WeightedLink(url=url) for url in (urljoin(frontier.url_base, path) for path in self.paths) if url not in urls]
+        if added:
+            frontier.set_ignore_seeds(frontier.ignore_seeds + added)
+
+MIDDLEWARE_CLASSES = {
+    IgnorePathsMiddleware.name: IgnorePathsMiddleware,
+}
+
+def load_middleware(name):
+    """
+    Return the middleware class of name: a name of MIDDLEWARE_CLASSES or module.Class
+    """
+    if name in MIDDLEWARE_CLASSES:
+        return MIDDLEWARE_CLASSES[name]
+    module_name, _, class_name = name.rpartition('.')
+    if not module_name:
+        raise ValueError(u'Unknown middleware: ' + name)
+    return getattr(importlib.import_module(module_name), class_name)
+
+class MiddlewareChain():
+    """
+    Middleware Chain
+
+    Calls the hooks of the middlewares in chain order and times them
+    Life Cycle: see main
+    """
+    middlewares = None
+    # {hook: [(middleware name, bound hook)]}, only the middlewares overriding the hook
+    hooks = None
+
+    def __init__(self, middlewares=[]):
+        self.middlewares = list(middlewares)
+        self.hooks = {hook: [(middleware.name or type(middleware).__name__, getattr(middleware, hook))
+                             for middleware in self.middlewares
+                             if getattr(type(middleware), hook) is not getattr(Middleware, hook)]
+                      for hook in HOOKS}
+
+    @staticmethod
+    def from_names(names=MIDDLEWARES):
+        return MiddlewareChain([load_middleware(name)() for name in names])
+
+    def frontier_start(self, frontier):
+        for name, hook in self.hooks['frontier_start']:
+            with MIDDLEWARE_SECONDS.time(middleware=name, hook='frontier_start'):
+                hook(frontier)
+
+    def frontier_stop(self, frontier):
+        for name, hook in self.hooks['frontier_stop']:
+            with MIDDLEWARE_SECONDS.time(middleware=name, hook='frontier_stop'):
+                hook(frontier)
+
+    def request(self, request):
+        """
+        Return the request to fetch, raise Drop if it is not fetched
+        """
+        for name, hook in self.hooks['request']:
+            with MIDDLEWARE_SECONDS.time(middleware=name, hook='request'):
+                request = hook(request)
+        return request
+
+    def response(self, response):
+        """
+        Return the response to parse, raise Drop if it is not parsed
+        """
+        for name, hook in self.hooks['response']:
+            with MIDDLEWARE_SECONDS.time(middleware=name, hook='response'):
+                response = hook(response)
+        return response
+
+    def document(self, response, page):
+        for name, hook in self.hooks['document']:
+            with MIDDLEWARE_SECONDS.time(middleware=name, hook='document'):
+                page = hook(response, page)
+        return page
+
+    def links(self, request, links):
+        for name, hook in self.hooks['links']:
+            with MIDDLEWARE_SECONDS.time(middleware=name, hook='links'):
+                links = hook(request, links)
+        return links
+
 class Usage(Exception):
     def __init__(self, msg):
         self.msg = msg
-        
+
 def main(argv=None):
     """
     main
@@ -34,26 +193,32 @@ def main(argv=None):
         argv = sys.argv
 
     try:
-        try:                                
-            opts, args = getopt.getopt(argv, "hup:d", ["help", "url=", "path="])
+        try:
+            opts, args = getopt.getopt(argv, "hm:d", ["help", "middlewares="])
         except getopt.error as msg:
-             raise Usage(msg)            
-        url = u'http://localhost'
-        path = u'/var/www'
+             raise Usage(msg)
+        names = MIDDLEWARES
         for opt, arg in opts:
             if opt in ("-h", "--help"):
-                print(__usage__)                   
-                sys.exit()                  
+                print(__usage__)
+                sys.exit()
             elif opt == '-d':
-                global _debug               
-                _debug = 1                  
+                global _debug
+                _debug = 1
+            elif opt in ("-m", "--middlewares"):
+                names = [name for name in arg.split(',') if name]
     except Usage as err:
-        print >>sys.stderr, err.msg
-        print >>sys.stderr, "for help use --help"
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
         return 2
 
+    chain = MiddlewareChain.from_names(names)
+    for middleware in chain.middlewares:
+        hooks = [hook for hook in HOOKS if any(bound.__self__ is middleware for name, bound in chain.hooks[hook])]
+        print(middleware.name or type(middleware).__name__, '-', type(middleware).__module__ + '.' + type(middleware).__name__,
+              '-', ', '.join(hooks) or 'no hooks')
+
 if __name__ == "__main__":
     import sys
     print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
     main(sys.argv[1:])
-
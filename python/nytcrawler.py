@@ -31,17 +31,24 @@ import requests
 # html parser
 from bs4 import BeautifulSoup
 # url parser
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 
 # database
 import pymysql.cursors
 
 # Our frontier
 from frontier import CrawlFrontier
+from urlfilter import UrlFilter
+from settings import IGNORE_PATHS
 
 from crawler import WebPage, GenericCrawler
 
 class NytPage(WebPage):
+    # ignore list, see the ignore_paths middleware
+    # ignore Spanish and French pages
+    # one compiled filter of the url paths, shared by all the pages
+    ignore_filter = UrlFilter(IGNORE_PATHS)
+
     def __init__(self, url=u'', save_dir = u'./'):
         """
         init
@@ -63,87 +70,25 @@ class NytPage(WebPage):
             
             # url root (eg.: https://toto.com/)
             url_base = urljoin(self.url, '/')
-            # ignores ugly, but faster this way
-            # ignore Spanish and French pages
-            prefix_es = '/es/'
-            url_base_es_ignore = urljoin(self.url, prefix_es)
-            prefix_fr = '/fr/'
-            url_base_fr_ignore = urljoin(self.url, prefix_fr)
-            prefix_newsletters = '/newsletters'
-            url_base_newsletters = urljoin(self.url, prefix_newsletters)
-            prefix_ca = '/ca/'
-            url_base_ca = urljoin(self.url, prefix_ca)
-            prefix_2021 = '/2021/'
-            url_base_2021 = urljoin(self.url, prefix_2021)
-            prefix_world = '/section/world'
-            url_base_world = urljoin(self.url, prefix_world)
-            prefix_videoworld = '/video/world'
-            url_base_videoworld = urljoin(self.url, prefix_videoworld)
-            prefix_food = '/section/food'
-            url_base_food = urljoin(self.url, prefix_food)
-            prefix_arts = '/section/arts'
-            url_base_arts = urljoin(self.url, prefix_arts)
-            prefix_sports = '/section/sports'
-            url_base_sports = urljoin(self.url, prefix_sports)
-            prefix_science = '/section/science'
-            url_base_science = urljoin(self.url, prefix_science)
-            prefix_books = '/section/books'
-            url_base_books = urljoin(self.url, prefix_books)
-            prefix_dealbook = '/section/business/dealbook'
-            url_base_dealbook = urljoin(self.url, prefix_dealbook)
-            prefix_pagesdealbook = '/pages/business/dealbook'
-            url_base_pagesdealbook = urljoin(self.url, prefix_pagesdealbook)
-            # nyregion only
-            prefix_nyregion = '/section/nyregion'
-            url_base_nyregion = urljoin(self.url, prefix_nyregion)
-
-            # ignore list
-            ignore_suffixes = ['/es/', '/fr/', '/ca/', '/newsletters', '/2021/',
-                            '/2020/01/', '/2020/02/', '/2020/03/', '/2020/04/', '/2020/05/', '/2020/06/',
-                            '/2020/07/', '/2020/08/', '/2020/09/', '/2020/10/',
-                            '/2019/', '/2018/', '/2017/', '/2016/', '/2015/', '/2014/',
-                            '/section/world', '/video/world', '/section/food', '/section/arts',
-                            '/section/sports', '/section/science', '/section/books', '/section/travel', 
-                            '/section/realestate', '/section/fashion', '/section/technology',
-                            '/section/politics', '/section/business', '/section/style',
-                            '/section/style/love', '/section/us', '/section/video', '/section/interactive',
-                            '/section/t-magazine',
-                            'section/fashion', '/issue/fashion',
-                            '/section/business/dealbook', '/pages/business/dealbook',
-                            '/privacy'
-                            ]
-            ignore_urls = [urljoin(self.url, suffix) for suffix in ignore_suffixes]
             
             links_href_absolute = []
             links_href_relative = []
             for link in links:
                 if link and link.get('href'):
                     link_href = link.get('href')
-                    ignore_link = False
                     # only keep website links, drop the rest
                     # absolute url
                     if link_href.startswith(url_base):
-                        for ignore_url in ignore_urls:
-                            if link_href.startswith(ignore_url):
-                                self.ignored_links.add(link_href)
-                                ignore_link = True
-                                break
-                        if ignore_link:
-                            ignore_link = False
+                        if NytPage.ignore_filter.match(urlsplit(link_href).path):
+                            self.ignored_links.add(link_href)
                         else:
                             links_href_absolute.append(link_href)
                     # relative link
                     elif link_href.startswith('/') and link_href != '/' and not link_href.startswith('/#'): 
-                        for ignore_suffix in ignore_suffixes:
-                            if link_href.startswith(ignore_suffix):
-                                link_href = urljoin(self.url, link_href)
-                                self.ignored_links.add(link_href)
-                                ignore_link = True
-                                break
-                        if ignore_link:
-                            ignore_link = False
+                        link_href = urljoin(self.url, link_href)
+                        if NytPage.ignore_filter.match(urlsplit(link_href).path):
+                            self.ignored_links.add(link_href)
                         else:
-                            link_href = urljoin(self.url, link_href)
                             links_href_relative.append(link_href)
             self.links_href = links_href_absolute + links_href_relative
             print(u'Web Page:',len(links_href_absolute), u'absolute links and',len(links_href_relative), u'relative links found')
@@ -10,10 +10,13 @@ __usage__ = u"""Usage: python3 optimize.py [options]
 
 Options:
   -h, --help              show this help
+  -P ..., --profile=...   sampling profiler: write prefix.collapsed and prefix.txt, see profiler.py
+  --profile-window=...    [delay:]seconds profiled, default: the whole run
   -d                      show debugging information
 
 Examples:
   python3 optimize.py
+  python3 optimize.py -P /tmp/optimize
 """
 
 __author__ = u"M0t13y"
@@ -27,6 +30,7 @@ import os
 from settings import SEEDS, WWW_DIR
 from settings import WORKBOOK
 from workbook import CrawlWorkbook 
+from profiler import profiled
 
 class Optimize():
     """
@@ -57,7 +61,7 @@ class Optimize():
         self.ignore_seeds =  self.crawl_book.ignore_seeds
         self.ignored_pages =  self.crawl_book.ignored_pages
 
-    def rewrite_check_seeds(self)
+    def rewrite_check_seeds(self):
         """
         Rewrite the crawlbook depending on seeds
         """
@@ -77,9 +81,11 @@ def main(argv=None):
 
     try:
         try:                                
-            opts, args = getopt.getopt(argv, "h:d", ["help"])
+            opts, args = getopt.getopt(argv, "hdP:", ["help", "profile=", "profile-window="])
         except getopt.error as msg:
              raise Usage(msg)            
+        profile = None
+        profile_window = None
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 print(__usage__)                   
@@ -87,6 +93,10 @@ def main(argv=None):
             elif opt == '-d':
                 global _debug               
                 _debug = 1                  
+            elif opt in ("-P", "--profile"):
+                profile = arg
+            elif opt == "--profile-window":
+                profile_window = arg
     except Usage as err:
         print >>sys.stderr, err.msg
         print >>sys.stderr, "for help use --help"
@@ -99,7 +109,8 @@ def main(argv=None):
     
     # Get the list of all files and directories 
     # in the root directory
-    opti = Optimize()
+    with profiled(profile, profile_window):
+        opti = Optimize()
         
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+u"""Page Parser
+
+Parses fetched pages in a pool of worker processes
+Workers receive the raw response bytes and return the title, links, body text and its SimHash
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 pageparser.py [options] [file.html ...]
+
+Options:
+  -h, --help              show this help
+  -u ..., --url=...       url base of the links eg. https://www.nytimes3xbfgragh.onion/
+  -d                      show debugging information
+
+Examples:
+  python3 pageparser.py --url='https://www.nytimes3xbfgragh.onion/' /var/www/html/www.nytimes3xbfgragh.onion/*.html
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/04/01 19:05:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+# url parser
+from urllib.parse import urljoin
+
+from settings import PARSE_WORKERS, PARSER_BACKEND, CANONICAL
+from document import open_document
+from simhash import simhash
+
+@dataclass
+class ParsedPage():
+    """Parsed Page
+
+    What the frontier needs from a fetched page
+    """
+    url: str = u''
+    title: str = u''
+    # absolute links to pages of the website
+    links: list = field(default_factory=list)
+    # body text, for the search engine
+    text: str = u''
+    # SimHash of the text, 0 if too short, see simhash.py
+    fingerprint: int = 0
+
+def extract_links(document, url_base):
+    """
+    Return the links of a Document that are on the website starting with url_base, relative links made absolute
+    """
+    hrefs = document.hrefs
+    # absolute links, any case, http or https if they are merged: see canonical.py
+    site = url_base.partition('://')[2].lower()
+    if CANONICAL['MERGE_SCHEMES']:
+        prefixes = ('http://' + site, 'https://' + site)
+    else:
+        prefixes = (url_base.lower(), )
+    links_href_absolute = [href for href in hrefs if href.lower().startswith(prefixes)]
+    # relative links
+    links_href_relative = [ urljoin(url_base, href) for href in hrefs if href.startswith('/')
+                            and href != '/' and not href.startswith('/#')
+                            ]
+    print(u'Web Page:',len(links_href_absolute), u'absolute links, ', len(links_href_relative), u'relative links found, ')
+    return links_href_absolute + links_href_relative
+
+def parse_page(url, content, encoding=None, url_base=u'', backend=PARSER_BACKEND):
+    """
+    Parse a page once: return a ParsedPage
+
+    content is the raw response body (bytes), encoding the response encoding if known
+    Runs in a worker process, arguments and result are pickled
+    """
+    document = open_document(content, encoding, backend)
+    return ParsedPage(url=url, title=document.title, links=extract_links(document, url_base),
+                      text=document.text, fingerprint=simhash(document.text))
+
+class ParserPool():
+    """
+    Parser Pool
+
+    Parses pages in worker processes so that parsing does not hold the GIL of the crawler
+    Life Cycle: see main
+    """
+    workers = PARSE_WORKERS
+    backend = PARSER_BACKEND
+    executor = None
+
+    def __init__(self, workers=PARSE_WORKERS, backend=PARSER_BACKEND):
+        self.workers = workers
+        self.backend = backend
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    async def parse(self, response, url_base=u''):
+        """
+        Parse a response in a worker process, return a ParsedPage
+
+        A worker process died (BrokenProcessPool): the pool is replaced for the next parses
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, parse_page,
+                                              response.request.url, response.content, response.encoding, url_base, self.backend)
+        except BrokenProcessPool:
+            # parses running in the broken pool fail together, it is replaced once
+            if self.executor is executor:
+                self.restart()
+            raise
+
+    def restart(self):
+        """
+        Replace a broken pool, eg. a worker process was killed: BrokenProcessPool
+        """
+        self.executor.shutdown(wait=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def close(self):
+        """
+        Wait for running parses and stop the worker processes
+        """
+        self.executor.shutdown(wait=True)
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hu:d", ["help", "url="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        url = u'http://localhost/'
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-u", "--url"):
+                url = arg
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    if len(args)<1:
+        print("Arguments error")
+        print(__usage__)
+        sys.exit(2)
+
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as executor:
+        contents = []
+        for file_name in args:
+            with open(file_name, 'rb') as f:
+                contents.append(f.read())
+        for file_name, page in zip(args, executor.map(parse_page, args, contents, [None] * len(args), [url] * len(args))):
+            print(file_name, '-', page.title, '-', len(page.links), 'links -', len(page.text), 'chars')
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+u"""Page Store
+
+Compressed store of the raw fetched pages
+Pages are appended to hash-sharded segment files, an index maps page ids to offsets
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 pagestore.py [options] [id or url ...]
+
+Options:
+  -u ..., --url=...       website url eg. https://www.nytimes3xbfgragh.onion/
+  -h, --help              show this help
+  -p, --path              www path where files were stored eg. /var/www
+  -o ..., --output=...    write the pages to this directory as id.html files
+  -d                      show debugging information
+
+Examples:
+  python3 pagestore.py --url='https://www.nytimes3xbfgragh.onion/' --path='/var/www'
+  prints the number of pages and bytes stored
+  python3 pagestore.py --url='https://www.nytimes3xbfgragh.onion/' --path='/var/www' 256
+  prints the page with id 256 (see the search UI results)
+  python3 pagestore.py --url='https://www.nytimes3xbfgragh.onion/' --path='/var/www' --output=/tmp/pages 256 1024
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/05/01 17:00:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+import gzip
+import shutil
+import struct
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from settings import PAGESTORE, WWW_DIR, SEEDS
+
+from workbook import CrawlWorkbook
+from search import SearchEngine
+
+# page record header: magic, codec, encoding length, url length, data length
+RECORD_HEADER = struct.Struct('<4sBBHI')
+RECORD_MAGIC = b'TCP1'
+# index entry: page id, segment offset, record length
+INDEX_ENTRY = struct.Struct('<QQI')
+
+CODEC_RAW = 0
+CODEC_GZIP = 1
+CODEC_ZSTD = 2
+CODECS = {u'raw': CODEC_RAW, u'gzip': CODEC_GZIP, u'zstd': CODEC_ZSTD}
+
+def compress(data, codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=PAGESTORE['LEVEL']['zstd']).compress(data)
+    if codec == CODEC_GZIP:
+        return gzip.compress(data, compresslevel=PAGESTORE['LEVEL']['gzip'], mtime=0)
+    return data
+
+def decompress(data, codec):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise IOError(u'zstd compressed page, zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_GZIP:
+        return gzip.decompress(data)
+    return data
+
+class PageStore():
+    """
+    Page Store
+
+    Raw response bytes of a website, compressed (zstd if zstandard is installed, gzip otherwise)
+    Page id: SearchEngine.hash_url(url), shard: id % shards
+    HTML_DIR/netloc/pages/##.seg: page records, appended
+    HTML_DIR/netloc/pages/##.idx: (id, offset, length) entries, appended after the record is written
+    Life Cycle: see main
+    """
+    path = u''
+    shards = PAGESTORE['SHARDS']
+    codec = CODEC_RAW
+    # {id: (shard, offset, length)}
+    index = None
+    # open segment and index files: {shard: (segment file, index file)}
+    files = None
+
+    def __init__(self, path, shards=PAGESTORE['SHARDS'], codec=PAGESTORE['CODEC']):
+        """
+        Init with the website pages path, eg. /var/www/html/www.apple.com
+        """
+        self.path = os.path.join(path, PAGESTORE['SUBDIR'])
+        self.shards = shards
+        if codec == u'zstd' and zstandard is None:
+            codec = u'gzip'
+        self.codec = CODECS[codec]
+        self.index = {}
+        self.files = {}
+
+    @staticmethod
+    def from_url(path=WWW_DIR, url=next(iter(SEEDS))):
+        """
+        Return the Page Store of a website from www path and url
+        """
+        return PageStore(CrawlWorkbook.wb_html_pages_path(path, url))
+
+    def shard_name(self, shard, ext):
+        return os.path.join(self.path, '%02x' % shard + ext)
+
+    def open(self):
+        """
+        Load the index of every shard
+
+        Index entries pointing past the end of their segment (crash) are dropped
+        """
+        self.index = {}
+        for shard in range(self.shards):
+            index_name = self.shard_name(shard, '.idx')
+            if not os.path.isfile(index_name):
+                continue
+            segment_size = os.path.getsize(self.shard_name(shard, '.seg'))
+            with open(index_name, 'rb') as f:
+                data = f.read()
+            for id, offset, length in INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]):
+                if offset + length <= segment_size:
+                    self.index[id] = (shard, offset, length)
+        return self
+
+    def shard_files(self, shard):
+        files = self.files.get(shard)
+        if files is None:
+            os.makedirs(self.path, exist_ok=True)
+            files = (open(self.shard_name(shard, '.seg'), 'ab'), open(self.shard_name(shard, '.idx'), 'ab'))
+            self.files[shard] = files
+        return files
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, url):
+        return SearchEngine.hash_url(url) in self.index
+
+    def put(self, url, content, encoding=None):
+        """
+        Store the raw content of a page, return its id
+        """
+        id = SearchEngine.hash_url(url)
+        shard = id % self.shards
+        url_bytes = url.encode('utf-8')
+        encoding_bytes = (encoding or u'').encode('ascii', errors='ignore')[:255]
+        data = compress(content, self.codec)
+        record = RECORD_HEADER.pack(RECORD_MAGIC, self.codec, len(encoding_bytes), len(url_bytes), len(data)) + encoding_bytes + url_bytes + data
+        self.put_record(id, record)
+        return id
+
+    def put_record(self, id, record):
+        """
+        Append a page record to the segment of id, then its index entry
+        """
+        shard = id % self.shards
+        segment, index = self.shard_files(shard)
+        offset = segment.tell()
+        segment.write(record)
+        segment.flush()
+        index.write(INDEX_ENTRY.pack(id, offset, len(record)))
+        index.flush()
+        self.index[id] = (shard, offset, len(record))
+
+    def read_raw(self, shard, offset, length):
+        """
+        Return the bytes of a record
+        """
+        files = self.files.get(shard)
+        if files is not None:
+            files[0].flush()
+        with open(self.shard_name(shard, '.seg'), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read_record(self, shard, offset, length):
+        """
+        Return (url, content, encoding) of a record
+        """
+        record = self.read_raw(shard, offset, length)
+        magic, codec, encoding_length, url_length, data_length = RECORD_HEADER.unpack_from(record)
+        if magic != RECORD_MAGIC:
+            raise IOError(u'Bad page record in ' + self.shard_name(shard, '.seg'))
+        start = RECORD_HEADER.size
+        encoding = record[start:start + encoding_length].decode('ascii') or None
+        start += encoding_length
+        url = record[start:start + url_length].decode('utf-8')
+        start += url_length
+        content = decompress(record[start:start + data_length], codec)
+        return url, content, encoding
+
+    def get_id(self, id):
+        """
+        Return (url, content, encoding) of page id, None if not stored
+        """
+        entry = self.index.get(id)
+        if entry is None:
+            return None
+        return self.read_record(*entry)
+
+    def get(self, url):
+        """
+        Return (content, encoding) of the page at url, None if not stored
+        """
+        page = self.get_id(SearchEngine.hash_url(url))
+        if page is None or page[0] != url:
+            return None
+        return page[1], page[2]
+
+    def items(self):
+        """
+        Iterate over stored pages: (url, content, encoding), eg. to parse them again
+        """
+        for id, entry in list(self.index.items()):
+            yield self.read_record(*entry)
+
+    def rekey(self, hash_url=SearchEngine.hash_url):
+        """
+        Rewrite the store with hash_url(url) ids, return the number of changed ids
+
+        Records are copied, still compressed, to the segments of their new id,
+        the new store replaces the old one once written.
+        Old records of pages already stored with their new id are dropped
+        """
+        self.close()
+        rekeyed = PageStore(os.path.dirname(self.path), self.shards)
+        rekeyed.path = self.path + '.rekey'
+        if os.path.isdir(rekeyed.path):
+            shutil.rmtree(rekeyed.path)
+        os.makedirs(rekeyed.path)
+        n_changed = 0
+        for id, (shard, offset, length) in sorted(self.index.items(), key=lambda item: item[1]):
+            record = self.read_raw(shard, offset, length)
+            url = self.read_record(shard, offset, length)[0]
+            new_id = hash_url(url)
+            if new_id != id:
+                if new_id in self.index:
+                    # page stored again since with the new id, drop the old record
+                    continue
+                n_changed += 1
+            rekeyed.put_record(new_id, record)
+        rekeyed.close()
+        old_path = self.path + '.old'
+        os.replace(self.path, old_path)
+        os.replace(rekeyed.path, self.path)
+        shutil.rmtree(old_path)
+        self.open()
+        return n_changed
+
+    def close(self):
+        """
+        Sync and close the segment and index files
+        """
+        for segment, index in self.files.values():
+            for f in (segment, index):
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+        self.files = {}
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hu:p:o:d", ["help", "url=", "path=", "output="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        url = next(iter(SEEDS))
+        path = WWW_DIR
+        output = None
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-u", "--url"):
+                url = arg
+            elif opt in ("-p", "--path"):
+                path = arg
+            elif opt in ("-o", "--output"):
+                output = arg
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    store = PageStore.from_url(path, url).open()
+    if not args:
+        n_bytes = sum(length for shard, offset, length in store.index.values())
+        print(store.path, len(store), 'pages', n_bytes, 'bytes')
+        return 0
+    for arg in args:
+        id = int(arg) if arg.isdigit() else SearchEngine.hash_url(arg)
+        page = store.get_id(id)
+        if page is None:
+            print(arg, 'not found', file=sys.stderr)
+            continue
+        page_url, content, encoding = page
+        if output:
+            os.makedirs(output, exist_ok=True)
+            file_name = os.path.join(output, str(id) + '.html')
+            with open(file_name, 'wb') as f:
+                f.write(content)
+            print(page_url, '=>', file_name)
+        else:
+            sys.stdout.buffer.write(content)
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
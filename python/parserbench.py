@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+u"""Parser Benchmark
+
+Compares the parser backends (see document.py) on saved pages (see pagestore.py)
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 parserbench.py [options] [file.html ...]
+
+Options:
+  -h, --help              show this help
+  -u ..., --url=...       website whose saved pages are parsed, default: first seed
+  -p, --path              www path where files were stored eg. /var/www
+  -b ..., --backends=...  comma separated parser backends, default: all available
+  -n ...                  parse every page n times, default: 3
+  -d                      show debugging information
+
+Examples:
+  python3 parserbench.py
+  python3 parserbench.py --backends=html.parser,fast -n 10
+  python3 parserbench.py /var/www/html/www.nytimes3xbfgragh.onion/256.html
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/04/01 19:05:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+import glob
+import time
+
+from settings import SEEDS, WWW_DIR
+from workbook import CrawlWorkbook
+from document import open_document, available_backends
+from pagestore import PageStore
+
+def bench_backend(backend, contents, repeat=3):
+    """
+    Parse every content repeat times with backend
+
+    Return (seconds per page, links found, text chars found) of the last round
+    """
+    n_links = 0
+    n_chars = 0
+    start = time.perf_counter()
+    for i in range(repeat):
+        n_links = 0
+        n_chars = 0
+        for content in contents:
+            document = open_document(content, backend=backend)
+            n_links += len(document.hrefs)
+            n_chars += len(document.text)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeat * len(contents)), n_links, n_chars
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hu:p:b:n:d", ["help", "url=", "path=", "backends="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        url = next(iter(SEEDS))
+        path = WWW_DIR
+        backends = available_backends()
+        repeat = 3
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-u", "--url"):
+                url = arg
+            elif opt in ("-p", "--path"):
+                path = arg
+            elif opt in ("-b", "--backends"):
+                backends = arg.split(',')
+            elif opt == '-n':
+                repeat = int(arg)
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    contents = []
+    file_names = args
+    if not file_names:
+        # pages of the page store and .html files saved by older versions
+        store = PageStore.from_url(path, url).open()
+        contents = [content for page_url, content, encoding in store.items()]
+        file_names = sorted(glob.glob(os.path.join(CrawlWorkbook.wb_html_pages_path(path, url), '*.html')))
+    for file_name in file_names:
+        with open(file_name, 'rb') as f:
+            contents.append(f.read())
+    if not contents:
+        print('No saved pages found')
+        sys.exit(2)
+    print(len(contents), 'pages,', sum(len(content) for content in contents), 'bytes, parsed', repeat, 'times')
+
+    baseline = None
+    print('{:<12} {:>10} {:>10} {:>8} {:>10} {:>12}'.format('backend', 'ms/page', 'pages/s', 'speedup', 'links', 'text chars'))
+    for backend in backends:
+        seconds, n_links, n_chars = bench_backend(backend, contents, repeat)
+        if baseline is None:
+            baseline = seconds
+        print('{:<12} {:>10.3f} {:>10.1f} {:>7.2f}x {:>10} {:>12}'.format(
+              backend, seconds * 1000, 1 / seconds, baseline / seconds, n_links, n_chars))
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
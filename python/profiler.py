@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+u"""Profiler
+
+Sampling profiler of the threads of the running process
+A daemon thread reads the stacks of all the other threads (sys._current_frames) every INTERVAL seconds:
+the profiled code is not instrumented, the overhead does not depend on the number of calls
+The parser worker processes are not sampled
+Writes
+  prefix.collapsed: collapsed stacks "thread;caller;...;function count", eg. for flamegraph.pl or speedscope
+  prefix.txt: samples per function, self (running the function) and total (function on the stack)
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 profiler.py [options] script.py [script arguments]
+
+Options:
+  -h, --help              show this help
+  -P ..., --profile=...   output prefix, default: profile
+  --profile-window=...    [delay:]seconds, sample from delay to delay + seconds after the start
+  -d                      show debugging information
+
+The -P and --profile-window options are also available in crawler.py, frontier.py, search.py and optimize.py
+
+Examples:
+  python3 crawler.py -P /tmp/crawl
+  python3 crawler.py -P /tmp/crawl --profile-window=600:60
+  flamegraph.pl /tmp/crawl.collapsed > /tmp/crawl.svg
+  python3 profiler.py -P /tmp/optimize optimize.py
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from settings import PROFILER
+
+def frame_name(code):
+    return u'%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+class SamplingProfiler():
+    """
+    Sampling Profiler
+
+    start() and stop() around the profiled code, or a profiled() block
+    Life Cycle: see main
+    """
+    interval = PROFILER['INTERVAL']
+    max_depth = PROFILER['MAX_DEPTH']
+    # seconds after start before sampling, seconds of sampling: None until stop
+    delay = 0.0
+    duration = None
+    # {collapsed stack: samples}
+    stacks = None
+    n_samples = 0
+    thread = None
+    stopping = None
+
+    def __init__(self, interval=PROFILER['INTERVAL'], delay=0.0, duration=None, max_depth=PROFILER['MAX_DEPTH']):
+        self.interval = interval
+        self.delay = delay
+        self.duration = duration
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.n_samples = 0
+        self.stopping = threading.Event()
+
+    @staticmethod
+    def parse_window(window):
+        """
+        Return (delay, duration) of a '[delay:]seconds' option, (0, None) if empty
+        """
+        if not window:
+            return 0.0, None
+        delay, _, duration = window.rpartition(':')
+        return float(delay or 0), float(duration)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        if self.stopping.wait(self.delay):
+            return
+        end = time.monotonic() + self.duration if self.duration else None
+        while not self.stopping.wait(self.interval):
+            self.sample()
+            if end is not None and time.monotonic() >= end:
+                return
+
+    def sample(self):
+        """
+        Add the stacks of all threads but the profiler
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                frames.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            frames.append(names.get(ident, u'thread-%d' % ident))
+            self.stacks[u';'.join(reversed(frames))] += 1
+        self.n_samples += 1
+
+    def functions(self):
+        """
+        Return {function: [self samples, total samples]}
+        """
+        functions = {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(u';')[1:]
+            for name in set(frames):
+                functions.setdefault(name, [0, 0])[1] += count
+            if frames:
+                functions[frames[-1]][0] += count
+        return functions
+
+    def write(self, prefix):
+        """
+        Write prefix.collapsed and prefix.txt
+        """
+        with open(prefix + u'.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(u'%s %d\n' % (stack, count))
+        total = max(sum(self.stacks.values()), 1)
+        with open(prefix + u'.txt', 'w', encoding='utf-8') as f:
+            f.write(u'%d samples every %.1fms, %d thread stacks\n' % (self.n_samples, 1000 * self.interval, total))
+            f.write(u'%7s %7s %8s %8s  %s\n' % (u'self%', u'total%', u'self', u'total', u'function'))
+            for name, (own, inclusive) in sorted(self.functions().items(), key=lambda item: (-item[1][0], -item[1][1])):
+                f.write(u'%6.2f%% %6.2f%% %8d %8d  %s\n' % (100.0 * own / total, 100.0 * inclusive / total, own, inclusive, name))
+        print(u'Profiler:', self.n_samples, u'samples written to', prefix + u'.collapsed', u'and', prefix + u'.txt')
+
+@contextmanager
+def profiled(prefix=None, window=None):
+    """
+    Profile a with block if prefix is given, window: '[delay:]seconds' or None for the whole block
+    """
+    if not prefix:
+        yield None
+        return
+    delay, duration = SamplingProfiler.parse_window(window)
+    profiler = SamplingProfiler(delay=delay, duration=duration).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.write(prefix)
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    import runpy
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            # options after the script are the script options
+            opts, args = getopt.getopt(argv, "hP:d", ["help", "profile=", "profile-window="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        profile = u'profile'
+        profile_window = None
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-P", "--profile"):
+                profile = arg
+            elif opt == "--profile-window":
+                profile_window = arg
+        if not args:
+            raise Usage(u'script missing')
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    sys.argv = args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args[0])))
+    with profiled(profile, profile_window):
+        try:
+            runpy.run_path(args[0], run_name='__main__')
+        except SystemExit:
+            pass
+
+if __name__ == "__main__":
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+u"""Rate Limit
+
+Per host rate limiter and concurrency controller
+  - token bucket: at most rate requests per second, bursts of burst requests
+  - AIMD: rate and concurrency grow additively while the host answers fast (exponentially until the first cut),
+    they are cut multiplicatively on timeouts, 429, 5xx or latency far above the host best latency
+The crawler runs at the highest rate the host tolerates
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 ratelimit.py
+
+Examples:
+  python3 ratelimit.py
+  simulates a host slowing down above 4 requests per second
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from settings import RATE_LIMIT
+
+# status codes of an overloaded or throttling host
+THROTTLE_STATUS_CODES = frozenset([429, 503])
+
+class HostLimiter():
+    """
+    Host Limiter
+
+    Token bucket and AIMD concurrency limit of one host
+    Used from the event loop thread only
+    """
+    host = u''
+    settings = RATE_LIMIT
+    max_concurrency = RATE_LIMIT['MAX_CONCURRENCY']
+    # requests per second, burst
+    rate = RATE_LIMIT['RATE']
+    burst = RATE_LIMIT['BURST']
+    tokens = 0.0
+    updated = 0.0
+    # concurrent requests allowed, in flight
+    limit = RATE_LIMIT['CONCURRENCY']
+    in_flight = 0
+    # seconds: best latency seen, moving average
+    best_latency = None
+    latency = 0.0
+    # no request before (monotonic), eg. Retry-After
+    paused_until = 0.0
+    # last multiplicative decrease (monotonic), at most one per latency
+    last_decrease = 0.0
+    # exponential increase until the first decrease, like TCP slow start
+    slow_start = True
+    n_requests = 0
+    n_throttled = 0
+    n_errors = 0
+
+    def __init__(self, host, max_concurrency=RATE_LIMIT['MAX_CONCURRENCY'], settings=RATE_LIMIT):
+        self.host = host
+        self.settings = settings
+        self.rate = settings['RATE']
+        self.burst = settings['BURST']
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.limit = float(settings['CONCURRENCY'])
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.best_latency = None
+        self.latency = 0.0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.slow_start = True
+        self.n_requests = 0
+        self.n_throttled = 0
+        self.n_errors = 0
+
+    def reserve(self, now):
+        """
+        Take a token and a concurrency slot, return 0, or the seconds to wait before trying again
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= max(int(self.limit), 1):
+            return self.settings['POLL_INTERVAL']
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def increase(self):
+        """
+        Additive increase: about one more concurrent request per window of limit requests
+        Slow start: one more concurrent request per request, rate doubled every window
+        """
+        if self.slow_start:
+            self.limit = min(self.max_concurrency, self.limit + 1)
+            self.rate = min(self.settings['MAX_RATE'], self.rate * (1 + 1 / self.limit))
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.rate = min(self.settings['MAX_RATE'], self.rate + self.settings['RATE_INCREASE'])
+
+    def decrease(self, now):
+        """
+        Multiplicative decrease, once per latency: the requests in flight saw the same congestion
+        """
+        if now - self.last_decrease < self.latency:
+            return
+        self.last_decrease = now
+        self.slow_start = False
+        self.limit = max(self.settings['MIN_CONCURRENCY'], self.limit * self.settings['DECREASE'])
+        self.rate = max(self.settings['MIN_RATE'], self.rate * self.settings['DECREASE'])
+        self.tokens = min(self.tokens, 1.0)
+        print('Rate limit:', self)
+
+    def completed(self, elapsed, status_code=None, retry_after=None):
+        """
+        Update the limits with the outcome of a request: status_code None for a failed request
+        """
+        now = time.monotonic()
+        self.in_flight -= 1
+        self.n_requests += 1
+        if status_code is None or status_code >= 500 or status_code in THROTTLE_STATUS_CODES:
+            if status_code in THROTTLE_STATUS_CODES:
+                self.n_throttled += 1
+                pause = min(retry_after or self.latency or 1.0, self.settings['MAX_PAUSE'])
+                self.paused_until = max(self.paused_until, now + pause)
+            else:
+                self.n_errors += 1
+            self.decrease(now)
+            return
+        self.latency = elapsed if not self.latency else 0.8 * self.latency + 0.2 * elapsed
+        if self.best_latency is None or elapsed < self.best_latency:
+            self.best_latency = elapsed
+        if elapsed > self.settings['LATENCY_FACTOR'] * self.best_latency and elapsed > self.settings['MIN_SLOW_LATENCY']:
+            self.decrease(now)
+        else:
+            self.increase()
+
+    def __str__(self):
+        return '%s: %.2f req/s, %.1f concurrent, %d in flight, %.2fs latency, %d requests, %d throttled, %d errors' % (
+            self.host, self.rate, self.limit, self.in_flight, self.latency, self.n_requests, self.n_throttled, self.n_errors)
+
+class RateLimiter():
+    """
+    Rate Limiter
+
+    One HostLimiter per host
+    async acquire(url) before a request, completed(...) after it
+    Life Cycle: see main
+    """
+    # {netloc: HostLimiter}
+    hosts = None
+    settings = RATE_LIMIT
+    max_concurrency = RATE_LIMIT['MAX_CONCURRENCY']
+
+    def __init__(self, max_concurrency=RATE_LIMIT['MAX_CONCURRENCY'], settings=RATE_LIMIT):
+        self.hosts = {}
+        self.max_concurrency = max_concurrency
+        self.settings = settings
+
+    def host(self, url):
+        netloc = urlsplit(url).netloc.lower()
+        host = self.hosts.get(netloc)
+        if host is None:
+            host = HostLimiter(netloc, self.max_concurrency, self.settings)
+            self.hosts[netloc] = host
+        return host
+
+    async def acquire(self, url):
+        """
+        Wait for a token and a concurrency slot of the host of url, return its HostLimiter
+        """
+        host = self.host(url)
+        while True:
+            wait = host.reserve(time.monotonic())
+            if not wait:
+                return host
+            await asyncio.sleep(min(wait, self.settings['MAX_PAUSE']))
+
+    @staticmethod
+    def retry_after(response):
+        """
+        Return the seconds of a Retry-After header, None if absent
+        """
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def completed(self, host, elapsed, response=None):
+        """
+        Release the slot of a request, response None if it failed (timeout, connection error)
+        """
+        if response is None:
+            host.completed(elapsed)
+        else:
+            host.completed(elapsed, response.status_code, RateLimiter.retry_after(response))
+
+    def print_stats(self):
+        for host in self.hosts.values():
+            print('Rate limit:', host)
+
+if __name__ == "__main__":
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+
+    class Response():
+        headers = {}
+        status_code = 200
+
+    async def simulate(limiter, n_requests=200):
+        """
+        The host answers in 0.05s up to 4 requests per second, then in 0.5s or with a 503
+        """
+        sent = []
+        async def request(i):
+            host = await limiter.acquire('https://www.nytimes3xbfgragh.onion/%d' % i)
+            now = time.monotonic()
+            sent.append(now)
+            load = len([t for t in sent if now - t < 1])
+            response = Response()
+            elapsed = 0.05
+            if load > 4:
+                elapsed = 0.5
+                if load > 6:
+                    response.status_code = 503
+            await asyncio.sleep(elapsed)
+            limiter.completed(host, elapsed, response)
+        await asyncio.gather(*[request(i) for i in range(n_requests)])
+        limiter.print_stats()
+
+    asyncio.run(simulate(RateLimiter(max_concurrency=8)))
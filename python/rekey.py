@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+u"""Rekey
+
+Offline migration from 32-bit crc32(sha256(url)) ids to 64-bit ids (see SearchEngine.hash_url)
+  - Manticore rt rows are replaced with their new id
+  - the page store index is rewritten with the new ids
+  - id.html pages saved by older versions are imported in the page store
+Stop the crawler first
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 rekey.py [options]
+
+Options:
+  -u ..., --url=...       website url eg. https://www.nytimes3xbfgragh.onion/
+  -h, --help              show this help
+  -p, --path              www path where files were stored eg. /var/www
+  -n, --dry-run           only count what would be rekeyed
+  -k, --keep              keep the id.html files imported in the page store
+  --no-db                 do not rekey the Manticore rt index
+  -d                      show debugging information
+
+Examples:
+  python3 rekey.py --url='https://www.nytimes3xbfgragh.onion/' --path='/var/www'
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import os
+
+from settings import SEEDS, WWW_DIR, WORKBOOK
+from workbook import CrawlWorkbook
+from search import SearchEngine
+from pagestore import PageStore
+
+# rt rows read and replaced per query
+BATCH_SIZE = 500
+
+def rekey_index(searchengine, dry_run=False):
+    """
+    Replace rt rows whose id is not SearchEngine.hash_url(url) with the new id
+
+    Return the number of rekeyed rows
+    """
+    n_rekeyed = 0
+    last_id = 0
+    while True:
+        with searchengine.pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute('SELECT id, title, url, body FROM rt WHERE id > %s ORDER BY id ASC LIMIT %s',
+                           (last_id, BATCH_SIZE))
+            rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        rows = [row for row in rows if row['id'] != SearchEngine.hash_url(row['url'] or u'')]
+        n_rekeyed += len(rows)
+        if rows and not dry_run:
+            with searchengine.pool.connection() as connection, connection.cursor() as cursor:
+                sql = 'REPLACE INTO rt (id,title,url,body) VALUES ' + ','.join(['(%s,%s,%s,%s)'] * len(rows))
+                cursor.execute(sql, [value for row in rows for value in
+                                     (SearchEngine.hash_url(row['url'] or u''), row['title'], row['url'], row['body'])])
+                sql = 'DELETE FROM rt WHERE id IN (' + ','.join(['%s'] * len(rows)) + ')'
+                cursor.execute(sql, [row['id'] for row in rows])
+                connection.commit()
+        print('rt:', n_rekeyed, 'rows rekeyed')
+    return n_rekeyed
+
+def import_html_files(store, urls, keep=False, dry_run=False):
+    """
+    Import the id.html pages saved by older versions in the page store
+
+    urls: crawled urls, a file is only imported if exactly one url has its legacy id
+    and if the page store does not hold a newer copy
+    Return (imported files, files of colliding legacy ids)
+    """
+    legacy_urls = {}
+    for url in urls:
+        legacy_urls.setdefault(SearchEngine.hash_url_legacy(url), []).append(url)
+    n_imported = 0
+    n_collisions = 0
+    for legacy_id, urls in legacy_urls.items():
+        file_name = os.path.join(os.path.dirname(store.path), str(legacy_id) + '.html')
+        if not os.path.isfile(file_name):
+            continue
+        if len(urls) > 1:
+            # the file holds one of these pages, which one is unknown: they will be crawled again
+            print('collision:', file_name, urls)
+            n_collisions += 1
+            continue
+        if dry_run:
+            n_imported += 1
+            continue
+        if urls[0] not in store:
+            # pages in the store are newer than id.html files
+            with open(file_name, 'rb') as f:
+                store.put(urls[0], f.read(), 'utf-8')
+            n_imported += 1
+        if not keep:
+            os.remove(file_name)
+    return n_imported, n_collisions
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hu:p:nkd", ["help", "url=", "path=", "dry-run", "keep", "no-db"])
+        except getopt.error as msg:
+             raise Usage(msg)
+        url = next(iter(SEEDS))
+        path = WWW_DIR
+        dry_run = False
+        keep = False
+        db = True
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-u", "--url"):
+                url = arg
+            elif opt in ("-p", "--path"):
+                path = arg
+            elif opt in ("-n", "--dry-run"):
+                dry_run = True
+            elif opt in ("-k", "--keep"):
+                keep = True
+            elif opt == "--no-db":
+                db = False
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    store = PageStore.from_url(path, url).open()
+    if dry_run:
+        n_changed = 0
+        for id, entry in store.index.items():
+            if id != SearchEngine.hash_url(store.read_record(*entry)[0]):
+                n_changed += 1
+    else:
+        n_changed = store.rekey()
+    print('page store:', n_changed, 'pages rekeyed')
+
+    crawl_book = CrawlWorkbook(path=path, url=url)
+    crawl_book.wb_open()
+    urls = list(crawl_book.sheets[WORKBOOK['crawler']['worksheet']['crawledpages']['TITLE']])
+    crawl_book.wb_close()
+    n_imported, n_collisions = import_html_files(store, urls, keep, dry_run)
+    store.close()
+    print('html files:', n_imported, 'imported,', n_collisions, 'legacy id collisions')
+
+    if db:
+        searchengine = SearchEngine()
+        searchengine.db_connect()
+        rekey_index(searchengine, dry_run)
+        searchengine.db_close()
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+u"""Revisit
+
+Revisit policy of the continuous crawl: how often each crawled page is fetched again
+The change rate of a page is estimated from its visits:
+  (changes + PRIOR_CHANGES) / (seconds observed + PRIOR_SECONDS)
+  a visit is a change if the body hash differs from the previous visit (not a 304 Not Modified)
+  on the first visit, the Last-Modified age of the page counts as one change in that age:
+  old articles start with a low rate, section pages with a high one
+REVISIT BUDGET fetches per hour are shared in proportion to the change rates,
+the revisit interval of a page is its share of the budget, within MIN_INTERVAL and MAX_INTERVAL
+Revisits due are let through by a token bucket refilled at the budget rate
+Intervals are computed at each visit with the rates known then
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 revisit.py [options]
+
+Show the revisit schedule of a crawl: estimated change rates and revisit intervals
+
+Options:
+  -h, --help              show this help
+  -u ..., --url=...       website of the crawl, default: the first seed
+  -p ..., --path=...      www path of the crawl, default: WWW_DIR
+  -n ..., --top=...       pages shown, most changing first, default: 20
+  -d                      show debugging information
+
+Examples:
+  python3 revisit.py -u 'https://www.nytimes3xbfgragh.onion/'
+  python3 crawler.py --continuous
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from settings import REVISIT
+from link import WeightedLink
+from scheduler import IndexedHeap
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def http_date(value):
+    """
+    Return the epoch time of an http date (Last-Modified), None if missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+class PageHistory():
+    """
+    Page History
+
+    Visits of a page
+    """
+    visits = 0
+    changes = 0.0
+    # seconds between the first and last visits, plus the Last-Modified age at the first visit
+    observed = 0.0
+    # epoch time
+    last_visit = 0.0
+
+    def __init__(self, visits=0, changes=0.0, observed=0.0, last_visit=0.0):
+        self.visits = visits
+        self.changes = changes
+        self.observed = observed
+        self.last_visit = last_visit
+
+    def rate(self):
+        """
+        Return the estimated changes per second
+        """
+        return (self.changes + REVISIT['PRIOR_CHANGES']) / (self.observed + REVISIT['PRIOR_SECONDS'])
+
+class RevisitScheduler():
+    """
+    Revisit Scheduler
+
+    visited() after each fetch of a crawled page, due() returns the pages to fetch again
+    Life Cycle: see main
+    """
+    # fetches per second
+    budget = REVISIT['BUDGET'] / 3600.0
+    burst = REVISIT['BURST']
+    min_interval = REVISIT['MIN_INTERVAL']
+    max_interval = REVISIT['MAX_INTERVAL']
+    # {url: PageHistory}
+    pages = None
+    # sum of the change rates of the pages
+    total_rate = 0.0
+    # pages by due time, earliest first - IndexedHeap {url: due}, priority: -due
+    queue = None
+    # token bucket of the revisits
+    tokens = 0.0
+    tokens_time = 0.0
+
+    def __init__(self, budget=REVISIT['BUDGET'], burst=REVISIT['BURST'],
+                 min_interval=REVISIT['MIN_INTERVAL'], max_interval=REVISIT['MAX_INTERVAL']):
+        self.budget = budget / 3600.0
+        self.burst = burst
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.pages = {}
+        self.total_rate = 0.0
+        self.queue = IndexedHeap()
+        self.tokens = float(burst)
+        self.tokens_time = time.time()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def load(self, weighted_links):
+        """
+        Load the Page revisits worksheet, the pages are due one interval after their last visit
+        """
+        for wl in weighted_links:
+            try:
+                changes, visits = (wl.title or u'0/0').split(u'/')
+                history = PageHistory(visits=int(visits), changes=float(changes), observed=float(wl.notes or 0),
+                                      last_visit=datetime.strptime(str(wl.date), DATE_FORMAT).timestamp())
+            except ValueError:
+                continue
+            self.pages[wl.url] = history
+            self.total_rate += history.rate()
+        for url, history in self.pages.items():
+            self.schedule(url, history.last_visit + self.interval(history))
+
+    def interval(self, history):
+        """
+        Return the seconds before the next visit of a page: its share of the budget
+        """
+        share = self.budget * history.rate() / max(self.total_rate, 1e-12)
+        return min(self.max_interval, max(self.min_interval, 1.0 / max(share, 1e-12)))
+
+    def schedule(self, url, due):
+        self.queue.push(url, due, -due)
+
+    def visited(self, url, changed, last_modified=None, now=None):
+        """
+        Record a visit of url, changed: the body differs from the previous visit
+        Return the WeightedLink of the Page revisits worksheet
+        """
+        now = time.time() if now is None else now
+        history = self.pages.get(url)
+        if history is None:
+            history = self.pages[url] = PageHistory()
+            modified = http_date(last_modified)
+            if modified is not None and modified < now:
+                history.changes = 1.0
+                history.observed = now - modified
+        else:
+            self.total_rate -= history.rate()
+            history.observed += max(0.0, now - history.last_visit)
+            if changed:
+                history.changes += 1
+        history.visits += 1
+        history.last_visit = now
+        self.total_rate += history.rate()
+        self.schedule(url, now + self.interval(history))
+        return WeightedLink(url=url, title=u'%g/%d' % (history.changes, history.visits),
+                            date=datetime.fromtimestamp(now).strftime(DATE_FORMAT),
+                            weight=round(history.rate() * 86400, 4), notes=u'%.0f' % history.observed)
+
+    def forget(self, url):
+        """
+        No more revisits of url, eg. failed or ignored
+        """
+        self.queue.remove(url)
+        history = self.pages.pop(url, None)
+        if history is not None:
+            self.total_rate -= history.rate()
+
+    def refill(self, now):
+        self.tokens = min(float(self.burst), self.tokens + max(0.0, now - self.tokens_time) * self.budget)
+        self.tokens_time = now
+
+    def due(self, now=None, busy=None):
+        """
+        Return the urls to revisit now, within the budget
+        busy(url): True if url is being fetched or waiting for a retry, it is scheduled one interval later
+          without using a token
+        """
+        now = time.time() if now is None else now
+        self.refill(now)
+        urls = []
+        while self.queue and self.tokens >= 1 and -self.queue.priority(self.queue.peek()[0]) <= now:
+            url = self.queue.pop()[0]
+            if busy is not None and busy(url):
+                self.schedule(url, now + self.interval(self.pages[url]))
+                continue
+            urls.append(url)
+            self.tokens -= 1
+        return urls
+
+    def next_due_delay(self, now=None):
+        """
+        Return the seconds before the next revisit, None if there is none
+        """
+        if not self.queue:
+            return None
+        now = time.time() if now is None else now
+        self.refill(now)
+        delay = max(0.0, -self.queue.priority(self.queue.peek()[0]) - now)
+        if self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) / self.budget)
+        return delay
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def main(argv=None):
+    """
+    main
+    """
+    import getopt
+    from settings import SEEDS, WWW_DIR, WORKBOOK
+    from workbook import CrawlWorkbook
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        try:
+            opts, args = getopt.getopt(argv, "hu:p:n:d", ["help", "url=", "path=", "top="])
+        except getopt.error as msg:
+             raise Usage(msg)
+        url = next(iter(SEEDS))
+        path = WWW_DIR
+        top = 20
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(__usage__)
+                sys.exit()
+            elif opt == '-d':
+                global _debug
+                _debug = 1
+            elif opt in ("-u", "--url"):
+                url = arg
+            elif opt in ("-p", "--path"):
+                path = arg
+            elif opt in ("-n", "--top"):
+                top = int(arg)
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("for help use --help", file=sys.stderr)
+        return 2
+
+    crawl_book = CrawlWorkbook(path=path, url=url)
+    crawl_book.wb_open()
+    scheduler = RevisitScheduler()
+    scheduler.load(crawl_book.page_revisits)
+    crawl_book.wb_close()
+    now = time.time()
+    print(len(scheduler.pages), 'pages, budget', REVISIT['BUDGET'], 'fetches per hour')
+    print(u'%10s %8s %12s %12s  %s' % (u'changes/d', u'visits', u'interval', u'due in', u'url'))
+    for url, history in sorted(scheduler.pages.items(), key=lambda item: -item[1].rate())[:top]:
+        due = scheduler.queue.get(url)
+        print(u'%10.3f %8d %11.0fs %11.0fs  %s' % (86400 * history.rate(), history.visits, scheduler.interval(history),
+                                                  max(0.0, due - now) if due is not None else 0, url))
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+    main(sys.argv[1:])
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+u"""Scheduler
+
+Indexed priority queue used by the frontier to crawl the highest weighted links first
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 scheduler.py
+
+Examples:
+  python3 scheduler.py
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/05/01 11:45:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+from itertools import count
+
+class IndexedHeap():
+    """
+    Indexed binary max-heap
+
+    Items are keyed (eg. by url) and ordered by priority, highest first.
+    Equal priorities are popped in insertion order.
+    push, pop, update and remove are O(log n), contains and get are O(1)
+    Life Cycle: see main
+    """
+    # heap entries: [-priority, sequence, key, item]
+    heap = None
+    # key => position of its entry in heap
+    positions = None
+    # insertion counter, keeps equal priorities FIFO
+    counter = None
+
+    def __init__(self):
+        self.heap = []
+        self.positions = {}
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        """
+        Iterate over keys, in heap order (not sorted)
+        """
+        return (entry[2] for entry in self.heap)
+
+    def get(self, key, default=None):
+        """
+        Return the item stored for key
+        """
+        pos = self.positions.get(key)
+        if pos is None:
+            return default
+        return self.heap[pos][3]
+
+    def priority(self, key):
+        """
+        Return the priority of key, None if not queued
+        """
+        pos = self.positions.get(key)
+        if pos is None:
+            return None
+        return -self.heap[pos][0]
+
+    def push(self, key, item, priority):
+        """
+        Add item with priority, or update item and priority if key is already queued
+        """
+        pos = self.positions.get(key)
+        if pos is not None:
+            self.heap[pos][3] = item
+            self.update(key, priority)
+            return
+        entry = [-priority, next(self.counter), key, item]
+        self.heap.append(entry)
+        self.positions[key] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def peek(self):
+        """
+        Return (key, item) with the highest priority without removing it
+        """
+        if not self.heap:
+            return None
+        entry = self.heap[0]
+        return entry[2], entry[3]
+
+    def pop(self):
+        """
+        Remove and return (key, item) with the highest priority
+
+        Raise IndexError if empty
+        """
+        if not self.heap:
+            raise IndexError('pop from an empty IndexedHeap')
+        entry = self._remove_at(0)
+        return entry[2], entry[3]
+
+    def update(self, key, priority):
+        """
+        Reprioritize key
+        """
+        pos = self.positions[key]
+        entry = self.heap[pos]
+        old = entry[0]
+        entry[0] = -priority
+        if entry[0] < old:
+            self._sift_up(pos)
+        else:
+            self._sift_down(pos)
+
+    def remove(self, key):
+        """
+        Remove key, return its item or None if not queued
+        """
+        pos = self.positions.get(key)
+        if pos is None:
+            return None
+        return self._remove_at(pos)[3]
+
+    def _remove_at(self, pos):
+        entry = self.heap[pos]
+        last = self.heap.pop()
+        del self.positions[entry[2]]
+        if pos < len(self.heap):
+            self.heap[pos] = last
+            self.positions[last[2]] = pos
+            self._sift_up(pos)
+            self._sift_down(self.positions[last[2]])
+        return entry
+
+    def _sift_up(self, pos):
+        heap = self.heap
+        entry = heap[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if heap[parent][:2] <= entry[:2]:
+                break
+            heap[pos] = heap[parent]
+            self.positions[heap[pos][2]] = pos
+            pos = parent
+        heap[pos] = entry
+        self.positions[entry[2]] = pos
+
+    def _sift_down(self, pos):
+        heap = self.heap
+        size = len(heap)
+        entry = heap[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1][:2] < heap[child][:2]:
+                child += 1
+            if entry[:2] <= heap[child][:2]:
+                break
+            heap[pos] = heap[child]
+            self.positions[heap[pos][2]] = pos
+            pos = child
+        heap[pos] = entry
+        self.positions[entry[2]] = pos
+
+if __name__ == "__main__":
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+
+    queue = IndexedHeap()
+    queue.push('https://apple.com/', 'home', 1.0)
+    queue.push('https://apple.com/meh', 'meh', 0.1)
+    queue.push('https://apple.com/mega', 'mega', 2048)
+    queue.push('https://apple.com/useless', 'useless', 0.1)
+    queue.update('https://apple.com/useless', 4096)
+    queue.remove('https://apple.com/meh')
+    while queue:
+        print(queue.pop())
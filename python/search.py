@@ -6,10 +6,17 @@ Search Engine handled by a Manticore Database
 Life Cycle: see main
 """
 
-__usage__ = u"""Usage: python3 search.py
+__usage__ = u"""Usage: python3 search.py [options]
+
+Options:
+  -h, --help              show this help
+  -P ..., --profile=...   sampling profiler: write prefix.collapsed and prefix.txt, see profiler.py
+  --profile-window=...    [delay:]seconds profiled, default: the whole run
+  -d                      show debugging information
 
 Examples:
   python3 search.py
+  python3 search.py -P /tmp/search
 """
 
 __author__ = u"M0t13y"
@@ -19,6 +26,12 @@ __copyright__ = u"Copyright [" + __author__ + "]"
 __license__ = u"Licensed under the Apache License, Version 2.0"
 
 import os
+import time
+import random
+import queue
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 
 # database
 import pymysql.cursors
@@ -36,16 +49,173 @@ from settings import DATABASES
 
 from settings import WORKBOOK
 from workbook import CrawlWorkbook 
+from profiler import profiled
+
+class ConnectionPool():
+    """Connection Pool
+
+    Thread-safe pool of Manticore Database pymysql connections
+    - at most size connections are open, acquire waits for a free one
+    - idle connections are pinged before use if idle for health_check_interval seconds,
+      or if a connection broke since they were released
+    - broken connections are dropped, new connections are opened with an exponential backoff
+      so that a Manticore restart does not cause a reconnect storm
+    Life Cycle: see SearchEngine
+    """
+    size = DATABASES['manticore']['POOL_SIZE']
+    timeout = DATABASES['manticore']['POOL_TIMEOUT']
+    health_check_interval = DATABASES['manticore']['HEALTH_CHECK_INTERVAL']
+    reconnect_delay = DATABASES['manticore']['RECONNECT_DELAY']
+    reconnect_max_delay = DATABASES['manticore']['RECONNECT_MAX_DELAY']
+
+    # pymysql.connect arguments
+    connect_kwargs = {}
+    # idle connections: (connection, released at)
+    idle = None
+    # open connections, idle or in use
+    n_open = 0
+    lock = None
+    # connections released before a connection broke are pinged before use
+    broken_at = 0.0
+    # no connect before retry_at after a failed connect
+    retry_at = 0.0
+    delay = 0.0
+
+    def __init__(self, size=DATABASES['manticore']['POOL_SIZE'], **connect_kwargs):
+        self.size = size
+        self.connect_kwargs = connect_kwargs
+        self.idle = queue.LifoQueue()
+        self.n_open = 0
+        self.lock = threading.Lock()
+        self.broken_at = 0.0
+        self.retry_at = 0.0
+        self.delay = 0.0
+
+    def connect(self):
+        """
+        Open a new connection, with exponential backoff after failures
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.retry_at:
+                raise pymysql.err.OperationalError(2003, u'Manticore unavailable, next connect in %.1f s' % (self.retry_at - now))
+        try:
+            connection = pymysql.connect(**self.connect_kwargs)
+        except pymysql.MySQLError:
+            with self.lock:
+                self.delay = min(self.reconnect_max_delay, max(self.reconnect_delay, self.delay * 2))
+                self.retry_at = time.monotonic() + self.delay * random.uniform(0.5, 1.0)
+            raise
+        with self.lock:
+            self.delay = 0.0
+        return connection
+
+    def healthy(self, connection):
+        """
+        Return True if the connection answers a ping
+        """
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except pymysql.MySQLError:
+            return False
+
+    def acquire(self):
+        """
+        Return a healthy connection
+
+        Raise pymysql.MySQLError if no connection could be opened or none was free after timeout seconds
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                connection, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    can_open = self.n_open < self.size
+                    if can_open:
+                        self.n_open += 1
+                if can_open:
+                    try:
+                        return self.connect()
+                    except Exception:
+                        with self.lock:
+                            self.n_open -= 1
+                        raise
+                try:
+                    connection, released_at = self.idle.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise pymysql.err.OperationalError(2013, u'No free Manticore connection after %s s' % self.timeout)
+            if released_at > self.broken_at and time.monotonic() - released_at < self.health_check_interval:
+                return connection
+            if self.healthy(connection):
+                return connection
+            self.discard(connection)
+
+    def release(self, connection):
+        """
+        Give a connection back to the pool
+        """
+        self.idle.put((connection, time.monotonic()))
+
+    def discard(self, connection):
+        """
+        Close a broken connection
+        """
+        with self.lock:
+            self.n_open -= 1
+            self.broken_at = time.monotonic()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        with pool.connection() as connection: ...
+
+        The connection is discarded if the block raises a connection error
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self.discard(connection)
+            raise
+        except Exception:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def close(self):
+        """
+        Close idle connections
+        """
+        while True:
+            try:
+                connection, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.n_open -= 1
+            try:
+                connection.close()
+            except Exception:
+                pass
 
 class SearchEngine():
     """Search Engine
 
     Search Engine handled by a Manticore Database
+    All SearchEngine instances of a process share one ConnectionPool
     Life Cycle: see main
     """
 
-    # Manticore Database pymysql connection
-    connection = None 
+    # Manticore Database pymysql connection pool, shared by all instances
+    pool = None
+    pool_lock = threading.Lock()
 
     db_host = ''
     db_user = '',
@@ -53,24 +223,43 @@ class SearchEngine():
     db_port = 9306,
     db_cursorclass = pymysql.cursors.DictCursor
 
+    # bulk indexing buffer: [(id, title, url, body)]
+    bulk_docs = []
+    bulk_lock = None
+    bulk_bytes = 0
+    bulk_last_flush = 0.0
+    bulk_size = DATABASES['manticore']['BULK_SIZE']
+    bulk_max_bytes = DATABASES['manticore']['BULK_BYTES']
+    bulk_interval = DATABASES['manticore']['BULK_INTERVAL']
+    # bytes kept while Manticore is unavailable, the oldest pages are dropped past it
+    bulk_max_buffer = DATABASES['manticore']['BULK_MAX_BUFFER']
+
     def __init__(self):
         self.db_host = DATABASES['manticore']['HOST']
         self.db_user = DATABASES['manticore']['USER']
         self.db_password = DATABASES['manticore']['PASSWORD']
         self.db_port = DATABASES['manticore']['PORT']
+        self.bulk_docs = []
+        self.bulk_bytes = 0
+        self.bulk_last_flush = time.monotonic()
+        self.bulk_lock = threading.Lock()
 
     def db_connect(self):
         """
-        Connect to the database
+        Connect to the database: create the shared connection pool once
 
         Create table if not exists
         Commit the changes
         """
-        self.connection = pymysql.connect(host=self.db_host, user=self.db_user, password=self.db_password,
-                                     port=self.db_port, cursorclass=self.db_cursorclass)
+        with SearchEngine.pool_lock:
+            if SearchEngine.pool is not None:
+                return
+            SearchEngine.pool = ConnectionPool(host=self.db_host, user=self.db_user, password=self.db_password,
+                                               port=self.db_port, cursorclass=self.db_cursorclass,
+                                               connect_timeout=DATABASES['manticore']['CONNECT_TIMEOUT'])
 
         try:
-            with self.connection.cursor() as cursor:
+            with self.pool.connection() as connection, connection.cursor() as cursor:
                 # creating a table "rt" if it doesn't exist with the following settings:
                 # - html_strip='1': stripping HTML is on
                 # - html_remove_elements='style,script,a': for HTML tags <style>/<script>/<a> we don't need their contents, so we are stripping them completely
@@ -79,16 +268,31 @@ class SearchEngine():
                 sql = "CREATE TABLE IF NOT EXISTS rt(title text, body text, url text stored) html_strip='1' html_remove_elements='style,script,a' morphology='stem_en' index_sp='1'"
                 # print(sql)
                 cursor.execute(sql)
-                self.connection.commit()
+                connection.commit()
 
         except Exception as e:
             print(e.__doc__)
-            print(e.message)   
+            print(e)   
 
     @staticmethod  
+    @lru_cache(maxsize=DATABASES['manticore']['ID_CACHE_SIZE'])
     def hash_url(url=u'https://www.apple.onion'):
         """
         Return an unique ID Hash from Url 
+
+        63 bits of sha256(url): positive signed 64-bit Manticore id
+        Memoised, the same urls are hashed by the frontier, the page store and the search engine
+        """
+        url_hash = sha256(url.encode()).digest()
+        id = int.from_bytes(url_hash[:8], 'big') >> 1
+        return(id or 1)
+
+    @staticmethod  
+    def hash_url_legacy(url=u'https://www.apple.onion'):
+        """
+        Return the ID Hash used before 64-bit ids: crc32(sha256(url))
+
+        32 bits: collisions are likely from about 77k urls, see rekey.py
         """
         url_hash = sha256(url.encode()).digest()
         id = crc32(url_hash)
@@ -109,37 +313,143 @@ class SearchEngine():
             body = u''
 
         id = SearchEngine.hash_url(url)
-        title = pymysql.escape_string(title)
-        url = pymysql.escape_string(url)
-        body = pymysql.escape_string(body)
         
         try:
-            with self.connection.cursor() as cursor:
-                sql = f'REPLACE INTO rt (id,title,url,body) VALUES({id},\'{title}\',\'{url}\',\'{body}\')'
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                sql = 'REPLACE INTO rt (id,title,url,body) VALUES(%s,%s,%s,%s)'
                 #print(f'Web Page: ' + sql[:400] + u'...')
-                cursor.execute(sql)
-                self.connection.commit()
+                cursor.execute(sql, (id, title, url, body))
+                connection.commit()
                 #print(u'DB Commit')
                 
         except Exception as e:
             print(e.__doc__)
-            print(e.message)   
+            print(e)   
+
+    def db_bulk_add(self, title, url, body):
+        """
+        Buffer a Web Page for bulk indexing
+
+        The buffer is flushed in one REPLACE when it holds bulk_size pages or bulk_max_bytes,
+        or when the last flush is older than bulk_interval seconds, see db_bulk_delay
+        Return (indexed urls, dropped urls) of this call, see db_bulk_flush
+        """
+        if title is None:
+            title = u''
+        if url is None:
+            url = u''
+        if body is None:
+            body = u''
+
+        with self.bulk_lock:
+            doc = (SearchEngine.hash_url(url), title, url, body)
+            self.bulk_docs.append(doc)
+            self.bulk_bytes += SearchEngine.doc_bytes(doc)
+            flush = (len(self.bulk_docs) >= self.bulk_size or self.bulk_bytes >= self.bulk_max_bytes
+                     or time.monotonic() - self.bulk_last_flush >= self.bulk_interval)
+        if flush:
+            return self.db_bulk_flush()
+        return [], []
+
+    @staticmethod
+    def doc_bytes(doc):
+        return len(doc[1]) + len(doc[2]) + len(doc[3])
+
+    def db_bulk_delay(self):
+        """
+        Return the seconds before the buffered pages are due for a flush, None if the buffer is empty
+        """
+        with self.bulk_lock:
+            if not self.bulk_docs:
+                return None
+            return max(0.0, self.bulk_last_flush + self.bulk_interval - time.monotonic())
+
+    def db_bulk_flush(self):
+        """
+        Replace buffered Web Pages into Database, one multi-row REPLACE with parameterised values
+
+        Return (indexed urls, dropped urls):
+          the pages are buffered again if Manticore is unavailable (operational or interface error),
+          the oldest ones are dropped past bulk_max_buffer bytes
+          other errors are not retried: the pages are replaced one by one, the failing ones are dropped
+        Thread-safe: the buffer is swapped under a lock, the REPLACE runs on a pooled connection
+        """
+        with self.bulk_lock:
+            self.bulk_last_flush = time.monotonic()
+            if not self.bulk_docs:
+                return [], []
+            docs = self.bulk_docs
+            self.bulk_docs = []
+            self.bulk_bytes = 0
+        try:
+            self.db_bulk_replace(docs)
+            print(u'DB Bulk replace:', len(docs), u'pages')
+            return [doc[2] for doc in docs], []
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            print(e.__doc__)
+            print(e)
+            return [], self.db_bulk_requeue(docs)
+        except Exception as e:
+            print(u'DB Bulk replace failed, pages replaced one by one -', type(e).__name__, e)
+        indexed = []
+        dropped = []
+        for i, doc in enumerate(docs):
+            try:
+                self.db_bulk_replace([doc])
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                dropped += self.db_bulk_requeue(docs[i:])
+                break
+            except Exception as e:
+                print(u'DB Bulk replace: dropped', doc[2], '-', type(e).__name__, e)
+                dropped.append(doc[2])
+            else:
+                indexed.append(doc[2])
+        return indexed, dropped
+
+    def db_bulk_replace(self, docs):
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            sql = 'REPLACE INTO rt (id,title,url,body) VALUES ' + ','.join(['(%s,%s,%s,%s)'] * len(docs))
+            cursor.execute(sql, [value for doc in docs for value in doc])
+            connection.commit()
+
+    def db_bulk_requeue(self, docs):
+        """
+        Buffer docs again before the pages added since, return the urls dropped past bulk_max_buffer bytes, oldest first
+        """
+        dropped = []
+        with self.bulk_lock:
+            self.bulk_docs = docs + self.bulk_docs
+            self.bulk_bytes += sum(SearchEngine.doc_bytes(doc) for doc in docs)
+            while self.bulk_bytes > self.bulk_max_buffer and self.bulk_docs:
+                doc = self.bulk_docs.pop(0)
+                self.bulk_bytes -= SearchEngine.doc_bytes(doc)
+                dropped.append(doc[2])
+        if dropped:
+            print(u'DB Bulk buffer full:', len(dropped), u'pages dropped')
+        return dropped
 
     def db_commit(self):
         """
         DB commit
 
-        Connection is not autocommit by default. So you must commit to save
-        your changes.
+        Pooled connections commit after each REPLACE,
+        commit sends the pages buffered for bulk indexing
         """      
-        self.connection.commit()
+        self.db_bulk_flush()
         #print(u'DB Commit')
       
     def db_close(self):
         """
         Close DB connection
+
+        Flushes the bulk indexing buffer first
+        Closes the connection pool shared by all SearchEngine instances
         """
-        self.connection.close()
+        self.db_bulk_flush()
+        with SearchEngine.pool_lock:
+            if SearchEngine.pool is not None:
+                SearchEngine.pool.close()
+                SearchEngine.pool = None
         print(u'DB Close connection')
 
 
@@ -157,15 +467,21 @@ def main(argv=None):
 
     try:
         try:                                
-            opts, args = getopt.getopt(argv, "hup:d", ["help", "url=", "path="])
+            opts, args = getopt.getopt(argv, "hup:dP:", ["help", "url=", "path=", "profile=", "profile-window="])
         except getopt.error as msg:
              raise Usage(msg)            
         url = u'http://localhost'
         path = u'/var/www'
+        profile = None
+        profile_window = None
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 print(__usage__)                   
                 sys.exit()
+            elif opt in ("-P", "--profile"):
+                profile = arg
+            elif opt == "--profile-window":
+                profile_window = arg
             elif opt == '-d':
                 global _debug               
                 _debug = 1                  
@@ -183,25 +499,26 @@ def main(argv=None):
     #    print(__usage__)
     #    sys.exit(2)
     
-    se = SearchEngine()
-    se.db_connect()
-
-    title = u'test title'
-    url = u'https://testurl.onion/test/test01.html'
-    body = u"""<!DOCTYPE html>
-                <html>
-                    <head>
-                        <title>test title</title>
-                    </head>
-                    <body>
-                        <p>Hello test</p>
-                        <p>"test", 'test', https://toto.com/</p>
-                    </body>
-                </html>
-            """
-    se.db_replace_into(title=title, url=url, body=body)
-
-    se.db_close()
+    with profiled(profile, profile_window):
+        se = SearchEngine()
+        se.db_connect()
+
+        title = u'test title'
+        url = u'https://testurl.onion/test/test01.html'
+        body = u"""<!DOCTYPE html>
+                    <html>
+                        <head>
+                            <title>test title</title>
+                        </head>
+                        <body>
+                            <p>Hello test</p>
+                            <p>"test", 'test', https://toto.com/</p>
+                        </body>
+                    </html>
+                """
+        se.db_replace_into(title=title, url=url, body=body)
+
+        se.db_close()
 
 if __name__ == "__main__":
     import sys
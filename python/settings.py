@@ -33,6 +33,122 @@ HTML_DIR = os.path.join(WWW_DIR, HTML_SUBDIR)
 
 MAX_N_REQUESTS = 10
 
+# concurrent requests, see fetcher.py
+FETCH_CONCURRENCY = 8
+# seconds, connect and read timeout of a request
+FETCH_TIMEOUT = 60
+# responses are streamed: other content types and bodies over FETCH_MAX_BYTES are not downloaded,
+#   their urls are recorded in the Ignored pages worksheet, see fetcher.py
+#   a missing Content-Type is accepted
+FETCH_CONTENT_TYPES = ['text/html', 'application/xhtml+xml']
+FETCH_MAX_BYTES = 5 * 1024 * 1024
+FETCH_CHUNK_SIZE = 64 * 1024
+
+# per host rate limit, see ratelimit.py
+#   rate and concurrency grow while the host answers fast, they are halved on timeouts, 429, 5xx and slow answers
+RATE_LIMIT = {
+    # requests per second: start, bounds, increase per fast answer
+    'RATE': 2.0,
+    'MIN_RATE': 0.1,
+    'MAX_RATE': 50.0,
+    'RATE_INCREASE': 0.1,
+    # requests sent at once after an idle time
+    'BURST': 4,
+    # concurrent requests per host: start, bounds (the crawler concurrency is the upper bound)
+    'CONCURRENCY': 2,
+    'MIN_CONCURRENCY': 1,
+    'MAX_CONCURRENCY': FETCH_CONCURRENCY,
+    # multiplicative decrease
+    'DECREASE': 0.5,
+    # an answer is slow if LATENCY_FACTOR times slower than the best answer and slower than MIN_SLOW_LATENCY seconds
+    'LATENCY_FACTOR': 4.0,
+    'MIN_SLOW_LATENCY': 2.0,
+    # seconds, longest pause on Retry-After
+    'MAX_PAUSE': 300,
+    # seconds between checks for a free concurrency slot
+    'POLL_INTERVAL': 0.05,
+} # end rate limit
+
+# failed requests are retried after BASE_DELAY * 2 ** (attempt - 1) seconds, at most MAX_DELAY,
+#   times a random factor in [1 - JITTER, 1 + JITTER], see FrontierManager.request_error
+#   pages failing MAX_ATTEMPTS times go to the Failed pages worksheet
+RETRY = {
+    'MAX_ATTEMPTS': 5,
+    'BASE_DELAY': 30,
+    'MAX_DELAY': 3600,
+    'JITTER': 0.5,
+} # end retry
+
+# Tor circuits the requests are dispatched to, round-robin, see circuits.py
+TOR_CIRCUITS = {
+    'SIZE': 4,
+    # proxy endpoints, eg. several Tor instances, default: the https proxy of PROXIES
+    'ENDPOINTS': [],
+    # socks username/password per circuit: Tor isolates streams with different credentials
+    'ISOLATION': True,
+    # failed requests in a row before a circuit is rotated
+    'MAX_FAILURES': 3,
+} # end tor circuits
+
+# crawler metrics, see metrics.py
+#   Prometheus text format on http://HOST:PORT/metrics while crawling, PORT 0: not served
+METRICS = {
+    'HOST': u'127.0.0.1',
+    'PORT': 9108,
+    # seconds between two stats lines, 0: none
+    'STATS_INTERVAL': 60,
+    'PREFIX': u'torcrawler_',
+} # end metrics
+
+# sampling profiler of the -P option of crawler.py, frontier.py, search.py and optimize.py, see profiler.py
+PROFILER = {
+    # seconds between two samples of the thread stacks
+    'INTERVAL': 0.005,
+    # frames sampled per stack, deeper frames are cut
+    'MAX_DEPTH': 128,
+} # end profiler
+
+# distributed crawl, see distributed.py
+#   urls are assigned to the NODES by consistent hashing of SearchEngine.hash_url,
+#   each node crawls its urls and forwards the links of the other nodes to them in batches
+#   python3 crawler.py --node=a on every node, each node state is stored in WWW_DIR/node
+DISTRIBUTED = {
+    # {node name: address}, tcp://host:port or unix:///path/to/socket
+    'NODES': {
+        # 'a': u'tcp://10.0.0.1:9201',
+        # 'b': u'tcp://10.0.0.2:9201',
+    },
+    # points of each node on the hash ring: more points, more even shards
+    'VNODES': 256,
+    # links per forwarded batch
+    'BATCH_SIZE': 500,
+    # seconds between two flushes of the forwarded links
+    'FLUSH_INTERVAL': 1.0,
+    # seconds to deliver a batch before retrying it on next flush
+    'SEND_TIMEOUT': 10,
+} # end distributed
+
+# worker processes parsing the fetched pages, see pageparser.py
+PARSE_WORKERS = os.cpu_count()
+# raw fetched pages, see pagestore.py
+#   eg. /var/www/html/www.apple.com/pages/00.seg
+PAGESTORE = {
+    'SUBDIR': u'pages',
+    # pages are sharded by id in SHARDS segment files
+    'SHARDS': 64,
+    # zstd (needs zstandard, gzip if not installed), gzip or raw
+    'CODEC': u'zstd',
+    'LEVEL': {
+        'zstd': 3,
+        'gzip': 6,
+    },
+} # end pagestore
+
+# parser backend, see document.py
+#   html.parser: BeautifulSoup, lxml: lxml.html (faster, needs lxml), fast: no tree, only title, links and text
+#   compare them on saved pages with: python3 parserbench.py
+PARSER_BACKEND = u'html.parser'
+
 DATABASES = {
     'manticore': {
         'ENGINE': 'mysql',
@@ -43,12 +159,43 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': 'localhost',
         'PORT': 9306,
+        'CONNECT_TIMEOUT': 10,
+        # memoised url => id hashes, see SearchEngine.hash_url
+        'ID_CACHE_SIZE': 65536,
+        # connection pool shared by the crawler workers, see search.py
+        'POOL_SIZE': 4,
+        # seconds to wait for a free connection
+        'POOL_TIMEOUT': 30,
+        # ping connections idle for more than HEALTH_CHECK_INTERVAL seconds
+        'HEALTH_CHECK_INTERVAL': 30,
+        # reconnect backoff in seconds, doubled after each failed connect
+        'RECONNECT_DELAY': 1,
+        'RECONNECT_MAX_DELAY': 60,
+        # bulk indexing: one REPLACE for BULK_SIZE pages or BULK_BYTES,
+        #   or after BULK_INTERVAL seconds
+        'BULK_SIZE': 200,
+        'BULK_BYTES': 4 * 1024 * 1024,
+        'BULK_INTERVAL': 30,
+        # bytes buffered at most while Manticore is unavailable, the oldest pages are dropped past it
+        'BULK_MAX_BUFFER': 64 * 1024 * 1024,
     } # end manticore
 } # end DATABASES
 
 WORKBOOK = {
     # workbook file extension: .xlsx
+    #   the .xlsx file is an export of the journal, see workbook.py --export
     'FILE_EXT': u'.xlsx',
+    # live crawler state: append-only journal
+    'JOURNAL': {
+        # eg. /var/www/html/www.apple.com.journal
+        'FILE_EXT': u'.journal',
+        # fsync every FSYNC_RECORDS records or FSYNC_INTERVAL seconds
+        'FSYNC_RECORDS': 256,
+        'FSYNC_INTERVAL': 5.0,
+        # the journal is compacted, on open and save, past COMPACT_RATIO records per live link
+        #   eg. revisits and links found again append records to the same links
+        'COMPACT_RATIO': 2,
+    }, # end journal
     'crawler': {
         # worksheet names and index
         'worksheet': {
@@ -68,6 +215,36 @@ WORKBOOK = {
                 'TITLE': u'Ignored pages',
                 'INDEX': 3
             }, # end ignore pages
+            # conditional GET validators of the crawled pages, see FrontierManager.recrawl
+            #   row: url, title: ETag, date: Last-Modified, notes: sha256 of the body
+            'pagevalidators': {
+                'TITLE': u'Page validators',
+                'INDEX': 4
+            }, # end page validators
+            # SimHash of the crawled pages, see simhash.py
+            #   row: url, title: fingerprint (hex), notes: url of the page it duplicates
+            'pagefingerprints': {
+                'TITLE': u'Page fingerprints',
+                'INDEX': 5
+            }, # end page fingerprints
+            # dead letters: pages failing RETRY MAX_ATTEMPTS times
+            #   row: url, title: last error, notes: attempts
+            'failedpages': {
+                'TITLE': u'Failed pages',
+                'INDEX': 6
+            }, # end failed pages
+            # change history of the crawled pages, see revisit.py
+            #   row: url, title: changes/visits, date: last visit, weight: changes per day, notes: seconds observed
+            'pagerevisits': {
+                'TITLE': u'Page revisits',
+                'INDEX': 7
+            }, # end page revisits
+            # links of the other nodes not forwarded yet, see distributed.py
+            #   row: url, notes: node
+            'linkstoforward': {
+                'TITLE': u'Links to forward',
+                'INDEX': 8
+            }, # end links to forward
 
             'weightedlink': {
                 # WeightedLink fields columns in a Worksheet 
@@ -83,7 +260,106 @@ WORKBOOK = {
     } # end crawler
 } # end workbook
 
+# Revisits of the crawled pages in continuous mode (crawler.py --continuous), see revisit.py
+#   the change rate of a page is estimated from its visits (body hash, 304 Not Modified, Last-Modified),
+#   BUDGET fetches per hour are shared between the pages in proportion to their change rate
+REVISIT = {
+    'BUDGET': 600,
+    # revisits fetched at once after an idle time
+    'BURST': 60,
+    # bounds of the seconds between two visits of a page
+    'MIN_INTERVAL': 300,
+    'MAX_INTERVAL': 30 * 24 * 3600,
+    # change rate prior: PRIOR_CHANGES changes in PRIOR_SECONDS seconds, before the first visits
+    'PRIOR_CHANGES': 0.5,
+    'PRIOR_SECONDS': 24 * 3600,
+} # end revisit
+
+# Frontier backend: storage of the pages to crawl and crawled pages, see backend.py
+#   workbook: in memory, journaled in the Pages to crawl and Crawled pages worksheets
+#   sqlite: in a database next to the workbook, eg. /var/www/html/www.apple.com.sqlite,
+#     the pages to crawl and crawled pages are not kept in memory, the other frontier tables still are
+#   memory: not saved, eg. tests and benchmarks
+#   compare them with: python3 backend.py and python3 crawlbench.py --backend=...
+BACKEND = {
+    'NAME': u'workbook',
+    'SQLITE': {
+        'FILE_EXT': u'.sqlite',
+        # urls per statement of the batched operations, below the sqlite bound parameters limit
+        'BATCH_SIZE': 500,
+        # page cache, negative: KiB
+        'CACHE_SIZE': -65536,
+    },
+} # end backend
+
+# Middleware chain, see middleware.py
+#   names of middleware.MIDDLEWARE_CLASSES or module.Class, their hooks run in this order
+#   a middleware only costs the hooks it implements
+MIDDLEWARES = [u'ignore_paths']
+# Ignore seeds worksheet of a new crawl, paths under the site of the seeds, the ignore_paths middleware may add more
+#   New York Times: other languages, archives and sections not searched
+IGNORE_PATHS = ['/es/', '/fr/', '/ca/', '/newsletters', '/2021/',
+                '/2020/01/', '/2020/02/', '/2020/03/', '/2020/04/', '/2020/05/', '/2020/06/',
+                '/2020/07/', '/2020/08/', '/2020/09/', '/2020/10/',
+                '/2019/', '/2018/', '/2017/', '/2016/', '/2015/', '/2014/',
+                '/section/world', '/video/world', '/section/food', '/section/arts',
+                '/section/sports', '/section/science', '/section/books', '/section/travel',
+                '/section/realestate', '/section/fashion', '/section/technology',
+                '/section/politics', '/section/business', '/section/style', '/section/well',
+                '/section/style/love', '/section/us', '/section/video', '/section/interactive',
+                '/section/magazine', '/international',
+                '/section/t-magazine', '/section/live', '/live', '/video', '/interactive',
+                '/issue/fashion',
+                '/subscription', '/subscriptions',
+                '/section/business/dealbook', '/pages/business/dealbook',
+                '/privacy'
+                ]
+
+# Ignore seeds worksheet: urls starting with IGNORE_REGEXP_PREFIX are regexps
+#   eg. 're:\.pdf$' ignores pdf files, other urls are prefixes to ignore
+IGNORE_REGEXP_PREFIX = u're:'
+
+# Url canonicalisation, see canonical.py
+#   links are canonicalised before the frontier checks them: variants of an url are fetched once
+CANONICAL = {
+    # http and https urls of a seed host are the same pages, fetched with the seed scheme
+    'MERGE_SCHEMES': True,
+    'REMOVE_FRAGMENT': True,
+    # trailing slash of paths other than /: strip, add or keep
+    'TRAILING_SLASH': u'strip',
+    # query parameters kept (fnmatch patterns, lower case), all if empty
+    'QUERY_ALLOW': [],
+    # query parameters removed (fnmatch patterns, lower case): tracking parameters and session ids only,
+    #   other names (eg. action, ref) select content on some sites
+    'QUERY_DENY': ['utm_*', 'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl',
+                   # nytimes share tracking
+                   'smid', 'smtyp',
+                   # session ids
+                   'phpsessid', 'jsessionid', 'aspsessionid*', 'sessionid', 'cfid', 'cftoken'],
+    # sort query parameters by name
+    'SORT_QUERY': True,
+    # memoised canonical urls
+    'CACHE_SIZE': 65536,
+} # end canonical
+
+# Near-duplicate pages, see simhash.py
+#   pages whose text SimHash is at most MAX_DISTANCE bits from an indexed page are not saved nor indexed,
+#   they are linked to that page in the Page fingerprints worksheet
+SIMHASH = {
+    'MAX_DISTANCE': 5,
+    # words per feature
+    'SHINGLE': 3,
+    # pages with less words are not fingerprinted
+    'MIN_WORDS': 50,
+} # end simhash
+
+# Links weight/priority, highest weights are crawled first
 DEFAULT_WEIGHT = 0.1
+# seeds are crawled first
+SEED_WEIGHT = 1.0
+# weight added to a link to crawl each time it is found in another page
+#   section pages linked from every page get crawled before articles
+INLINK_WEIGHT = 0.1
 
         
 def main(argv=None):
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+u"""SimHash
+
+64-bit SimHash fingerprints of page texts and a banded index of them
+Near-duplicate pages (print variants, section pages differing by one teaser)
+have fingerprints a few bits apart
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 simhash.py [file.html ...]
+
+Examples:
+  python3 simhash.py /tmp/pages/*.html
+  prints the fingerprint of every page and the near-duplicates found
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/10/01 09:30:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import re
+import hashlib
+
+from settings import SIMHASH
+
+FINGERPRINT_BITS = 64
+WORD_RE = re.compile(r'\w+')
+
+def feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def simhash(text, shingle=SIMHASH['SHINGLE'], min_words=SIMHASH['MIN_WORDS']):
+    """
+    Return the 64-bit SimHash of text, 0 if text has less than min_words words
+
+    Features are the shingles of shingle words, lower case
+    """
+    words = WORD_RE.findall(text.lower())
+    if len(words) < max(min_words, 1):
+        return 0
+    shingle = min(shingle, len(words))
+    # bit counts per byte: features are counted per byte value, bits are summed once at the end
+    byte_counts = [[0] * 256 for i in range(FINGERPRINT_BITS // 8)]
+    n_features = 0
+    for i in range(len(words) - shingle + 1):
+        for j, byte in enumerate(feature_hash(u' '.join(words[i:i + shingle])).to_bytes(8, 'little')):
+            byte_counts[j][byte] += 1
+        n_features += 1
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        counts = byte_counts[bit >> 3]
+        mask = 1 << (bit & 7)
+        if 2 * sum(count for byte, count in enumerate(counts) if byte & mask) > n_features:
+            fingerprint |= 1 << bit
+    return fingerprint or 1
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+class SimHashIndex():
+    """
+    SimHash Index
+
+    Fingerprints are split in max_distance + 1 bands: two fingerprints at most max_distance bits apart
+    have at least one identical band, only the fingerprints sharing a band with a lookup are compared
+    Life Cycle: see main
+    """
+    max_distance = SIMHASH['MAX_DISTANCE']
+    # band widths in bits
+    bands = []
+    # one table per band: {band value: {url: fingerprint}}
+    tables = None
+    # {url: fingerprint}
+    fingerprints = None
+
+    def __init__(self, max_distance=SIMHASH['MAX_DISTANCE']):
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        self.bands = [FINGERPRINT_BITS // n_bands + (1 if i < FINGERPRINT_BITS % n_bands else 0) for i in range(n_bands)]
+        self.tables = [{} for band in self.bands]
+        self.fingerprints = {}
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, url):
+        return url in self.fingerprints
+
+    def band_values(self, fingerprint):
+        shift = 0
+        for width in self.bands:
+            yield (fingerprint >> shift) & ((1 << width) - 1)
+            shift += width
+
+    def add(self, url, fingerprint):
+        """
+        Add or replace the fingerprint of url
+        """
+        self.remove(url)
+        self.fingerprints[url] = fingerprint
+        for table, value in zip(self.tables, self.band_values(fingerprint)):
+            table.setdefault(value, {})[url] = fingerprint
+
+    def remove(self, url):
+        fingerprint = self.fingerprints.pop(url, None)
+        if fingerprint is None:
+            return
+        for table, value in zip(self.tables, self.band_values(fingerprint)):
+            bucket = table[value]
+            del bucket[url]
+            if not bucket:
+                del table[value]
+
+    def find(self, fingerprint, exclude=None):
+        """
+        Return (url, distance) of the nearest fingerprint at most max_distance bits apart, None if none
+
+        exclude: url not returned, eg. the url of the page looked up
+        """
+        nearest = None
+        for table, value in zip(self.tables, self.band_values(fingerprint)):
+            for url, other in table.get(value, {}).items():
+                if url == exclude:
+                    continue
+                distance = hamming_distance(fingerprint, other)
+                if distance <= self.max_distance and (nearest is None or distance < nearest[1]):
+                    nearest = (url, distance)
+        return nearest
+
+if __name__ == "__main__":
+    import sys
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+
+    from document import open_document
+    index = SimHashIndex()
+    for file_name in sys.argv[1:]:
+        with open(file_name, 'rb') as f:
+            fingerprint = simhash(open_document(f.read()).text)
+        nearest = index.find(fingerprint) if fingerprint else None
+        print(file_name, '%016x' % fingerprint, 'duplicate of %s (%d bits)' % nearest if nearest else '')
+        if fingerprint and not nearest:
+            index.add(file_name, fingerprint)
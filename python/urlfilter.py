@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+u"""Url Filter
+
+Compiled url filter: prefix trie and combined regular expression
+Used for the ignore seeds
+Life Cycle: see main
+"""
+
+__usage__ = u"""Usage: python3 urlfilter.py
+
+Examples:
+  python3 urlfilter.py
+"""
+
+__author__ = u"M0t13y"
+__version__ = u"$Revision: 0.01 $"
+__date__ = u"$Date: 2021/05/01 11:45:00 $"
+__copyright__ = u"Copyright [" + __author__ + "]"
+__license__ = u"Licensed under the Apache License, Version 2.0"
+
+import re
+
+from settings import IGNORE_REGEXP_PREFIX
+
+class PrefixTrie():
+    """
+    Prefix Trie
+
+    match(url) returns the first (shortest) prefix of url, in O(len(url))
+    Life Cycle: see main
+    """
+    # node: {char: node}, a node ending a prefix stores it under the None key
+    root = None
+    size = 0
+
+    def __init__(self, prefixes=[]):
+        self.root = {}
+        self.size = 0
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if None not in node:
+            node[None] = prefix
+            self.size += 1
+
+    def match(self, url):
+        """
+        Return the first prefix of url, None if none matches
+        """
+        node = self.root
+        for char in url:
+            node = node.get(char)
+            if node is None:
+                return None
+            prefix = node.get(None)
+            if prefix is not None:
+                return prefix
+        return None
+
+class UrlFilter():
+    """
+    Url Filter
+
+    A url matches if it starts with one of the prefixes or if one of the regexps is found in it
+    Life Cycle: see main
+    """
+    prefixes = None
+    regexps = []
+    # all regexps compiled in one alternation
+    regexp = None
+
+    def __init__(self, prefixes=[], regexps=[]):
+        self.prefixes = PrefixTrie(prefixes)
+        self.regexps = list(regexps)
+        self.regexp = None
+        if self.regexps:
+            self.regexp = re.compile('|'.join('(?:' + regexp + ')' for regexp in self.regexps))
+
+    @staticmethod
+    def from_weighted_links(weighted_links):
+        """
+        Return a Url Filter from weighted links, eg. the Ignore seeds worksheet
+
+        Urls starting with IGNORE_REGEXP_PREFIX are regexps, eg. 're:/20(19|20)/.*\\.pdf$'
+        other urls are prefixes
+        """
+        prefixes = []
+        regexps = []
+        for wl in weighted_links:
+            if not wl.url:
+                continue
+            if wl.url.startswith(IGNORE_REGEXP_PREFIX):
+                regexps.append(wl.url[len(IGNORE_REGEXP_PREFIX):])
+            else:
+                prefixes.append(wl.url)
+        return UrlFilter(prefixes, regexps)
+
+    def __len__(self):
+        return len(self.prefixes) + len(self.regexps)
+
+    def match(self, url):
+        """
+        Return the matching prefix or regexp (prefixed with IGNORE_REGEXP_PREFIX), None if url does not match
+        """
+        prefix = self.prefixes.match(url)
+        if prefix is not None:
+            return prefix
+        if self.regexp is not None and self.regexp.search(url):
+            return next(IGNORE_REGEXP_PREFIX + regexp for regexp in self.regexps if re.search(regexp, url))
+        return None
+
+if __name__ == "__main__":
+    print("\n" + __doc__ + "\n" + __copyright__ + "\n" + __license__ +"\n" )
+
+    url_filter = UrlFilter(['https://apple.com/es/', 'https://apple.com/section/world'], [r'\.pdf$', r'/20(19|20)/'])
+    for url in ['https://apple.com/', 'https://apple.com/es/news', 'https://apple.com/section/worldwide',
+                'https://apple.com/doc.pdf', 'https://apple.com/2020/01/news', 'https://apple.com/2021/01/news']:
+        print(url, url_filter.match(url))
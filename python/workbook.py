@@ -2,6 +2,8 @@
 
 u"""Workbook load/save the Crawler state
 
+The live state is kept in an append-only journal (see journal.py)
+The .xlsx workbook is imported on first open and exported on demand
 Life cycle: see main
 """
 
@@ -11,10 +13,12 @@ Options:
   -u ..., --url=...       Website URL to crawl
   -h, --help              show this help
   -p, --path              www path where files were stored eg. /var/www
+  -x, --export            export the crawler state to the .xlsx workbook
   -d                      show debugging information
 
 Examples:
   python3 workbook.py --url='https://www.nytimes3xbfgragh.onion/' --path='/var/www'
+  python3 workbook.py --url='https://www.nytimes3xbfgragh.onion/' --path='/var/www' --export
 """
 
 __author__ = u"M0t13y"
@@ -37,30 +41,48 @@ from datetime import datetime
 from settings import WORKBOOK, HTML_SUBDIR
 
 from link import WeightedLink
+from journal import CrawlJournal
+from metrics import STAGE_SECONDS
 
 class CrawlWorkbook():
     """
     Crawl Workbook class
     
     Save/Load progress of a crawl frontier
+    Changes are appended to a journal, the .xlsx workbook is only written by wb_export
     Life cycle: see main
     """
     file_name = u''
+    journal_name = u''
     html_pages_path = u''
-    # workbook
+    # workbook, only used to import/export the .xlsx file
     wb = None
+    # live crawler state
+    journal = None
+    # {worksheet_name: {url: WeightedLink}}
+    sheets = None
+    # crawler worksheets, see settings WORKBOOK
+    worksheets = ['crawledpages', 'tocrawlpages', 'ignoreseeds', 'ignoredpages', 'pagevalidators', 'pagefingerprints', 'failedpages',
+                  'pagerevisits', 'linkstoforward']
 
     weighted_links = set()
     weighted_links_done = []
     ignore_seeds = []
     ignored_pages = []
+    page_validators = []
+    page_fingerprints = []
+    failed_pages = []
+    page_revisits = []
+    links_to_forward = []
     
     def __init__(self, path='/var/www', url='http://localhost'):
       """
       Init with file_name
       """
       self.file_name = CrawlWorkbook.wb_filename(path, url)
+      self.journal_name = CrawlWorkbook.wb_journal_name(path, url)
       self.html_pages_path = CrawlWorkbook.wb_html_pages_path(path, url)
+      self.journal = CrawlJournal(self.journal_name)
 
     def __unicode__(self):
         return self.file_name
@@ -78,6 +100,14 @@ class CrawlWorkbook():
         file_name = os.path.join(html_path, urlsplit(url).netloc) + WORKBOOK['FILE_EXT']
         return file_name
 
+    @staticmethod
+    def wb_journal_name(path='/var/www', url='http://localhost'):
+        """
+        Return the journal file name from www path and url
+        """
+        # /var/www/html/localhost.journal
+        return os.path.splitext(CrawlWorkbook.wb_filename(path, url))[0] + WORKBOOK['JOURNAL']['FILE_EXT']
+
     @staticmethod  
     def wb_html_pages_path(path='/var/www', url='http://localhost'):
         """
@@ -138,29 +168,63 @@ class CrawlWorkbook():
 
     def wb_open(self):
         """
-        Load or create a workbook if it does not exist
-        
-        Return [weighted_links_done, weighted_links]
-        """
-        try:
-            # open if already exist
-            self.wb = openpyxl.load_workbook(self.file_name)
-            
-            self.weighted_links_done = self.ws_load_weighted_links(self.wb[WORKBOOK['crawler']['worksheet']['crawledpages']['TITLE']])
-            self.weighted_links = self.ws_load_weighted_links(self.wb[WORKBOOK['crawler']['worksheet']['tocrawlpages']['TITLE']])
-            self.ignore_seeds = self.ws_load_weighted_links(self.wb[WORKBOOK['crawler']['worksheet']['ignoreseeds']['TITLE']])
-            self.ignored_pages = self.ws_load_weighted_links(self.wb[WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE']])
+        Load the crawler state from the journal
+
+        On first open, the .xlsx workbook is imported if it exists
+        """
+        if self.journal.exists():
+            self.sheets = self.journal.replay()
             print('--- open ---')
-            print(self.file_name)
-            print('crawled pages:', len(self.weighted_links_done))
-            print('to crawl pages:', len(self.weighted_links))
-            print('ignore seeds:', len(self.ignore_seeds))
-            print('ignored pages:', len(self.ignored_pages))
-            print('--- loaded ---')
-        except IOError:
-            # create
-            self.wb_create()
-            return None
+            print(self.journal_name)
+        else:
+            self.sheets = {}
+            try:
+                # import if already exist
+                self.wb = openpyxl.load_workbook(self.file_name)
+                print('--- import ---')
+                print(self.file_name)
+                for wsname in self.worksheets:
+                    worksheet_name = WORKBOOK['crawler']['worksheet'][wsname]['TITLE']
+                    if worksheet_name in self.wb:
+                        links = self.ws_load_weighted_links(self.wb[worksheet_name])
+                        self.sheets[worksheet_name] = {wl.url: wl for wl in links if wl.url}
+                self.wb = None
+            except IOError:
+                print('--- create ---')
+                print(self.journal_name)
+        for wsname in self.worksheets:
+            self.sheets.setdefault(WORKBOOK['crawler']['worksheet'][wsname]['TITLE'], {})
+
+        # snapshot the state when the journal is new or mostly made of outdated records
+        if not self.journal.exists() or self.journal_outdated():
+            self.journal.compact(self.sheets)
+        self.journal.open()
+
+        self.weighted_links_done = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['crawledpages']['TITLE'])
+        self.weighted_links = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['tocrawlpages']['TITLE'])
+        self.ignore_seeds = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['ignoreseeds']['TITLE'])
+        self.ignored_pages = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE'])
+        self.page_validators = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['pagevalidators']['TITLE'])
+        self.page_fingerprints = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['pagefingerprints']['TITLE'])
+        self.failed_pages = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['failedpages']['TITLE'])
+        self.page_revisits = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['pagerevisits']['TITLE'])
+        self.links_to_forward = self.ws_weighted_links(WORKBOOK['crawler']['worksheet']['linkstoforward']['TITLE'])
+        print('crawled pages:', len(self.weighted_links_done))
+        print('to crawl pages:', len(self.weighted_links))
+        print('ignore seeds:', len(self.ignore_seeds))
+        print('ignored pages:', len(self.ignored_pages))
+        print('page validators:', len(self.page_validators))
+        print('page fingerprints:', len(self.page_fingerprints))
+        print('failed pages:', len(self.failed_pages))
+        print('page revisits:', len(self.page_revisits))
+        print('links to forward:', len(self.links_to_forward))
+        print('--- loaded ---')
+
+    def ws_weighted_links(self, worksheet_name):
+        """
+        Return the weighted links of a worksheet
+        """
+        return list(self.sheets.get(worksheet_name, {}).values())
 
     def ws_fill_empty(self, ws):
         """
@@ -199,33 +263,35 @@ class CrawlWorkbook():
     
     def wb_create(self):
         """
-        Create a workbook
+        Create an empty workbook with the crawler worksheets
+
+        Does not save the workbook
         """
         self.wb = openpyxl.Workbook()
-        print('--- create ---')
-        print(self.file_name)
-        for wsname in ['crawledpages', 'tocrawlpages', 'ignoreseeds', 'ignoredpages']:
-            print(WORKBOOK['crawler']['worksheet'][wsname]['TITLE'])
+        for wsname in self.worksheets:
             self.ws_init(WORKBOOK['crawler']['worksheet'][wsname]['TITLE'],
                          -1)
                         #WORKBOOK['crawler']['worksheet'][wsname]['INDEX'])
-    
-        self.wb_save() 
-        print('--- save ---')
 
     def ws_writeln(self, worksheet_name, weighted_link=WeightedLink('', '', '2020-01-31 00:00:00', 0, '')):
         """
-        Add a line to the workboot worksheet
+        Add or replace a link in a worksheet
         
         Workbook should already be opened
         /!\ Does not save
         """
-       
-        ws = self.wb[worksheet_name]
-        ws.append([ '', weighted_link.url, weighted_link.title,
-                  weighted_link.date,
-                  weighted_link.weight,
-                  weighted_link.notes])
+        self.sheets.setdefault(worksheet_name, {})[weighted_link.url] = weighted_link
+        self.journal.add(worksheet_name, weighted_link)
+
+    def ws_removeln(self, worksheet_name, url):
+        """
+        Remove a link from a worksheet
+
+        Workbook should already be opened
+        /!\ Does not save
+        """
+        if self.sheets.setdefault(worksheet_name, {}).pop(url, None) is not None:
+            self.journal.remove(worksheet_name, url)
 
     def ws_appendrows(self, worksheet_name, weighted_links):
         """
@@ -234,13 +300,8 @@ class CrawlWorkbook():
         Workbook should already be opened
         /! Parameter: link is absolute  eg.: 'https://www.apple.com/section/useless_page'
         """
-
-        ws = self.wb[worksheet_name]
         for weighted_link in weighted_links:
-            ws.append([ '', weighted_link.url, weighted_link.title,
-                  weighted_link.date,
-                  weighted_link.weight,
-                  weighted_link.notes])
+            self.ws_writeln(worksheet_name, weighted_link)
         self.wb_save() 
 
     def ws_writerows(self, worksheet_name, weighted_links):
@@ -250,29 +311,60 @@ class CrawlWorkbook():
         Workbook should already be opened
         /! Parameter: link is absolute  eg.: 'https://www.apple.com/section/useless_page'
         """
-
-        ws = self.wb[worksheet_name]
-
-        row_min = WORKBOOK['crawler']['worksheet']['weightedlink']['STARTING_ROW']
-        row_max = ws.max_row
-        #print(worksheet_name, row_max)
-        #print('row min:', row_min, 'row max', row_max)
-        # Empty sheet first if not empty
-        if row_max > row_min:
-            ws.delete_rows(row_min, row_max)
+        self.sheets[worksheet_name] = {}
+        self.journal.clear(worksheet_name)
         for weighted_link in weighted_links:
-            #print(weighted_link.url)
-            ws.append([ '', weighted_link.url, weighted_link.title,
-                  weighted_link.date,
-                  weighted_link.weight,
-                  weighted_link.notes])
+            self.ws_writeln(worksheet_name, weighted_link)
         self.wb_save() 
 
     def wb_save(self):
         """
-        Save the workbook
+        Save the crawler state
+
+        Flushes the journal, fsyncs in batches
+        Compacts the journal when it is mostly made of outdated records, eg. a continuous crawl
         """    
-        self.wb.save(self.file_name)
+        with STAGE_SECONDS.time(stage='persist'):
+            if self.journal_outdated():
+                self.journal.compact(self.sheets)
+            else:
+                self.journal.sync()
+
+    def journal_outdated(self):
+        """
+        Return True if the journal has more than COMPACT_RATIO records per live link
+        """
+        n_links = sum(len(links) for links in self.sheets.values())
+        return self.journal.n_records > WORKBOOK['JOURNAL']['COMPACT_RATIO'] * n_links + len(self.sheets)
+
+    def wb_close(self):
+        """
+        Save the crawler state and close the journal
+        """
+        self.journal.close()
+
+    def wb_export(self, file_name=None):
+        """
+        Export the crawler state to the .xlsx workbook
+
+        Workbook should already be opened
+        """
+        if file_name is None:
+            file_name = self.file_name
+        self.wb_create()
+        for worksheet_name, links in self.sheets.items():
+            if worksheet_name not in self.wb:
+                self.ws_init(worksheet_name, -1)
+            ws = self.wb[worksheet_name]
+            for weighted_link in links.values():
+                ws.append([ '', weighted_link.url, weighted_link.title,
+                      weighted_link.date,
+                      weighted_link.weight,
+                      weighted_link.notes])
+        self.wb.save(file_name)
+        self.wb = None
+        print('--- export ---')
+        print(file_name)
 
 class Usage(Exception):
     def __init__(self, msg):
@@ -288,11 +380,12 @@ def main(argv=None):
 
     try:
         try:                                
-            opts, args = getopt.getopt(argv, "hup:d", ["help", "url=", "path="])
+            opts, args = getopt.getopt(argv, "hu:p:dx", ["help", "url=", "path=", "export"])
         except getopt.error as msg:
              raise Usage(msg)            
         url = u'http://localhost'
         path = u'/var/www'
+        export = False
         for opt, arg in opts:
             if opt in ("-h", "--help"):
                 print(__usage__)                   
@@ -304,14 +397,16 @@ def main(argv=None):
                 url = arg               
             elif opt in ("-p", "--path"):
                 path = arg               
+            elif opt in ("-x", "--export"):
+                export = True
     except Usage as err:
         print >>sys.stderr, err.msg
         print >>sys.stderr, "for help use --help"
         return 2
 
     if len(argv)<2:
-        print("Arguments error")
-        print(__usage__)
+        print("Arguments error")
+        print(__usage__)
         sys.exit(2)
 
     w_l_00 = WeightedLink(u'https://www.nytimes3xbfgragh.onion/',
@@ -346,6 +441,10 @@ def main(argv=None):
     #print(cwb.file_name)
     #print(cwb.html_pages_path)
     cwb.wb_open()
+    if export:
+        cwb.wb_export()
+        cwb.wb_close()
+        return 0
     print(cwb.weighted_links_done)
     print(cwb.weighted_links)
     print(cwb.ignore_seeds)
@@ -360,6 +459,7 @@ def main(argv=None):
 
     wbwsname = WORKBOOK['crawler']['worksheet']['ignoredpages']['TITLE']
     cwb.ws_writerows(wbwsname, [ w_l_03, w_l_04 ])
+    cwb.wb_close()
                     
 if __name__ == "__main__":
     import sys